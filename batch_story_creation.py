@@ -0,0 +1,126 @@
+import asyncio
+import os
+import logging
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from src.agent import NovelAIAgent
+from src.batch import BatchJob, BatchRunner, load_manifest
+from src.cache import ResponseCache
+from src.routing import ROUTING_MODES, TierRouter
+from story_creation_example import MODEL_CONFIGS, build_provider_pool, load_story_prompt
+
+# 加载.env文件
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description='AI小说批量创作工具')
+    parser.add_argument('manifest', type=str, help='任务清单（JSON），格式见batch_manifest.example.json')
+    parser.add_argument('--output', type=str, default=None,
+                       help='批量输出目录，再次指定同一目录时从各任务的断点继续 (默认output/batch_时间戳)')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='所有任务合计的最大并发调用数 (默认8)')
+    parser.add_argument('--max-concurrency', type=int, default=None,
+                       help='单部小说内同时生成的章节数 (默认与--workers相同)')
+    parser.add_argument('--synopsis-mode', type=str, choices=['sequential', 'parallel', 'chained'],
+                       default='parallel', help='章节梗概生成方式 (默认parallel)')
+    parser.add_argument('--retry-strategy', type=str, choices=['regenerate', 'continue'],
+                       default='continue', help='章节字数不足时的处理方式 (默认continue)')
+    parser.add_argument('--context-mode', type=str, choices=['full', 'compact'], default='full',
+                       help='章节上下文模式')
+    parser.add_argument('--routing', type=str, choices=ROUTING_MODES, default='fixed',
+                       help='模型档位：固定档位(fixed)或先用低档位起草、未通过质量检查再升级(cascade)')
+    parser.add_argument('--routing-stats', type=str, metavar='PATH',
+                       help='cascade模式下各步骤档位通过率的统计文件，跨多次运行持续学习')
+    parser.add_argument('--detect-degeneration', action='store_true',
+                       help='以流式方式生成章节，文本陷入重复或偏离格式时立即中止并保留之前的部分')
+    parser.add_argument('--check-consistency', action='store_true',
+                       help='每完成一章就检查人物名字漂移、已死亡角色再次出场等问题（不额外调用模型）')
+    parser.add_argument('--samples', type=int, default=1,
+                       help='每章同时请求的候选数，大于1时按本地评分（字数、重复、梗概覆盖、格式）选出最好的一份')
+    parser.add_argument('--sample-tier', type=str, choices=['simple', 'medium', 'complex'], default=None,
+                       help='第一轮候选使用的档位（如simple），不合格重试时恢复原档位')
+    parser.add_argument('--accept-score', type=float, default=0.8,
+                       help='候选通过字数检查且评分达到该值时立即采用，并取消其余候选、停止其生成 (默认0.8)')
+    parser.add_argument('--outline-shape', type=str, metavar='VxAxC',
+                       help='长篇连载的分层大纲：卷数x每卷篇数x每篇章数（如10x5x10共500章），按需逐篇展开梗概')
+    parser.add_argument('--max-chapters', type=int, default=None,
+                       help='分层大纲模式下本次写到第几章，调高后用--resume续写')
+    parser.add_argument('--outline-lookahead', type=int, default=1,
+                       help='分层大纲模式下梗概最多领先正文的篇数 (默认1)')
+    parser.add_argument('--report-interval', type=float, default=30.0,
+                       help='进度日志的输出间隔（秒）')
+    parser.add_argument('--cache-dir', type=str, default=os.getenv("CACHE_DIR"),
+                       help='响应缓存目录 (默认不启用)')
+    parser.add_argument('--container', action='store_true',
+                       help='同时把每部小说写入单文件容器novel.nvl（带章节索引，可按章随机读取）')
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest, load_story_prompt)
+    for model_type in {job.model_type for job in jobs}:
+        config = MODEL_CONFIGS.get(model_type)
+        if not config:
+            raise ValueError(f"不支持的模型类型: {model_type}，请选择 'puyu'、'glm' 或 'mock'")
+        if not config["api_key"]:
+            raise ValueError(f"请在.env文件中设置{model_type.upper()}_API_KEY")
+
+    cache = ResponseCache(args.cache_dir) if args.cache_dir else None
+    max_concurrency = args.max_concurrency or args.workers
+    # 同一提供方的所有任务共用一个连接池：复用保持的连接，各密钥的RPM/TPM限额也在任务间共享
+    pools = {model_type: build_provider_pool(model_type) for model_type in {job.model_type for job in jobs}}
+    # 所有任务共用一个档位路由器，前面任务的升级情况直接用于后面的任务
+    router = TierRouter(path=args.routing_stats) if args.routing == "cascade" else None
+
+    def create_job_agent(job: BatchJob, **shared) -> NovelAIAgent:
+        # 每个任务独立的代理实例，连接池、限流器和并发名额在任务间共享
+        config = MODEL_CONFIGS[job.model_type]
+        return NovelAIAgent(
+            api_key=config["api_key"],
+            provider_pool=pools[job.model_type],
+            max_concurrency=max_concurrency,
+            synopsis_mode=args.synopsis_mode,
+            cache=cache,
+            retry_strategy=args.retry_strategy,
+            context_mode=args.context_mode,
+            router=router,
+            detect_degeneration=args.detect_degeneration,
+            check_consistency=args.check_consistency,
+            samples=args.samples,
+            sample_tier=args.sample_tier,
+            accept_score=args.accept_score,
+            outline_shape=args.outline_shape,
+            max_chapters=args.max_chapters,
+            outline_lookahead=args.outline_lookahead,
+            **shared
+        )
+
+    output_base = args.output or os.path.join("output", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    runner = BatchRunner(
+        jobs, create_job_agent, output_base,
+        workers=args.workers,
+        report_interval=args.report_interval,
+        container=args.container
+    )
+
+    # 在Windows系统上运行异步代码
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    async def run_batch():
+        try:
+            return await runner.run()
+        finally:
+            await asyncio.gather(*(pool.close() for pool in pools.values()))
+
+    summary = asyncio.run(run_batch())
+    logger.info(f"批量创作结束：完成{summary['done']}部，失败{summary['failed']}部，"
+                f"吞吐量{summary['chapters_per_hour']}章/小时，报告：{os.path.join(output_base, 'batch_report.json')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+测试批量创作在不同共享并发名额下的吞吐量（章/小时）
+
+用法：
+    python -m benchmarks.bench_batch --jobs 6 --workers 1 4 16 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+
+from benchmarks.mock_server import MockLLMServer
+from src.agent import NovelAIAgent
+from src.batch import BatchJob, BatchRunner
+
+BENCH_PROMPT = "请创作一个修仙题材的小说。"
+
+
+async def run_batch(base_url: str, jobs: int, workers: int) -> dict:
+    batch = [BatchJob(job_id=f"{n:03d}_puyu_bench", model_type="puyu", genre="修仙", prompt=BENCH_PROMPT)
+             for n in range(1, jobs + 1)]
+
+    def factory(job: BatchJob, **shared) -> NovelAIAgent:
+        return NovelAIAgent(api_key="mock-key", base_url=base_url, model_type="puyu",
+                            max_concurrency=workers, synopsis_mode="parallel", **shared)
+
+    with tempfile.TemporaryDirectory() as output_base:
+        runner = BatchRunner(batch, factory, output_base, workers=workers, report_interval=3600)
+        return await runner.run()
+
+
+async def main(latency: float, jobs: int, levels: list):
+    server = MockLLMServer(latency=latency)
+    await server.start()
+    try:
+        print(f"模拟接口延迟：{latency:.3f}s，任务数：{jobs}")
+        print(f"{'并发名额':>8} {'总耗时(s)':>10} {'章节':>6} {'章/小时':>12} {'失败':>4}")
+        for workers in levels:
+            summary = await run_batch(server.base_url, jobs, workers)
+            print(f"{workers:>8} {summary['elapsed']:>10.2f} {summary['chapters_generated']:>6} "
+                  f"{summary['chapters_per_hour']:>12.0f} {summary['failed']:>4}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量创作吞吐量基准测试")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟接口的单次延迟（秒）")
+    parser.add_argument("--jobs", type=int, default=4, help="批量任务数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16],
+                        help="需要测试的共享并发名额")
+    args = parser.parse_args()
+
+    # 基准测试只保留警告以上输出
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(args.latency, args.jobs, args.workers))
@@ -0,0 +1,68 @@
+"""
+测试N个create_story并发运行时的总耗时
+
+用法：
+    python -m benchmarks.bench_concurrent_stories --latency 0.05 --concurrency 1 2 4 8
+    python -m benchmarks.bench_concurrent_stories --concurrency 1 --max-concurrency 1 5 10
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from benchmarks.mock_server import MockLLMServer
+from src.agent import NovelAIAgent
+
+BENCH_PROMPT = "请创作一个修仙题材的小说。"
+
+
+async def run_stories(base_url: str, count: int, max_concurrency: int = 1,
+                      synopsis_mode: str = "sequential") -> float:
+    """并发运行count个故事创作任务，返回总耗时（秒）"""
+    # current_story是实例级状态，每个任务使用独立的agent
+    agents = [
+        NovelAIAgent(api_key="mock-key", base_url=base_url, model_type="puyu",
+                     max_concurrency=max_concurrency, synopsis_mode=synopsis_mode)
+        for _ in range(count)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(agent.create_story(BENCH_PROMPT) for agent in agents))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(agent.close() for agent in agents))
+    return elapsed
+
+
+async def main(latency: float, levels: list, chapter_levels: list, synopsis_mode: str):
+    server = MockLLMServer(latency=latency)
+    await server.start()
+    try:
+        print(f"模拟接口延迟：{latency:.3f}s，梗概模式：{synopsis_mode}")
+        print(f"{'并发数':>6} {'章节并发':>8} {'总耗时(s)':>10} {'请求数':>8} {'相对首项':>8}")
+        baseline = None
+        for count in levels:
+            for max_concurrency in chapter_levels:
+                before = server.request_count
+                elapsed = await run_stories(server.base_url, count, max_concurrency, synopsis_mode)
+                baseline = baseline or elapsed
+                requests = server.request_count - before
+                print(f"{count:>6} {max_concurrency:>8} {elapsed:>10.2f} {requests:>8} "
+                      f"{elapsed / baseline:>8.2f}x")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发创作基准测试")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟接口的单次延迟（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="需要测试的并发故事数")
+    parser.add_argument("--max-concurrency", type=int, nargs="+", default=[1],
+                        help="每个故事内同时生成的章节数")
+    parser.add_argument("--synopsis-mode", choices=["sequential", "parallel", "chained"],
+                        default="sequential", help="章节梗概生成方式")
+    args = parser.parse_args()
+
+    # 基准测试只保留警告以上输出
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(args.latency, args.concurrency, args.max_concurrency, args.synopsis_mode))
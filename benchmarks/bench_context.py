@@ -0,0 +1,52 @@
+"""
+比较完整上下文与精简上下文下每章的输入token数
+
+用法：
+    python -m benchmarks.bench_context --budget 800 1500
+"""
+
+import argparse
+import asyncio
+import logging
+
+from benchmarks.mock_server import MockLLMServer
+from src.agent import NovelAIAgent
+from src.metrics import MemorySink, MetricsRecorder
+
+BENCH_PROMPT = "请创作一个修仙题材的小说。"
+
+
+async def chapter_prompt_tokens(base_url: str, context_mode: str, budget: int) -> float:
+    """运行一次完整创作，返回章节步骤平均每次调用的输入token数"""
+    sink = MemorySink()
+    agent = NovelAIAgent(api_key="mock-key", base_url=base_url, model_type="puyu",
+                         max_concurrency=10, context_mode=context_mode, context_budget=budget,
+                         metrics=MetricsRecorder([sink]))
+    await agent.create_story(BENCH_PROMPT)
+    await agent.close()
+    records = [r for r in sink.records if r.stage == "chapters"]
+    return sum(r.prompt_tokens for r in records) / len(records)
+
+
+async def main(budgets: list):
+    server = MockLLMServer(latency=0.0)
+    await server.start()
+    try:
+        full = await chapter_prompt_tokens(server.base_url, "full", 0)
+        print(f"{'模式':<16} {'每章输入token':>14} {'相对完整':>8}")
+        print(f"{'full':<16} {full:>14.0f} {1:>8.2f}")
+        for budget in budgets:
+            compact = await chapter_prompt_tokens(server.base_url, "compact", budget)
+            print(f"{f'compact({budget})':<16} {compact:>14.0f} {compact / full:>8.2f}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="章节上下文token对比")
+    parser.add_argument("--budget", type=int, nargs="+", default=[800, 1500],
+                        help="compact模式的上下文token预算")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(args.budget))
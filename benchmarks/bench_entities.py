@@ -0,0 +1,93 @@
+"""
+人物/地点索引与一致性检查的吞吐量测试：合成数千章正文，注入名字漂移与死者复现，
+统计建立索引的耗时、每章增量耗时以及检出情况
+
+用法：
+    python -m benchmarks.bench_entities --chapters 2000 --chapter-chars 3000
+"""
+
+import argparse
+import random
+import time
+
+from src.entities import EntityIndex
+from src.mock_provider import MOCK_NAMES, MOCK_WORDS, _mock_characters, _mock_setting
+
+PLACES = ["青云宗", "天剑城", "血魔谷", "东荒古域", "万妖山", "北冥海", "皇都", "落日沙漠"]
+
+
+def synthesize_chapter(rng: random.Random, chars: int, name_ratio: float, names: list) -> str:
+    """由模拟词汇拼成的正文，按比例穿插人物对白和地名"""
+    parts = []
+    length = 0
+    while length < chars:
+        roll = rng.random()
+        if roll < name_ratio:
+            part = rng.choice(names) + "说道"
+        elif roll < name_ratio * 1.5:
+            part = rng.choice(PLACES)
+        else:
+            part = rng.choice(MOCK_WORDS)
+        if rng.random() < 0.1:
+            part += "。"
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def main(chapters: int, chapter_chars: int, name_ratio: float, seed: int):
+    rng = random.Random(seed)
+    # 注入的问题：中间某章一个配角战死，之后只在两章中再次出场；主角的名字在两章中被写错
+    victim = MOCK_NAMES[7]
+    death = chapters // 2
+    survivors = [name for name in MOCK_NAMES if name != victim]
+    texts = [synthesize_chapter(rng, chapter_chars, name_ratio, MOCK_NAMES if n <= death else survivors)
+             for n in range(1, chapters + 1)]
+    protagonist = MOCK_NAMES[0]
+    typo = protagonist[0] + "芸"
+    texts[death - 1] += f"一场大战，{victim}战死在血魔谷。"
+    for n in (death + 3, death + 10):
+        if n <= chapters:
+            texts[n - 1] += f"{victim}站在天剑城头。"
+    for n in (5, chapters - 1):
+        texts[n - 1] += f"{typo}说道：走吧。"
+
+    started = time.perf_counter()
+    index = EntityIndex.from_story(_mock_characters(), _mock_setting())
+    build = time.perf_counter() - started
+
+    # 章节乱序加入，模拟并发生成
+    order = list(range(1, chapters + 1))
+    rng.shuffle(order)
+    timings = []
+    for n in order:
+        started = time.perf_counter()
+        index.add_chapter(n, texts[n - 1])
+        timings.append(time.perf_counter() - started)
+    total = sum(timings)
+    chars = sum(len(text) for text in texts)
+
+    started = time.perf_counter()
+    issues = index.issues()
+    check = time.perf_counter() - started
+    mentions = sum(len(offsets) for chapters in index.postings.values() for offsets in chapters.values())
+
+    timings.sort()
+    print(f"实体：{len(index.character_names)}个角色，{len(index.entities) - len(index.character_names)}个地点，"
+          f"自动机构建{build * 1000:.1f}ms")
+    print(f"章节：{chapters}章，共{chars}字，出现位置{mentions}处")
+    print(f"建立索引：总计{total * 1000:.0f}ms，吞吐量{chars / total / 1e6:.1f}M字/秒，"
+          f"每章中位数{timings[len(timings) // 2] * 1000:.2f}ms，最慢{timings[-1] * 1000:.2f}ms")
+    print(f"全量检查：{check * 1000:.1f}ms，发现{len(issues)}处问题")
+    for issue in issues:
+        print(f"  第{issue.chapter}章 {issue.kind}：{issue.detail}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="人物/地点索引吞吐量测试")
+    parser.add_argument("--chapters", type=int, default=2000, help="合成的章节数")
+    parser.add_argument("--chapter-chars", type=int, default=3000, help="每章字数")
+    parser.add_argument("--name-ratio", type=float, default=0.03, help="正文片段中人物对白的比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+    main(args.chapters, args.chapter_chars, args.name_ratio, args.seed)
@@ -0,0 +1,71 @@
+"""
+分层大纲的规划开销：全书形状固定（默认10卷×5篇×10章，共500章），改变本次写到的章节数，
+统计规划（卷、篇、章节梗概）的调用次数、输出token以及第一章正文开始生成前的等待时间
+
+规划开销应与写到的章节数成正比，与全书的总长度无关；第一章不等待后面的篇展开。
+
+用法：
+    python -m benchmarks.bench_outline --max-chapters 10 50 100 --shape 10x5x10
+    python -m benchmarks.bench_outline --max-chapters 50 --lookahead 0 1 3 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from benchmarks.bench_suite import BENCH_PROMPT
+from src.agent import NovelAIAgent
+from src.metrics import MemorySink, MetricsRecorder
+
+
+async def run_once(shape: str, max_chapters: int, lookahead: int, mock_options: Dict,
+                   max_concurrency: int) -> Dict:
+    sink = MemorySink()
+    agent = NovelAIAgent(api_key="mock", model_type="mock", max_concurrency=max_concurrency,
+                         metrics=MetricsRecorder([sink]), mock_options=mock_options,
+                         outline_shape=shape, max_chapters=max_chapters, outline_lookahead=lookahead)
+    start = time.perf_counter()
+    await agent.create_story(BENCH_PROMPT)
+    elapsed = time.perf_counter() - start
+    await agent.close()
+
+    planning = [record for record in sink.records if record.stage == "synopses"]
+    chapters = [record for record in sink.records if record.stage == "chapters"]
+    return {
+        "elapsed": elapsed,
+        "planning_calls": len(planning),
+        "planning_tokens": sum(record.completion_tokens for record in planning),
+        "chapters": len(agent.current_story["content"]),
+        # 第一次章节调用开始时，距第一次规划调用开始的时间
+        "first_chapter": min(r.timestamp for r in chapters) - min(r.timestamp for r in planning),
+        "arcs": len(agent.outline_tree.chapters)
+    }
+
+
+async def main(args):
+    mock_options = {"latency": args.latency, "tokens_per_second": args.tokens_per_second, "seed": args.seed}
+    print(f"大纲形状{args.shape}，首字延迟{args.latency}s，生成速度{args.tokens_per_second}tok/s")
+    print(f"{'写到章节':>8} {'领先篇数':>8} {'展开篇数':>8} {'规划调用':>8} {'规划输出tok':>11} "
+          f"{'首章等待(s)':>11} {'总耗时(s)':>9}")
+    for max_chapters in args.max_chapters:
+        for lookahead in args.lookahead:
+            r = await run_once(args.shape, max_chapters, lookahead, mock_options, args.max_concurrency)
+            print(f"{r['chapters']:>8} {lookahead:>8} {r['arcs']:>8} {r['planning_calls']:>8} "
+                  f"{r['planning_tokens']:>11} {r['first_chapter']:>11.2f} {r['elapsed']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分层大纲规划开销随写到章节数的变化")
+    parser.add_argument("--shape", type=str, default="10x5x10", help="大纲形状：卷数x每卷篇数x每篇章数")
+    parser.add_argument("--max-chapters", type=int, nargs="+", default=[10, 50, 100], help="本次写到的章节数")
+    parser.add_argument("--lookahead", type=int, nargs="+", default=[1], help="梗概最多领先正文的篇数")
+    parser.add_argument("--latency", type=float, default=0.05, help="首字延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=20000, help="生成速度")
+    parser.add_argument("--max-concurrency", type=int, default=10, help="同时生成的章节数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(args))
@@ -0,0 +1,80 @@
+"""
+测量命令行脚本和批量任务进程的启动耗时，以及启动时是否加载了未选用的提供方SDK
+
+每个场景在新的子进程中运行多次，取耗时中位数；--max-ms指定上限时超出即以非零状态退出，可用于CI检查
+（选用真实提供方的场景包含SDK本身的导入耗时，不参与检查）。
+
+用法：
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --max-ms 300
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各提供方SDK的顶层模块
+SDK_MODULES = ("openai", "zhipuai", "httpx")
+
+# 子进程中执行的代码：完成启动后输出已加载的SDK模块
+_REPORT_SDKS = f"import sys, json; print(json.dumps([m for m in {SDK_MODULES!r} if m in sys.modules]))"
+
+SCENARIOS = {
+    # 导入核心模块
+    "import_agent": "import src.agent\n" + _REPORT_SDKS,
+    # 命令行脚本解析参数之前的全部导入
+    "cli_import": "import story_creation_example\n" + _REPORT_SDKS,
+    "batch_cli_import": "import batch_story_creation\n" + _REPORT_SDKS,
+    # 批量任务进程：创建离线提供方的代理（不应加载openai/zhipuai）
+    "mock_worker": ("from src.agent import NovelAIAgent\n"
+                    "NovelAIAgent(api_key='mock', model_type='mock')\n" + _REPORT_SDKS),
+    # 选用OpenAI兼容提供方时才加载对应SDK，仅供对比
+    "puyu_worker": ("from src.agent import NovelAIAgent\n"
+                    "NovelAIAgent(api_key='key', base_url='http://127.0.0.1:9', model_type='puyu')\n"
+                    + _REPORT_SDKS),
+}
+
+# 不参与--max-ms检查的场景
+UNCHECKED = {"puyu_worker"}
+
+
+def run_scenario(code: str, runs: int) -> dict:
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "sdks": loaded}
+
+
+def main(runs: int, max_ms: float = None) -> int:
+    baseline = run_scenario(_REPORT_SDKS, runs)["median_ms"]
+    print(f"空解释器启动：{baseline:.0f}ms（以下耗时均包含此部分）")
+    print(f"{'场景':<18} {'中位数(ms)':>10} {'最小(ms)':>9}  已加载的SDK")
+    slow = []
+    for name, code in SCENARIOS.items():
+        result = run_scenario(code, runs)
+        print(f"{name:<18} {result['median_ms']:>10.0f} {result['min_ms']:>9.0f}  "
+              f"{', '.join(result['sdks']) or '-'}")
+        if max_ms is not None and name not in UNCHECKED and result["median_ms"] > max_ms:
+            slow.append(name)
+    if slow:
+        print(f"\n启动耗时超过{max_ms:.0f}ms：{', '.join(slow)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="每个场景运行的次数")
+    parser.add_argument("--max-ms", type=float, default=None, help="启动耗时中位数的上限（毫秒）")
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.max_ms))
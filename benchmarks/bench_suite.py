@@ -0,0 +1,203 @@
+"""
+端到端基准测试：使用进程内的mock提供方完整运行50章的create_story，
+统计不同并发设置下各步骤的实际耗时、调用次数和token用量
+
+用法：
+    python -m benchmarks.bench_suite --max-concurrency 1 5 10 --synopsis-mode sequential parallel
+    python -m benchmarks.bench_suite --latency 0.2 --latency-distribution lognormal --tokens-per-second 200
+    python -m benchmarks.bench_suite --rpm 120 --rate-limit-ratio 0.02 --short-ratio 0.3 --json result.json
+    python -m benchmarks.bench_suite --replay transcript.jsonl
+    python -m benchmarks.bench_suite --routing fixed cascade --tier-profiles --tokens-per-second 500
+    python -m benchmarks.bench_suite --prefix-cache --prefill-tokens-per-second 20000 --stream
+    python -m benchmarks.bench_suite --repeat-ratio 0.2 --tokens-per-second 500 --detect-degeneration
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from src.agent import NovelAIAgent, STORY_STAGES, SYNOPSIS_MODES
+from src.metrics import CallRecord, MemorySink, MetricsRecorder
+from src.routing import ROUTING_MODES, TierRouter
+
+BENCH_PROMPT = "请创作一个修仙题材的小说。"
+STAGE_ORDER = list(STORY_STAGES) + ["chapters"]
+
+
+def tier_profiles(latency: float, tokens_per_second: float, flash_short_ratio: float) -> Dict[str, Dict]:
+    """模拟三个档位的差异：flash首字延迟为1/4、生成速度为4倍，但有一定比例字数不足"""
+    return {
+        "mock-flash": {"latency": latency / 4, "tokens_per_second": tokens_per_second * 4,
+                       "short_ratio": flash_short_ratio},
+        "mock-air": {"latency": latency / 2, "tokens_per_second": tokens_per_second * 2},
+        "mock-plus": {"latency": latency, "tokens_per_second": tokens_per_second}
+    }
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def stage_breakdown(records: List[CallRecord]) -> Dict[str, Dict]:
+    """按步骤统计调用次数、token和实际耗时（该步骤第一次调用开始到最后一次调用结束）"""
+    stages: Dict[str, Dict] = {}
+    for record in records:
+        stats = stages.setdefault(record.stage, {
+            "calls": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "start": record.timestamp, "end": record.timestamp
+        })
+        stats["calls"] += 1
+        stats["errors"] += 1 if record.error else 0
+        stats["retries"] += record.retries
+        stats["prompt_tokens"] += record.prompt_tokens
+        stats["completion_tokens"] += record.completion_tokens
+        stats["start"] = min(stats["start"], record.timestamp)
+        stats["end"] = max(stats["end"], record.timestamp + record.latency)
+    for stats in stages.values():
+        stats["wall"] = stats.pop("end") - stats.pop("start")
+    return stages
+
+
+async def run_once(max_concurrency: int, synopsis_mode: str, stream: bool,
+                   mock_options: Dict, retry_base_delay: float, router: Optional[TierRouter] = None,
+                   detect_degeneration: bool = False) -> Dict:
+    """完整运行一次创作，返回总耗时与各步骤统计"""
+    sink = MemorySink()
+    agent = NovelAIAgent(api_key="mock", model_type="mock", max_concurrency=max_concurrency,
+                         synopsis_mode=synopsis_mode, metrics=MetricsRecorder([sink]),
+                         retry_base_delay=retry_base_delay, retry_max_delay=retry_base_delay * 20,
+                         mock_options=mock_options, router=router, detect_degeneration=detect_degeneration)
+    start = time.perf_counter()
+    if stream:
+        async for _ in agent.stream_story(BENCH_PROMPT):
+            pass
+    else:
+        await agent.create_story(BENCH_PROMPT)
+    elapsed = time.perf_counter() - start
+    await agent.close()
+    return {
+        "max_concurrency": max_concurrency,
+        "synopsis_mode": synopsis_mode,
+        "routing": "cascade" if router is not None else "fixed",
+        "stream": stream,
+        "detect_degeneration": detect_degeneration,
+        "elapsed": elapsed,
+        "chapters": len(agent.current_story["content"]),
+        "requests": agent.client.request_count,
+        "replay_hits": agent.client.replay_hits,
+        "replay_misses": agent.client.replay_misses,
+        "stages": stage_breakdown(sink.records),
+        "models": dict(Counter(record.model for record in sink.records)),
+        "chapter_tiers": dict(Counter(stats["tier"] for stats in agent.chapter_stats.values())),
+        "aborted": sum(1 for record in sink.records if record.aborted),
+        "prefix_reuse": agent.prefix_stats.stats,
+        "cached_prompt_tokens": sum(record.cached_prompt_tokens for record in sink.records),
+        "chapter_first_token_latency": _mean([record.first_token_latency for record in sink.records
+                                              if record.stage == "chapters"
+                                              and record.first_token_latency is not None]),
+        "critical_path": agent.stage_graph.critical_path() if agent.stage_graph else []
+    }
+
+
+def print_result(result: Dict):
+    print(f"\n章节并发 {result['max_concurrency']}，梗概模式 {result['synopsis_mode']}，"
+          f"档位 {result['routing']}，{'流式' if result['stream'] else '非流式'}：总耗时 {result['elapsed']:.2f}s，"
+          f"{result['chapters']}章，请求 {result['requests']} 次")
+    print(f"  各模型调用次数：{result['models']}，章节最终档位：{result['chapter_tiers']}")
+    reuse = result["prefix_reuse"]
+    print(f"  相同前缀：{reuse['shared_tokens']}/{reuse['prompt_tokens']} tokens（{reuse['reuse_ratio']:.1%}），"
+          f"提供方报告的缓存命中：{result['cached_prompt_tokens']} tokens")
+    if result["chapter_first_token_latency"] is not None:
+        print(f"  章节平均首字延迟：{result['chapter_first_token_latency']:.3f}s")
+    if result["detect_degeneration"]:
+        print(f"  因退化中止的调用：{result['aborted']}")
+    if result["critical_path"]:
+        print(f"  关键路径：{' -> '.join(result['critical_path'])}")
+    if result["replay_hits"] or result["replay_misses"]:
+        print(f"  回放命中 {result['replay_hits']}，未命中 {result['replay_misses']}")
+    print(f"  {'步骤':<14} {'耗时(s)':>8} {'调用':>6} {'错误':>4} {'重试':>4} {'输入tok':>10} {'输出tok':>10}")
+    stages = result["stages"]
+    for name in sorted(stages, key=lambda n: STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER)):
+        s = stages[name]
+        print(f"  {name:<14} {s['wall']:>8.2f} {s['calls']:>6} {s['errors']:>4} {s['retries']:>4} "
+              f"{s['prompt_tokens']:>10} {s['completion_tokens']:>10}")
+
+
+async def main(args):
+    mock_options = {
+        "latency": args.latency,
+        "latency_distribution": args.latency_distribution,
+        "tokens_per_second": args.tokens_per_second,
+        "requests_per_minute": args.rpm,
+        "rate_limit_ratio": args.rate_limit_ratio,
+        "error_ratio": args.error_ratio,
+        "short_ratio": args.short_ratio,
+        "repeat_ratio": args.repeat_ratio,
+        "prefill_tokens_per_second": args.prefill_tokens_per_second,
+        "prefix_cache": args.prefix_cache,
+        "model_profiles": tier_profiles(args.latency, args.tokens_per_second, args.flash_short_ratio)
+        if args.tier_profiles else None,
+        "replay_path": args.replay,
+        "seed": args.seed
+    }
+    print(f"mock提供方：{json.dumps({k: v for k, v in mock_options.items() if v}, ensure_ascii=False)}")
+
+    results = []
+    for max_concurrency, synopsis_mode, routing in itertools.product(
+            args.max_concurrency, args.synopsis_mode, args.routing):
+        # 每次运行使用新的路由器，从零开始学习
+        router = TierRouter() if routing == "cascade" else None
+        result = await run_once(max_concurrency, synopsis_mode, args.stream, mock_options,
+                                args.retry_base_delay, router, args.detect_degeneration)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"mock_options": mock_options, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="端到端创作基准测试（离线mock提供方）")
+    parser.add_argument("--max-concurrency", type=int, nargs="+", default=[1, 10],
+                        help="需要测试的章节并发数")
+    parser.add_argument("--synopsis-mode", choices=SYNOPSIS_MODES, nargs="+", default=["sequential"],
+                        help="需要测试的梗概生成方式")
+    parser.add_argument("--routing", choices=ROUTING_MODES, nargs="+", default=["fixed"],
+                        help="需要测试的档位路由方式")
+    parser.add_argument("--tier-profiles", action="store_true",
+                        help="模拟档位差异：低档位更快但有一定比例字数不足")
+    parser.add_argument("--flash-short-ratio", type=float, default=0.2,
+                        help="--tier-profiles下最低档位章节字数不足的概率")
+    parser.add_argument("--stream", action="store_true", help="以流式方式请求章节")
+    parser.add_argument("--detect-degeneration", action="store_true",
+                        help="流式检测章节退化，陷入重复时立即中止")
+    parser.add_argument("--latency", type=float, default=0.05, help="首字延迟均值（秒）")
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal"],
+                        default="fixed", help="首字延迟分布")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0,
+                        help="模拟的生成速度，0表示瞬时生成")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0.0,
+                        help="模拟处理输入的速度，未命中前缀缓存的输入计入首字延迟，0表示不计")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="模拟提供方的前缀缓存，与此前请求相同的前缀不计处理时间")
+    parser.add_argument("--rpm", type=int, default=None, help="模拟服务端的每分钟请求额度")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="随机返回429的概率")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="随机返回503的概率")
+    parser.add_argument("--short-ratio", type=float, default=0.0, help="章节字数不足的概率")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="章节整章重复的概率")
+    parser.add_argument("--replay", type=str, default=None, help="回放的对话记录（JSONL）")
+    parser.add_argument("--retry-base-delay", type=float, default=0.05, help="暂时性错误的退避基数（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", type=str, default=None, help="把完整结果写入JSON文件")
+    args = parser.parse_args()
+
+    # 基准测试只保留警告以上输出
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main(args))
@@ -0,0 +1,100 @@
+"""
+本地模拟的OpenAI兼容接口，用于在没有真实API密钥的情况下做性能测试
+"""
+
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from src.mock_provider import mock_reply
+
+
+class MockLLMServer:
+    """在本地端口上提供 /v1/chat/completions 的模拟服务"""
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0,
+                 chunk_size: int = 50, chunk_delay: float = 0.0,
+                 short_ratio: float = 0.0, error_ratio: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.chunk_size = chunk_size      # 流式响应每块的字数
+        self.chunk_delay = chunk_delay    # 流式响应块间隔（秒）
+        self.short_ratio = short_ratio    # 章节正文字数不足的概率
+        self.error_ratio = error_ratio    # 返回503错误的概率
+        self._random = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.request_count = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1/"
+
+    async def _stream_reply(self, request: web.Request, body: dict, content: str) -> web.StreamResponse:
+        """以SSE格式逐块返回内容"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for start in range(0, len(content), self.chunk_size):
+            chunk = {
+                "id": f"mock-{self.request_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": content[start:start + self.chunk_size]},
+                    "finish_reason": None
+                }]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.request_count += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_ratio:
+            return web.json_response({"error": {"message": "mock overloaded"}}, status=503)
+        short = self._random.random() < self.short_ratio
+        content = mock_reply(body.get("messages", []), short)
+        if body.get("stream"):
+            return await self._stream_reply(request, body, content)
+        return web.json_response({
+            "id": f"mock-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": sum(len(m.get("content", "")) for m in body.get("messages", [])),
+                "completion_tokens": len(content),
+                "total_tokens": 0
+            }
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._handle_chat)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # 端口为0时由系统分配，取回实际端口
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
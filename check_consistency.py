@@ -0,0 +1,40 @@
+import argparse
+import json
+import logging
+import os
+import time
+from src.entities import index_directory
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description='检查已生成小说的人物名字漂移与已死亡角色再次出场')
+    parser.add_argument('directories', nargs='+', help='输出目录（含meta.json与chapters/）')
+    parser.add_argument('--min-variant-count', type=int, default=2,
+                       help='疑似误写的名字至少出现多少次才报告 (默认2)')
+    parser.add_argument('--no-save', action='store_true', help='不写入<目录>/entity_index.json')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出全部问题')
+    args = parser.parse_args()
+
+    report = {}
+    for directory in args.directories:
+        started = time.perf_counter()
+        index = index_directory(directory, min_variant_count=args.min_variant_count)
+        elapsed = time.perf_counter() - started
+        issues = index.issues()
+        if not args.no_save:
+            index.save(os.path.join(directory, "entity_index.json"))
+        if args.json:
+            report[directory] = [issue.__dict__ for issue in issues]
+            continue
+        print(f"{directory}：{len(index.chapters)}章，{len(index.entities)}个人物/地点，"
+              f"耗时{elapsed * 1000:.0f}ms，发现{len(issues)}处问题")
+        for issue in issues:
+            print(f"  第{issue.chapter}章（偏移{issue.offset}）{issue.detail}")
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
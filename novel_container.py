@@ -0,0 +1,48 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from src.container import NovelContainerReader, convert_directory
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description='小说单文件容器工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help='把输出目录转换为单文件容器')
+    convert.add_argument('directories', nargs='+', help='输出目录（含meta.json与chapters/）')
+    convert.add_argument('--output', type=str, default=None,
+                         help='容器文件路径，只转换一个目录时有效 (默认<目录>/novel.nvl)')
+    convert.add_argument('--no-compress', action='store_true', help='不压缩章节内容')
+
+    read = subparsers.add_parser('read', help='读取容器中的章节或元数据')
+    read.add_argument('path', help='容器文件')
+    read.add_argument('--chapter', type=int, default=None, help='输出指定章节的正文')
+    read.add_argument('--meta', action='store_true', help='输出元数据（JSON）')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        if args.output and len(args.directories) > 1:
+            parser.error('--output只能在转换单个目录时使用')
+        for directory in args.directories:
+            convert_directory(directory, args.output, compress=not args.no_compress)
+        return
+
+    with NovelContainerReader(args.path) as reader:
+        if args.meta:
+            print(json.dumps(reader.meta, ensure_ascii=False, indent=2))
+        elif args.chapter is not None:
+            sys.stdout.write(reader.chapter(args.chapter))
+        else:
+            print(f"{reader.meta.get('title', '未命名')}：{len(reader)}章，"
+                  f"文件大小{os.path.getsize(args.path)}字节")
+            for index in reader.chapters:
+                print(f"  第{index}章：{reader.chapter(index).split(chr(10), 1)[0]}")
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,257 @@
-from typing import Dict, Optional, List
-from openai import OpenAI
-from zhipuai import ZhipuAI
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, List, Sequence, Tuple, Union
+import asyncio
+import contextlib
+import contextvars
 import logging
+import random
+import time
+from dataclasses import asdict
 from .prompts import (
     THEME_ANALYSIS_PROMPT,
     CHARACTER_DESIGN_PROMPT,
     STORY_OUTLINE_PROMPT,
-    CONTENT_CREATION_SYSTEM_PROMPT,
+    CHAPTER_CONTINUATION_PROMPT,
     CHAPTER_SYNOPSIS_PROMPT,
+    SECTION_TITLE_PROMPT,
     SETTING_GENERATION_PROMPT,
-    TONE_ANALYSIS_PROMPT
+    STAGE_SYNOPSIS_REQUIREMENTS_PROMPT,
+    TITLE_GENERATION_PROMPT,
+    TONE_ANALYSIS_PROMPT,
+    ARC_SYNOPSIS_REQUIREMENTS_PROMPT,
+    PrefixReuseStats,
+    get_arc_plan_messages,
+    get_arc_synopsis_messages,
+    get_chapter_content_messages,
+    get_stage_synopsis_messages,
+    get_volume_plan_messages
+)
+from .budget import STAGE_OUTPUT_CHARS, PromptSection, completion_budget, messages_tokens, plan_request
+from .cache import ResponseCache
+from .checkpoint import CheckpointStore, fingerprint
+from .context import StoryContext, estimate_tokens
+from .degeneration import DegenerationDetector
+from .entities import EntityIndex
+from .metrics import CallRecord, MetricsRecorder
+from .mock_provider import TranscriptLog
+from .outline import (
+    PLAN_ITEM_CHARS,
+    SYNOPSIS_CHARS_PER_CHAPTER,
+    OutlineShape,
+    OutlineTree,
+    parse_plan,
+    render_plan
+)
+from .providers import ProviderEndpoint, ProviderPool
+from .rate_limit import RateLimiter
+from .routing import TierRouter, check_chapter
+from .sampling import DEFAULT_ACCEPT_SCORE, ChapterScore, score_chapter, synopsis_keywords
+from .scheduler import Stage, StageGraph
+from .synopsis import (
+    SYNOPSIS_STAGES,
+    ChapterSynopsis,
+    SynopsisFeed,
+    SynopsisStreamParser,
+    parse_synopses,
+    render_synopses,
+    stage_chapters
 )
 import json
+import re
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# 章节字数要求配置
+REQUIRED_WORDS = 3000  # 要求模型生成的字数
+MIN_WORDS = 2000      # 实际检查的最小字数
+
+# create_story中可断点恢复的步骤，章节正文按章单独保存
+STORY_STAGES = ("themes", "title", "tone", "section_titles", "setting",
+                "characters", "outline", "synopses")
+
+# 各步骤的提示词模板与使用的档位，与上游产物、模型一起构成步骤的输入指纹（见CheckpointStore）
+STAGE_TEMPLATES = {
+    "themes": (THEME_ANALYSIS_PROMPT, "complex"),
+    "title": (TITLE_GENERATION_PROMPT, "medium"),
+    "tone": (TONE_ANALYSIS_PROMPT, "medium"),
+    "section_titles": (SECTION_TITLE_PROMPT, "simple"),
+    "setting": (SETTING_GENERATION_PROMPT, "complex"),
+    "characters": (CHARACTER_DESIGN_PROMPT, "complex"),
+    "outline": (STORY_OUTLINE_PROMPT, "complex"),
+    "synopses": (STAGE_SYNOPSIS_REQUIREMENTS_PROMPT, "complex")
+}
+
+# 章节梗概的生成方式，五个阶段见synopsis.SYNOPSIS_STAGES
+SYNOPSIS_MODES = ("sequential", "parallel", "chained")
+SYNOPSIS_TAIL_CHARS = 600  # chained模式下传给下一阶段的梗概结尾长度
+SYNOPSIS_REPAIR_ATTEMPTS = 2  # 阶段梗概缺少章节时的补写次数
+
+# 章节上下文：full每章附带完整角色设计，compact只附带本章相关人物、设定与前情回顾
+CONTEXT_MODES = ("full", "compact")
+
+# 章节字数不足时的处理策略：regenerate重写整章，continue保留草稿并续写
+RETRY_STRATEGIES = ("regenerate", "continue")
+
+# 限流、超时、服务端错误等可以通过重试恢复的HTTP状态码
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# 当前任务（如单个章节）内的token用量累计，由调用方在任务开始时设置
+_usage_scope: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("usage_scope", default=None)
+# 当前所处的创作步骤与章节，写入每次调用的统计记录
+_stage_scope: contextvars.ContextVar[str] = contextvars.ContextVar("stage_scope", default="unknown")
+_chapter_scope: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("chapter_scope", default=None)
+# 当前步骤或章节被指定重新生成，调用时不读取响应缓存（否则会拿回同样的结果）
+_refresh_scope: contextvars.ContextVar[bool] = contextvars.ContextVar("refresh_scope", default=False)
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """判断API错误是否为暂时性错误（限流、超时、连接失败、5xx）"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+    # openai与zhipuai的连接、超时错误同名，按类名判断以免引入两套异常类型
+    return isinstance(error, (ConnectionError, asyncio.TimeoutError)) or \
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _parse_json_block(text: str) -> Optional[Dict]:
+    """从模型回复中取出第一个JSON对象，无法解析时返回None"""
+    match = re.search(r"\{.*\}", text, re.S)
+    if not match:
+        return None
+    try:
+        value = json.loads(match.group(0))
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+# 流式创作时的事件回调，参数为事件字典，事件类型见NovelAIAgent.stream_story
+EventCallback = Callable[[Dict], Awaitable[None]]
+# 梗概逐章解析完成时的回调
+SynopsisCallback = Callable[[ChapterSynopsis], None]
+
 class NovelAIAgent:
-    def __init__(self, api_key: str, base_url: Optional[str] = None, model_type: str = "puyu"):
-        """初始化小说创作智能代理"""
-        logger.info(f"初始化NovelAIAgent... (model_type: {model_type})")
-        
-        self.model_type = model_type
-        if model_type == "puyu":
-            self.client = OpenAI(api_key=api_key, base_url=base_url)
-            self.model = "internlm2.5-latest"
-        else:  # zhipu models
-            self.client = ZhipuAI(api_key=api_key)
-            # 根据任务复杂度选择不同的模型
-            self.models = {
-                "complex": "glm-4-plus",   # 最复杂的任务：故事大纲、人物设计等
-                "medium": "glm-4-air",     # 中等复杂度：章节梗概、主题分析等
-                "simple": "glm-4-flash"    # 简单任务：具体内容生成等
-            }
-            self.model = self.models["medium"]  # 设置默认模型
-            
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model_type: str = "puyu",
+                 max_concurrency: int = 1,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 synopsis_mode: str = "sequential",
+                 cache: Optional[ResponseCache] = None,
+                 retry_strategy: str = "regenerate",
+                 max_api_retries: int = 5,
+                 retry_base_delay: float = 1.0,
+                 retry_max_delay: float = 60.0,
+                 metrics: Optional[MetricsRecorder] = None,
+                 context_mode: str = "full",
+                 context_budget: int = 3000,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 call_slots: Optional[asyncio.Semaphore] = None,
+                 transcript: Optional[TranscriptLog] = None,
+                 mock_options: Optional[Dict] = None,
+                 provider_pool: Optional[ProviderPool] = None,
+                 router: Optional[TierRouter] = None,
+                 detect_degeneration: bool = False,
+                 check_consistency: bool = False,
+                 samples: int = 1,
+                 sample_tier: Optional[str] = None,
+                 accept_score: float = DEFAULT_ACCEPT_SCORE,
+                 outline_shape: Union[str, OutlineShape, None] = None,
+                 max_chapters: Optional[int] = None,
+                 outline_lookahead: int = 1):
+        """初始化小说创作智能代理
+
+        max_concurrency: 同时生成的章节数，1表示逐章生成
+        requests_per_minute / tokens_per_minute: 当前提供方的限流额度，不设置则不限流
+        synopsis_mode: 章节梗概的生成方式，sequential、parallel或chained
+        cache: 可选的响应缓存，相同请求直接复用之前的回复
+        retry_strategy: 章节字数不足时重写整章（regenerate）或在草稿基础上续写（continue）
+        max_api_retries / retry_base_delay / retry_max_delay: 暂时性API错误的指数退避重试参数
+        metrics: 可选的统计记录器，每次模型调用都会记录步骤、模型、token、耗时等
+        context_mode / context_budget: 章节上下文模式（full或compact）及compact模式的token预算
+        rate_limiter: 可选的共享限流器，设置时忽略requests_per_minute/tokens_per_minute，
+            用于多个代理共用同一提供方额度
+        call_slots: 可选的共享信号量，限制多个代理同时进行中的模型调用总数
+        transcript: 可选的对话记录，每次实际请求的消息与回复都会追加写入，供mock提供方回放
+        mock_options: model_type为mock时传给MockLLMClient的参数（延迟、生成速度、错误率等）
+        provider_pool: 可选的提供方连接池（多个密钥/端点、熔断切换），设置时忽略api_key、
+            base_url和model_type；可在多个代理之间共享
+        router: 可选的档位路由器，设置时主题、标题、基调、分部标题和章节正文先用低档位起草，
+            未通过质量检查时再升级（见routing.TierRouter）；可在多个代理之间共享
+        detect_degeneration: 章节正文总以流式方式请求，文本陷入重复或偏离格式时立即中止，
+            保留之前正常的部分（见degeneration.DegenerationDetector）
+        check_consistency: 每完成一章就更新人物/地点索引，检查名字漂移、已死亡角色再次出场等问题，
+            不额外调用模型（见entities.EntityIndex）
+        samples: 每次生成章节时同时请求的候选数，大于1时按本地评分（字数、重复、梗概关键词覆盖、格式，
+            见sampling.score_chapter）选出最好的一份；某个候选通过字数检查且评分达到accept_score时
+            立即取消其余候选。全部候选不合格时按retry_strategy重试。候选以流式方式请求，
+            取消时关闭连接，提供方随之停止生成
+        sample_tier: 第一轮候选使用的档位（如simple），重试时恢复原来的档位；None表示不改变
+        outline_shape: 长篇连载的分层大纲形状（如"10x5x10"：10卷、每卷5篇、每篇10章，见outline.OutlineShape），
+            设置时以全书→卷→篇→章的方式按需展开梗概，代替默认的五阶段×10章；None表示使用默认方式
+        max_chapters: 分层大纲模式下本次最多写到第几章，只展开这些章节所在的卷和篇；
+            之后调高该值并从断点恢复即可续写，已展开的节点直接复用
+        outline_lookahead: 分层大纲模式下梗概最多领先正文的篇数，超出时等待正文写完再展开下一篇
+        """
+        if context_mode not in CONTEXT_MODES:
+            raise ValueError(f"不支持的上下文模式: {context_mode}，可选值：{', '.join(CONTEXT_MODES)}")
+        if retry_strategy not in RETRY_STRATEGIES:
+            raise ValueError(f"不支持的重试策略: {retry_strategy}，可选值：{', '.join(RETRY_STRATEGIES)}")
+        if sample_tier is not None and sample_tier not in ("simple", "medium", "complex"):
+            raise ValueError(f"不支持的候选档位: {sample_tier}，可选值：simple, medium, complex")
+        if synopsis_mode not in SYNOPSIS_MODES:
+            raise ValueError(f"不支持的梗概生成模式: {synopsis_mode}，可选值：{', '.join(SYNOPSIS_MODES)}")
+        if isinstance(outline_shape, str):
+            outline_shape = OutlineShape.parse(outline_shape)
+        if max_chapters is not None and (outline_shape is None or max_chapters < 1):
+            raise ValueError("max_chapters只能在设置outline_shape时使用，且至少为1")
+
+        if provider_pool is None:
+            # 未提供连接池时，用传入的密钥建立只有一个端点的池
+            provider_pool = ProviderPool([ProviderEndpoint(model_type, api_key, base_url,
+                                                           mock_options=mock_options)])
+            self._owns_pool = True
+        else:
+            self._owns_pool = False
+        self.provider_pool = provider_pool
+
+        # 优先级最高的端点决定默认模型名与缓存键
+        primary = provider_pool.primary
+        self.model_type = primary.model_type
+        logger.info(f"初始化NovelAIAgent... (model_type: {self.model_type}，端点数：{len(provider_pool.endpoints)})")
+        self.client = primary.client
+        self.models = primary.models
+        self.model = primary.resolve_model("medium")
         logger.info(f"API配置完成: model={self.model}")
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+        self.call_slots = call_slots
+        self.transcript = transcript
+        self.synopsis_mode = synopsis_mode
+        self.cache = cache
+        self.retry_strategy = retry_strategy
+        self.max_api_retries = max_api_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.chapter_stats: Dict[int, Dict] = {}
+        self.metrics = metrics
+        self.context_mode = context_mode
+        self.context_budget = context_budget
+        self.router = router
+        self.detect_degeneration = detect_degeneration
+        self.check_consistency = check_consistency
+        self.samples = max(1, samples)
+        self.sample_tier = sample_tier
+        self.accept_score = accept_score
+        self.outline_shape = outline_shape
+        self.max_chapters = max_chapters
+        self.outline_lookahead = max(0, outline_lookahead)
+        # 最近一次分层大纲模式下已展开的大纲树
+        self.outline_tree: Optional[OutlineTree] = None
+        # 最近一次生成章节时的人物/地点索引，check_consistency为True时建立
+        self.entity_index: Optional[EntityIndex] = None
+        # 各次请求与此前请求相同的前缀，即提供方前缀缓存可复用的部分
+        self.prefix_stats = PrefixReuseStats(count=estimate_tokens)
         
         self.current_story = {
             "title": "",
@@ -47,264 +259,1093 @@ class NovelAIAgent:
             "setting": "",
             "characters": "",
             "tone": "",
+            "section_titles": {},
             "outline": "",
             "synopses": "",
             "content": []
         }
+        # 最近一次create_story的步骤调度图，可查看各步骤耗时与关键路径
+        self.stage_graph: Optional[StageGraph] = None
+
+    def _resolve_model(self, complexity: str) -> str:
+        """返回指定复杂度在首选端点上使用的模型名"""
+        return self.provider_pool.primary.resolve_model(complexity)
+
+    async def _request_with_retry(self, messages: List[Dict], complexity: str,
+                                  estimated_tokens: int, **kwargs):
+        """从连接池选择端点发起请求，遇到暂时性错误时切换端点或退避重试
+
+        还有未试过的可用端点时立即切换；所有端点都试过后按带随机抖动的指数退避等待。
+        所有端点都熔断时等待最早的端点冷却结束，等待不计入重试次数。
+        返回(响应, 重试次数, 使用的端点)。非暂时性错误或重试次数用尽时抛出原异常。
+        请求被取消时释放端点的熔断试探名额，不计入错误率。
+        """
+        attempt = 0
+        tried: List[ProviderEndpoint] = []
+        while True:
+            endpoint = await self.provider_pool.acquire(exclude=tried)
+            try:
+                await self.rate_limiter.acquire(estimated_tokens)
+                await endpoint.rate_limiter.acquire(estimated_tokens)
+                endpoint.in_flight += 1
+                try:
+                    response = await endpoint.create(messages, complexity, **kwargs)
+                finally:
+                    endpoint.in_flight -= 1
+            except Exception as e:
+                transient = _is_transient_error(e)
+                # 只有暂时性错误计入端点的错误率，请求本身有误时换端点也无济于事
+                self.provider_pool.report(endpoint, success=not transient)
+                if attempt >= self.max_api_retries or not transient:
+                    raise
+                tried.append(endpoint)
+                if self.provider_pool.has_alternative(exclude=tried):
+                    attempt += 1
+                    logger.warning(f"端点{endpoint.name}暂时不可用（{str(e)}），切换端点第{attempt}次重试...")
+                    continue
+                # full jitter：在[0, 当前退避上限]内随机等待，避免并发请求同时重试
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                attempt += 1
+                tried.clear()
+                logger.warning(f"API暂时不可用（{str(e)}），{delay:.1f}秒后第{attempt}次重试...")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 取消（如多份候选中已有合格的一份）不是端点的调用结果，否则半开端点的试探名额永远不会释放
+                self.provider_pool.release(endpoint)
+                raise
+            self.provider_pool.report(endpoint, success=True)
+            return response, attempt, endpoint
+
+    def _call_slot(self):
+        """占用一个共享调用名额，未设置call_slots时不做限制"""
+        return self.call_slots if self.call_slots is not None else contextlib.nullcontext()
 
-    async def _call_api(self, messages: List[Dict], complexity: str = "medium") -> str:
-        """根据任务复杂度调用不同的模型"""
+    def _record_call(self, record: CallRecord):
+        """记录一次调用：计入当前任务的用量累计，并交给统计记录器"""
+        record.stage = _stage_scope.get()
+        record.chapter = _chapter_scope.get()
+        usage = _usage_scope.get()
+        if usage is not None and not record.cached:
+            usage["calls"] += 1
+            usage["prompt_tokens"] += record.prompt_tokens
+            usage["completion_tokens"] += record.completion_tokens
+            usage["api_retries"] += record.retries
+        if self.metrics is not None:
+            self.metrics.record(record)
+
+    def _cache_key(self, messages: List[Dict], complexity: str, params: Dict,
+                   endpoint: Optional[ProviderEndpoint] = None) -> Optional[str]:
+        """缓存键：消息、发给提供方的采样参数（max_tokens等），以及回答请求的提供方和模型
+
+        查找时使用首选端点；故障切换后由其他提供方回答的请求按实际的端点写入，
+        不同提供方（或模型）的回复互不复用。同一提供方的多个密钥使用相同的模型，回复可以互相复用。
+        """
+        if self.cache is None:
+            return None
+        endpoint = endpoint or self.provider_pool.primary
+        return ResponseCache.make_key(endpoint.model_type, endpoint.resolve_model(complexity), messages, params)
+
+    def _fit_request(self, messages: List[Dict], complexity: str, max_tokens: Optional[int],
+                     sections: Sequence[PromptSection], record: CallRecord) -> tuple:
+        """按连接池中各端点的上下文窗口检查请求，超出时压缩提示词或减少输出预算"""
+        models = [endpoint.resolve_model(complexity) for endpoint in self.provider_pool.endpoints]
+        messages, max_tokens, record.trimmed_tokens = plan_request(messages, models, max_tokens, sections)
+        record.max_tokens = max_tokens
+        return messages, max_tokens
+
+    async def _call_api(self, messages: List[Dict], complexity: str = "medium",
+                        use_cache: bool = True, max_tokens: Optional[int] = None,
+                        sections: Sequence[PromptSection] = ()) -> str:
+        """根据任务复杂度调用不同的模型（不阻塞事件循环）
+
+        use_cache为False时不读取缓存（例如重试时需要新的结果），但仍会写入。
+        max_tokens: 本次输出的token上限，None表示不限制
+        sections: 提示词超出上下文窗口时可以压缩的段落（见budget.plan_request）
+        """
+        record = CallRecord(stage="", complexity=complexity, model=self._resolve_model(complexity))
+        messages, max_tokens = self._fit_request(messages, complexity, max_tokens, sections, record)
+        kwargs = {"max_tokens": max_tokens} if max_tokens is not None else {}
+        cache_key = self._cache_key(messages, complexity, kwargs)
+        if cache_key and use_cache and not _refresh_scope.get():
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record.cached = True
+                record.chars = len(cached)
+                self._record_call(record)
+                return cached
+
+        record.shared_prefix_tokens = self.prefix_stats.observe(messages)
+        # 本地估算token占用，响应返回实际用量后再校正限流额度
+        estimated_tokens = messages_tokens(messages)
+        start = time.perf_counter()
         try:
-            if self.model_type == "puyu":
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages
-                )
-            else:  # zhipu models
-                model = self.models.get(complexity, self.models["medium"])
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages
+            async with self._call_slot():
+                response, record.retries, endpoint = await self._request_with_retry(
+                    messages, complexity, estimated_tokens, **kwargs
                 )
-            return response.choices[0].message.content
+            record.model = endpoint.resolve_model(complexity)
+            content = response.choices[0].message.content
+            record.latency = time.perf_counter() - start
+            record.chars = len(content or "")
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                total_tokens = getattr(usage, "total_tokens", 0) or 0
+                self.rate_limiter.settle(estimated_tokens, total_tokens)
+                endpoint.rate_limiter.settle(estimated_tokens, total_tokens)
+                record.prompt_tokens = usage.prompt_tokens or 0
+                record.completion_tokens = usage.completion_tokens or 0
+                # 提供方命中前缀缓存的输入token（OpenAI协议的prompt_tokens_details.cached_tokens）
+                details = getattr(usage, "prompt_tokens_details", None)
+                record.cached_prompt_tokens = getattr(details, "cached_tokens", 0) or 0
+            else:
+                record.prompt_tokens = estimated_tokens
+                record.completion_tokens = record.chars
+            self._record_call(record)
+        except asyncio.CancelledError:
+            # 调用方取消了请求（如多份候选中已有合格的一份），记录为中止
+            record.latency = time.perf_counter() - start
+            record.aborted = True
+            self._record_call(record)
+            raise
         except Exception as e:
             logger.error(f"API调用出错: {str(e)}")
+            record.latency = time.perf_counter() - start
+            record.error = type(e).__name__
+            self._record_call(record)
+            raise
+
+        if cache_key:
+            self.cache.put(self._cache_key(messages, complexity, kwargs, endpoint), content)
+        if self.transcript is not None:
+            self.transcript.append(messages, content)
+        return content
+
+    async def _stream_api(self, messages: List[Dict], complexity: str = "medium",
+                          use_cache: bool = True, max_tokens: Optional[int] = None,
+                          sections: Sequence[PromptSection] = ()) -> AsyncIterator[str]:
+        """以流式方式调用模型，逐段产出生成的文本
+
+        命中缓存时一次性产出完整回复，未命中时在流结束后写入缓存。
+        max_tokens与sections同_call_api。
+        """
+        record = CallRecord(stage="", complexity=complexity, model=self._resolve_model(complexity),
+                            streamed=True)
+        messages, max_tokens = self._fit_request(messages, complexity, max_tokens, sections, record)
+        kwargs = {"max_tokens": max_tokens} if max_tokens is not None else {}
+        cache_key = self._cache_key(messages, complexity, kwargs)
+        if cache_key and use_cache and not _refresh_scope.get():
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                record.cached = True
+                record.chars = len(cached)
+                self._record_call(record)
+                yield cached
+                return
+
+        record.shared_prefix_tokens = self.prefix_stats.observe(messages)
+        estimated_tokens = messages_tokens(messages)
+        parts = []
+        endpoint = None
+        start = time.perf_counter()
+        try:
+            # 流式调用在整个输出期间占用调用名额
+            async with self._call_slot():
+                # 只有建立连接阶段的错误可以重试，开始输出后出错直接抛出
+                stream, record.retries, endpoint = await self._request_with_retry(
+                    messages, complexity, estimated_tokens, stream=True, **kwargs
+                )
+                record.model = endpoint.resolve_model(complexity)
+                endpoint.in_flight += 1
+                try:
+                    async for text in endpoint.iter_text(stream):
+                        if not parts:
+                            record.first_token_latency = time.perf_counter() - start
+                        parts.append(text)
+                        yield text
+                finally:
+                    endpoint.in_flight -= 1
+                    # 调用方提前停止读取时立即关闭连接，不再为后续输出付费
+                    await endpoint.close_stream(stream)
+        except (GeneratorExit, asyncio.CancelledError):
+            # 调用方中止了生成（如检测到退化、已有合格的候选），不完整的结果不写入缓存
+            record.aborted = True
+            raise
+        except Exception as e:
+            logger.error(f"API流式调用出错: {str(e)}")
+            record.error = type(e).__name__
             raise
+        finally:
+            # 流式响应不返回用量，按输出字数估算
+            produced = sum(len(text) for text in parts)
+            self.rate_limiter.settle(estimated_tokens, estimated_tokens + produced)
+            if endpoint is not None:
+                endpoint.rate_limiter.settle(estimated_tokens, estimated_tokens + produced)
+            record.latency = time.perf_counter() - start
+            record.prompt_tokens = estimated_tokens
+            record.completion_tokens = produced
+            record.chars = produced
+            self._record_call(record)
+
+        if cache_key:
+            self.cache.put(self._cache_key(messages, complexity, kwargs, endpoint), "".join(parts))
+        if self.transcript is not None:
+            self.transcript.append(messages, "".join(parts))
+
+    async def close(self):
+        """关闭自建连接池中的客户端，释放保持的连接（外部传入的共享连接池由调用方关闭）"""
+        if self._owns_pool:
+            await self.provider_pool.close()
+
+    async def _call_routed(self, messages: List[Dict], complexity: str,
+                           gate: Callable[[str], Optional[str]],
+                           max_tokens: Optional[int] = None) -> str:
+        """按档位路由调用模型
+
+        未设置router时直接使用complexity对应的档位；否则按router给出的档位依次尝试，
+        gate返回None表示通过，返回原因表示不合格、需要升级。最高档位的结果无论是否合格都会采用。
+        """
+        if self.router is None:
+            return await self._call_api(messages, complexity=complexity, max_tokens=max_tokens)
+        stage = _stage_scope.get()
+        tiers = self.router.plan(stage)
+        for n, tier in enumerate(tiers):
+            content = await self._call_api(messages, complexity=tier, max_tokens=max_tokens)
+            failure = gate(content)
+            self.router.record(stage, tier, failure is None)
+            if failure is None:
+                return content
+            if n + 1 < len(tiers):
+                logger.info(f"步骤{stage}的{tier}档位结果未通过检查（{failure}），升级到{tiers[n + 1]}")
+        logger.warning(f"步骤{stage}在最高档位仍未通过检查（{failure}），使用该结果")
+        return content
+
+    @staticmethod
+    async def _emit(on_event: Optional[EventCallback], event: Dict):
+        """向调用方推送流式事件（未设置回调时忽略）"""
+        if on_event is not None:
+            await on_event(event)
+
+    async def _generate_stage_synopses(self, meta_info: Dict, stage_index: int, stage: str,
+                                       previous_tail: str = "",
+                                       on_chapter: Optional[SynopsisCallback] = None) -> List[ChapterSynopsis]:
+        """生成单个阶段（10章）的章节梗概，返回按编号排序的章节列表
+
+        previous_tail: 上一阶段梗概的结尾，非空时要求本阶段与之衔接
+        on_chapter: 以流式方式请求，每解析出一章立即回调，章节生成无需等待整个阶段结束
+        缺失的章节单独补写，多次补写仍缺失时以占位梗概代替。
+        """
+        logger.info(f"正在生成第{stage_index}阶段（{stage}）的章节梗概...")
+
+        # 计算本阶段的章节编号范围
+        expected = stage_chapters(stage_index)
+        start_chapter, end_chapter = expected[0], expected[-1]
+
+        messages = get_stage_synopsis_messages(meta_info, stage_index, stage, start_chapter, end_chapter,
+                                               previous_tail)
+        return await self._request_synopses(meta_info, messages, expected, f"第{stage_index}阶段", stage,
+                                            self._stage_budget("synopses"), on_chapter)
 
-    async def _generate_chapter_synopses(self, meta_info: Dict) -> str:
-        """分阶段生成章节梗概"""
+    async def _request_synopses(self, meta_info: Dict, messages: List[Dict], expected: range, label: str,
+                                stage: str, max_tokens: int,
+                                on_chapter: Optional[SynopsisCallback] = None) -> List[ChapterSynopsis]:
+        """请求expected范围内的章节梗概，缺失的章节补写，仍缺失时以占位梗概代替
+
+        label用于日志（如“第2阶段”），stage写入各章的ChapterSynopsis.stage。
+        """
+        # 超出上下文窗口时先压缩世界观，再压缩人物
+        sections = [PromptSection("setting", meta_info.get('setting', ''), priority=0),
+                    PromptSection("characters", meta_info.get('characters', ''), priority=1)]
+        parser = SynopsisStreamParser(expected)
+        chapters: List[ChapterSynopsis] = []
+
+        def collect(parsed: List[ChapterSynopsis]):
+            for chapter in parsed:
+                chapter.stage = stage
+                chapters.append(chapter)
+                if on_chapter is not None:
+                    on_chapter(chapter)
+
+        async def request(request_messages: List[Dict]):
+            if on_chapter is None:
+                collect(parser.feed(await self._call_api(request_messages, complexity="complex",
+                                                         max_tokens=max_tokens, sections=sections)))
+            else:
+                async for text in self._stream_api(request_messages, complexity="complex",
+                                                   max_tokens=max_tokens, sections=sections):
+                    collect(parser.feed(text))
+            collect(parser.finish())
+
+        await request(messages)
+        for repair in range(SYNOPSIS_REPAIR_ATTEMPTS):
+            missing = parser.missing()
+            if not missing:
+                break
+            logger.warning(f"{label}缺少第{'、'.join(map(str, missing))}章的梗概，"
+                           f"第{repair + 1}次补写...")
+            written = "\n".join(c.heading for c in sorted(chapters, key=lambda c: c.number))
+            await request(messages + [{"role": "user", "content": f"""
+以下章节已经完成：
+{written or '（无）'}
+
+请补写以下章节的梗概，与已完成的章节衔接，格式不变：
+{'、'.join(f'第{n}章' for n in missing)}
+"""}])
+
+        missing = parser.missing()
+        if missing:
+            logger.error(f"{label}第{'、'.join(map(str, missing))}章的梗概补写失败，使用占位梗概")
+            collect([
+                ChapterSynopsis(number=n, title="", body=f"承接上一章的情节，推进{stage}阶段的故事。", stage=stage)
+                for n in missing
+            ])
+        return sorted(chapters, key=lambda c: c.number)
+
+    async def _generate_chapter_synopses(self, meta_info: Dict,
+                                         on_chapter: Optional[SynopsisCallback] = None) -> str:
+        """分阶段生成章节梗概，返回统一格式的梗概文本
+
+        synopsis_mode决定各阶段的生成方式：
+        - sequential：逐阶段依次生成
+        - parallel：五个阶段同时生成，延迟约为单次调用
+        - chained：逐阶段生成，并把上一阶段的结尾交给下一阶段以保证衔接
+        on_chapter: 每解析出一章梗概立即回调（见_generate_stage_synopses）
+        """
         try:
-            logger.info("开始生成章节梗概...")
-            all_synopses = []
-            stages = ["起", "承", "转", "合", "终"]
-            
-            for stage_index, stage in enumerate(stages, 1):
-                logger.info(f"正在生成第{stage_index}阶段（{stage}）的章节梗概...")
-                
-                # 计算本阶段的章节编号范围
-                start_chapter = (stage_index - 1) * 10 + 1
-                end_chapter = start_chapter + 9
-                
-                response = await self._call_api([
-                    {"role": "system", "content": "你是一位优秀的故事规划师，擅长设计扣人心弦的情节。"},
-                    {"role": "user", "content": f"""
-请为小说的第{stage_index}阶段（{stage}）创作10个章节的详细梗概。
-
-小说基本信息：
-标题：{meta_info.get('title', '未命名')}
-主题：{', '.join(meta_info.get('themes', []))}
-世界观：{meta_info.get('setting', '')}
-主要人物：{meta_info.get('characters', '')}
-
-本阶段要求：
-1. 创作第{start_chapter}章到第{end_chapter}章的梗概
-2. 每章梗概200字左右
-3. 体现阶段性特点：
-   - 起：引入故事、展示天赋、初入宗门
-   - 承：磨练成长、结交好友、树敌对手
-   - 转：身世之谜、实力暴涨、危机显现
-   - 合：真相揭露、大战爆发、逆境突破
-   - 终：终极决战、拯救世界、圆满收官
-
-4. 爽点要求：
-   - 每章都要有意外或反转
-   - 实力要循序渐进提升
-   - 设置合理的打脸情节
-   - 制造期待和悬念
-
-请按以下格式输出10个章节的梗概：
-
-【第{start_chapter}章：章节标题】
-[详细梗概，包含地点、人物、事件、转折]
-
-【第{start_chapter + 1}章：章节标题】
-[详细梗概]
-...
-"""}], complexity="complex")
-                
-                all_synopses.append(response)
-                logger.info(f"第{stage_index}阶段章节梗概生成完成")
-            
-            # 合并所有阶段的梗概
-            complete_synopses = "\n\n".join(all_synopses)
+            logger.info(f"开始生成章节梗概...（模式：{self.synopsis_mode}）")
+            stages = list(enumerate(SYNOPSIS_STAGES, 1))
+
+            if self.synopsis_mode == "parallel":
+                all_synopses = await asyncio.gather(*(
+                    self._generate_stage_synopses(meta_info, stage_index, stage, on_chapter=on_chapter)
+                    for stage_index, stage in stages
+                ))
+            else:
+                all_synopses = []
+                previous_tail = ""
+                for stage_index, stage in stages:
+                    chapters = await self._generate_stage_synopses(
+                        meta_info, stage_index, stage, previous_tail, on_chapter
+                    )
+                    all_synopses.append(chapters)
+                    logger.info(f"第{stage_index}阶段章节梗概生成完成")
+                    if self.synopsis_mode == "chained":
+                        previous_tail = render_synopses(chapters)[-SYNOPSIS_TAIL_CHARS:]
+
+            # 合并所有阶段的梗概，按章节编号排列
+            complete_synopses = render_synopses(c for chapters in all_synopses for c in chapters)
             logger.info("所有章节梗概生成完成")
             return complete_synopses
-        
+
         except Exception as e:
             logger.error(f"生成章节梗概时出错: {str(e)}")
             raise
 
-    async def _generate_chapters_content(self, meta_info: Dict, chapter_synopses: str) -> List[str]:
-        """生成所有章节的具体内容，返回章节列表"""
+    def _chapter_limit(self) -> int:
+        """分层大纲模式下本次写到的章节数"""
+        total = self.outline_shape.total_chapters
+        return min(self.max_chapters or total, total)
+
+    async def _outline_node(self, key: str, messages: List[Dict], produce: Callable[[], Awaitable[str]],
+                            checkpoint: Optional[CheckpointStore]) -> Tuple[str, bool]:
+        """展开分层大纲的一个节点，返回(内容, 是否从断点复用)
+
+        节点与步骤一样保存在断点中（键为outline:volumes、outline:v2、outline:v2a3），
+        请求的消息（含上级节点的规划）与所用模型构成输入指纹，一致时直接复用。
+        synopses步骤被指定重新生成时所有节点都重新展开。
+        """
+        node_fingerprint = fingerprint(key, messages, self.model_type, self._resolve_model("complex"))
+        if checkpoint is not None and not _refresh_scope.get():
+            if checkpoint.stage_status(key, node_fingerprint) == "fresh":
+                checkpoint.adopt_fingerprint("stages", key, node_fingerprint)
+                logger.info(f"从断点恢复大纲节点：{key}")
+                return checkpoint.get_stage(key), True
+        value = await produce()
+        if checkpoint is not None:
+            checkpoint.save_stage(key, value, node_fingerprint)
+        return value, False
+
+    async def _expand_outline(self, meta_info: Dict, feed: SynopsisFeed,
+                              checkpoint: Optional[CheckpointStore] = None,
+                              on_event: Optional[EventCallback] = None) -> str:
+        """按分层大纲逐篇展开章节梗概，返回已展开章节的梗概文本
+
+        开始时规划全书分卷；写到某一卷时才把这一卷划分为篇；每篇的章节梗概以流式方式请求，
+        每解析出一章立即交给feed，并且最多领先正文outline_lookahead篇。规划的调用次数
+        随写到的章节数增长，与全书的总长度无关；只展开到第max_chapters章所在的篇。
+        从断点复用的篇优先使用旧梗概中手工修改过的章节。
+        """
+        shape = self.outline_shape
+        limit = self._chapter_limit()
+        logger.info(f"开始展开分层大纲...（{shape.volumes}卷×{shape.arcs_per_volume}篇×"
+                    f"{shape.chapters_per_arc}章，共{shape.total_chapters}章，本次写到第{limit}章）")
+        tree = OutlineTree(shape)
+        self.outline_tree = tree
+        complex_model = self._resolve_model("complex")
+        edited: Dict[int, ChapterSynopsis] = {}
+        if checkpoint is not None and checkpoint.has_stage("synopses"):
+            edited = {c.number: c for c in parse_synopses(checkpoint.get_stage("synopses"))}
+
+        def feed_chapter(chapter: ChapterSynopsis):
+            if chapter.number <= limit:
+                feed.put(chapter)
+
+        messages = get_volume_plan_messages(meta_info, shape.volumes, shape.chapters_per_volume)
+        volume_plan, _ = await self._outline_node("outline:volumes", messages, lambda: self._call_api(
+            messages, complexity="complex",
+            max_tokens=completion_budget(PLAN_ITEM_CHARS * shape.volumes, complex_model)
+        ), checkpoint)
+        tree.volumes = parse_plan(volume_plan, "卷", shape.volumes)
+        rendered_volumes = render_plan(tree.volumes, "卷")
+        await self._emit(on_event, {"type": "outline", "tree": tree.to_dict()})
+
+        written: List[ChapterSynopsis] = []
+        for volume, arc in shape.arcs():
+            expected = shape.arc_chapters(volume, arc)
+            if expected.start > limit:
+                break
+            # 等待正文追上：展开本篇前，至少写完本篇之前outline_lookahead篇以外的章节
+            await feed.wait_done(expected.start - 1 - self.outline_lookahead * shape.chapters_per_arc)
+
+            if volume not in tree.arcs:
+                logger.info(f"正在划分第{volume}卷...")
+                arc_messages = get_arc_plan_messages(meta_info, rendered_volumes, volume,
+                                                     shape.arcs_per_volume, shape.chapters_per_arc)
+                arc_plan, _ = await self._outline_node(f"outline:v{volume}", arc_messages, lambda: self._call_api(
+                    arc_messages, complexity="complex",
+                    max_tokens=completion_budget(PLAN_ITEM_CHARS * shape.arcs_per_volume, complex_model)
+                ), checkpoint)
+                tree.arcs[volume] = parse_plan(arc_plan, "篇", shape.arcs_per_volume)
+
+            label = tree.label(volume, arc)
+            logger.info(f"正在展开{label}（第{expected.start}章到第{expected[-1]}章）...")
+            plan = tree.arcs[volume][arc - 1]
+            previous, following = tree.neighbours(volume, arc)
+            synopsis_messages = get_arc_synopsis_messages(
+                meta_info, label, f"{plan.title or '未命名'}：{plan.summary}", previous, following,
+                expected.start, expected[-1]
+            )
+
+            async def expand_arc() -> str:
+                return render_synopses(await self._request_synopses(
+                    meta_info, synopsis_messages, expected, label, label,
+                    completion_budget(SYNOPSIS_CHARS_PER_CHAPTER * shape.chapters_per_arc, complex_model),
+                    on_chapter=feed_chapter
+                ))
+
+            value, reused = await self._outline_node(f"outline:v{volume}a{arc}", synopsis_messages,
+                                                     expand_arc, checkpoint)
+            chapters = parse_synopses(value, expected)
+            if reused:
+                chapters = [edited.get(c.number, c) for c in chapters]
+            for chapter in chapters:
+                chapter.stage = label
+                feed_chapter(chapter)
+            written.extend(c for c in chapters if c.number <= limit)
+            tree.chapters[(volume, arc)] = [c.number for c in chapters]
+            await self._emit(on_event, {"type": "outline", "tree": tree.to_dict()})
+
+        logger.info(f"分层大纲已展开{len(tree.arcs)}卷、{len(tree.chapters)}篇，共{len(written)}章梗概")
+        return render_synopses(written)
+
+    async def _request_chapter_text(self, messages: List[Dict], i: int, use_cache: bool,
+                                    on_event: Optional[EventCallback] = None,
+                                    complexity: str = "complex", max_tokens: Optional[int] = None,
+                                    sections: Sequence[PromptSection] = (),
+                                    stream: bool = False) -> Tuple[str, Optional[str]]:
+        """请求一段章节文本，返回(文本, 中止原因)
+
+        设置on_event时以流式方式边生成边推送。开启detect_degeneration时也以流式方式请求，
+        检测到退化立即中止，返回退化之前的部分和原因；未中止时原因为None。
+        stream为True时即使不推送也以流式方式请求，调用方取消时随即关闭连接、停止生成。
+        """
+        detector = DegenerationDetector() if self.detect_degeneration else None
+        if on_event is None and detector is None and not stream:
+            return await self._call_api(messages, complexity=complexity, use_cache=use_cache,
+                                        max_tokens=max_tokens, sections=sections), None
+        parts = []
+        chunks = self._stream_api(messages, complexity=complexity, use_cache=use_cache,
+                                  max_tokens=max_tokens, sections=sections)
         try:
-            logger.info("开始生成章节内容...")
-            chapters = []
-            
-            # 字数要求配置
-            REQUIRED_WORDS = 3000  # 要求模型生成的字数
-            MIN_WORDS = 2000      # 实际检查的最小字数
-            
-            # 解析章节梗概
-            synopses_list = chapter_synopses.split("【第")
-            synopses_list = [s for s in synopses_list if s.strip()]  # 移除空字符串
-            
-            for i, synopsis in enumerate(synopses_list, 1):
-                logger.info(f"正在生成第{i}章内容...")
-                
-                # 提取章节标题和梗概内容
+            async for text in chunks:
+                parts.append(text)
+                await self._emit(on_event, {"type": "chapter_delta", "index": i, "text": text})
+                if detector is not None and detector.feed(text):
+                    break
+        finally:
+            await chunks.aclose()
+        if detector is not None and detector.reason is not None:
+            salvaged = detector.salvage()
+            logger.warning(f"第{i}章在第{len(detector.text)}字处出现退化（{detector.reason}），"
+                           f"已中止生成，保留前{len(salvaged)}字")
+            return salvaged, detector.reason
+        return "".join(parts), None
+
+    async def _request_best_chapter(self, messages: List[Dict], i: int, chapter_synopsis: str, use_cache: bool,
+                                    complexity: str = "complex", max_tokens: Optional[int] = None,
+                                    sections: Sequence[PromptSection] = ()) -> Tuple[str, ChapterScore]:
+        """同时请求samples份候选正文，返回本地评分最高的一份及其评分
+
+        候选按完成的先后评分，通过字数检查且评分达到accept_score时立即采用，取消其余仍在生成的候选。
+        候选总是以流式方式请求，取消时关闭流式响应，提供方随之停止生成，不再为剩余的输出计费
+        （同步SDK的流在线程中逐块读取，同样在取消后关闭）。
+        只有第一份候选可以读取缓存，其余候选总是重新生成。
+        候选的文本不推送chapter_delta事件，选定后由调用方整体推送。
+        """
+        keywords = synopsis_keywords(chapter_synopsis)
+
+        async def candidate(k: int) -> str:
+            text, _ = await self._request_chapter_text(messages, i, use_cache and k == 0, None,
+                                                       complexity, max_tokens, sections, stream=True)
+            return text.strip()
+
+        tasks = [asyncio.ensure_future(candidate(k)) for k in range(self.samples)]
+        best: Optional[Tuple[str, ChapterScore]] = None
+        error: Optional[Exception] = None
+        scored = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
                 try:
-                    chapter_parts = synopsis.split("】\n", 1)
-                    title_parts = chapter_parts[0].split("章：", 1)
-                    chapter_title = f"第{title_parts[0]}章：{title_parts[1] if len(title_parts) > 1 else '未命名'}"
-                    chapter_content = chapter_parts[1].strip() if len(chapter_parts) > 1 else ""
+                    text = await finished
                 except Exception as e:
-                    logger.warning(f"解析章节{i}梗概时出错: {str(e)}")
-                    chapter_title = f"第{i}章"
-                    chapter_content = synopsis
-                
-                # 添加重试机制
-                max_retries = 3
-                retry_count = 0
-                content = ""
-                
-                while retry_count < max_retries:
-                    response = await self._call_api([
-                        {"role": "system", "content": CONTENT_CREATION_SYSTEM_PROMPT},
-                        {"role": "user", "content": f"""
-请根据以下信息创作小说章节的具体内容：
-
-小说基本信息：
-标题：{meta_info.get('title', '未命名')}
-主题：{', '.join(meta_info.get('themes', []))}
-基调：{meta_info.get('tone', '')}
-
-本章信息：
-{chapter_title}
-
-本章梗概：
-{chapter_content}
-
-主要人物：
-{meta_info.get('characters', '')}
-
-创作要求：
-1. 字数要求：必须超过{REQUIRED_WORDS}字，建议2500-3500字
-   - 如果内容不足{REQUIRED_WORDS}字，请继续补充
-   - 保持情节的完整性和连贯性
-   - 不要为凑字数而冗长
-
-2. 情节结构：
-   - 反转与震撼（35%）：意外展现、打脸装逼
-   - 期待与升级（35%）：能力提升、资源获取
-   - 场景描写（20%）：震撼场面、众人反应
-   - 对话设计（10%）：金句对决、暗藏玄机
-
-3. 爽感要求：
-   - 情节要出人意料
-   - 打脸要干脆利落
-   - 升级要令人期待
-   - 反转要令人震惊
-
-4. 写作要点：
-   - 合理铺垫伏笔
-   - 制造期待感
-   - 突出震撼效果
-   - 保持爽感节奏
-
-请直接开始创作本章正文，确保字数超过{REQUIRED_WORDS}字：
-"""}], complexity="complex")
-                    
-                    content = response.strip()
-                    word_count = len(content)
-                    
-                    if word_count >= MIN_WORDS:  # 使用较低的阈值进行检查
-                        logger.info(f"第{i}章生成成功，字数：{word_count}")
-                        break
-                    else:
-                        retry_count += 1
-                        logger.warning(f"第{i}章字数不足（{word_count}字），第{retry_count}次重试...")
-                
-                if word_count < MIN_WORDS:
-                    logger.error(f"第{i}章生成失败，字数不足：{word_count}字")
-                
-                # 格式化章节内容，确保标题格式统一
-                formatted_chapter = f"{chapter_title}\n\n{content}\n"
-                chapters.append(formatted_chapter)
-                logger.info(f"第{i}章内容生成完成")
-            
+                    # 单个候选失败不影响其余候选，全部失败时才抛出
+                    error = e
+                    continue
+                scored += 1
+                score = score_chapter(text, chapter_synopsis, MIN_WORDS, REQUIRED_WORDS,
+                                      check_repetition=self.router is not None, keywords=keywords)
+                if best is None or (score.passed, score.total) > (best[1].passed, best[1].total):
+                    best = (text, score)
+                if score.passed and score.total >= self.accept_score:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if best is None:
+            raise error
+        logger.info(f"第{i}章评分{scored}/{self.samples}份候选，采用评分{best[1].total:.2f}的一份"
+                    f"（字数{best[1].length:.2f}，重复{best[1].repetition:.2f}，"
+                    f"覆盖{best[1].coverage:.2f}，格式{best[1].format:.2f}）")
+        return best
+
+    async def _generate_single_chapter(self, meta_info: Dict, i: int,
+                                       chapter_title: str, chapter_content: str,
+                                       on_event: Optional[EventCallback] = None,
+                                       story_context: Optional[StoryContext] = None) -> str:
+        """生成单个章节的正文，字数不足时按retry_strategy重试
+
+        - regenerate：丢弃草稿，重新生成整章
+        - continue：保留草稿，只请求模型从中断处续写
+
+        samples大于1时每次重写都同时请求多份候选并选出最好的一份（见_request_best_chapter），
+        续写仍只请求一份。
+        设置on_event时以流式方式请求，边生成边推送chapter_delta事件。
+        开启detect_degeneration时生成退化会被中止，保留下来的部分按字数不足处理（可续写）。
+        设置story_context时只附带本章相关的人物、设定和前情回顾，而不是完整的角色设计。
+        """
+        logger.info(f"正在生成第{i}章内容...")
+        await self._emit(on_event, {"type": "chapter_start", "index": i, "title": chapter_title})
+        # 本函数总在独立的任务中执行，这里设置的上下文只对本章节的调用生效
+        usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "api_retries": 0}
+        _usage_scope.set(usage)
+        _stage_scope.set("chapters")
+        _chapter_scope.set(i)
+
+        if story_context is not None:
+            context = story_context.build(i, f"{chapter_title}\n{chapter_content}")
+            characters_text = context["characters"]
+            context_sections = ""
+            if context["recap"]:
+                context_sections += f"\n前情回顾：\n{context['recap']}\n"
+            if context["setting"]:
+                context_sections += f"\n相关设定：\n{context['setting']}\n"
+        else:
+            characters_text = meta_info.get('characters', '')
+            context_sections = ""
+        # 超出上下文窗口时先压缩设定与前情回顾，再压缩人物；本章梗概总是完整保留
+        sections = [PromptSection("context", context_sections, priority=0),
+                    PromptSection("characters", characters_text, priority=1)]
+
+        # 完整模式下角色设计属于全书共享的前缀，compact模式下随章节变化
+        base_messages = get_chapter_content_messages(
+            meta_info, chapter_title, chapter_content, REQUIRED_WORDS,
+            characters=characters_text if story_context is not None else None, context=context_sections
+        )
+
+        # 添加重试机制；设置router时每次重试同时升级档位
+        max_retries = 3
+        retry_count = 0
+        content = ""
+        word_count = 0
+        failure = None
+        aborted_count = 0
+        tiers = self.router.plan("chapters") if self.router is not None else ["complex"]
+
+        best_score: Optional[ChapterScore] = None
+
+        while retry_count < max_retries:
+            tier = tiers[min(retry_count, len(tiers) - 1)]
+            if self.samples > 1 and retry_count == 0 and self.sample_tier is not None:
+                tier = self.sample_tier
+            model = self._resolve_model(tier)
+            # 重试时跳过缓存，否则会拿回同一份不合格的结果
+            use_cache = retry_count == 0
+            if content and self.retry_strategy == "continue" and failure == "length":
+                # 把已有草稿作为上文，只补写缺少的部分
+                messages = base_messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": CHAPTER_CONTINUATION_PROMPT.format(
+                        written_words=word_count,
+                        required_words=REQUIRED_WORDS,
+                        remaining_words=REQUIRED_WORDS - word_count
+                    )}
+                ]
+                response, aborted = await self._request_chapter_text(
+                    messages, i, use_cache, on_event, tier,
+                    completion_budget(REQUIRED_WORDS - word_count, model), sections
+                )
+                content = f"{content}{response}".strip()
+            else:
+                if retry_count > 0:
+                    # 通知调用方丢弃上一次不合格的草稿
+                    await self._emit(on_event, {"type": "chapter_reset", "index": i})
+                if self.samples > 1:
+                    response, best_score = await self._request_best_chapter(
+                        base_messages, i, chapter_content, use_cache, tier,
+                        completion_budget(REQUIRED_WORDS, model), sections
+                    )
+                    aborted = None
+                    await self._emit(on_event, {"type": "chapter_delta", "index": i, "text": response})
+                else:
+                    response, aborted = await self._request_chapter_text(
+                        base_messages, i, use_cache, on_event, tier, completion_budget(REQUIRED_WORDS, model),
+                        sections
+                    )
+                content = response.strip()
+
+            word_count = len(content)
+            if aborted is not None:
+                aborted_count += 1
+                # 已推送的文本包含退化的部分，通知调用方以保留下来的草稿为准
+                await self._emit(on_event, {"type": "chapter_reset", "index": i})
+                await self._emit(on_event, {"type": "chapter_delta", "index": i, "text": content})
+            # 未设置router时只检查字数（使用较低的阈值），设置时还检查重复
+            failure = check_chapter(content, MIN_WORDS, check_repetition=self.router is not None)
+            if self.router is not None:
+                self.router.record("chapters", tier, failure is None)
+
+            if failure is None:
+                logger.info(f"第{i}章生成成功，字数：{word_count}（档位：{tier}）")
+                break
+            else:
+                retry_count += 1
+                # 重复的草稿无法通过续写修复，总是重写
+                action = "续写" if self.retry_strategy == "continue" and failure == "length" else "重试"
+                reason = f"字数不足（{word_count}字）" if failure == "length" else "内容重复"
+                if aborted is not None:
+                    reason = f"生成中止后{reason}"
+                logger.warning(f"第{i}章{reason}，第{retry_count}次{action}...")
+
+        if failure is not None:
+            logger.error(f"第{i}章生成失败，{'字数不足' if failure == 'length' else '内容重复'}：{word_count}字")
+
+        self.chapter_stats[i] = dict(usage, strategy=self.retry_strategy, words=word_count,
+                                     attempts=min(retry_count + 1, max_retries), tier=tier,
+                                     aborted=aborted_count,
+                                     score=best_score.total if best_score is not None else None)
+        logger.info(f"第{i}章内容生成完成（策略：{self.retry_strategy}，档位：{tier}，调用{usage['calls']}次，"
+                    f"输入{usage['prompt_tokens']} tokens，输出{usage['completion_tokens']} tokens）")
+        # 格式化章节内容，确保标题格式统一
+        formatted_chapter = f"{chapter_title}\n\n{content}\n"
+        await self._emit(on_event, {"type": "chapter_end", "index": i, "content": formatted_chapter})
+        return formatted_chapter
+
+    async def _index_chapter(self, index: int, content: str, on_event: Optional[EventCallback]):
+        """把完成的章节加入人物/地点索引，发现新的不一致时记录警告并产出consistency事件"""
+        if self.entity_index is None:
+            return
+        issues = self.entity_index.add_chapter(index, content)
+        for issue in issues:
+            logger.warning(f"第{issue.chapter}章一致性问题：{issue.detail}")
+        if issues:
+            await self._emit(on_event, {"type": "consistency", "index": index,
+                                        "issues": [asdict(issue) for issue in issues]})
+
+    async def _generate_chapters_content(self, meta_info: Dict, chapter_synopses: Union[str, SynopsisFeed],
+                                         on_event: Optional[EventCallback] = None,
+                                         checkpoint: Optional[CheckpointStore] = None) -> List[str]:
+        """生成所有章节的具体内容，返回章节列表
+
+        chapter_synopses: 完整的梗概文本，或梗概生成过程中逐章到达的SynopsisFeed；
+        后者每到达一章就开始生成该章，不必等待全部梗概完成。
+        最多同时生成max_concurrency个章节，返回结果始终按章节顺序排列。
+        断点中已保存且输入指纹一致的章节直接复用，新完成的章节连同指纹立即写入断点。
+        """
+        try:
+            logger.info(f"开始生成章节内容...（并发数：{self.max_concurrency}）")
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            if isinstance(chapter_synopses, str):
+                chapter_synopses = SynopsisFeed.from_chapters(parse_synopses(chapter_synopses))
+
+            story_context = None
+            if self.context_mode == "compact":
+                # 梗概逐章加入索引，前情回顾只使用已经到达的梗概
+                story_context = self._compact_context(meta_info)
+                logger.info(f"使用精简上下文：已索引{len(story_context.characters)}个角色，"
+                            f"{len(story_context.setting_sections)}段设定")
+
+            self.entity_index = None
+            if self.check_consistency:
+                self.entity_index = EntityIndex.from_story(meta_info.get('characters', ''),
+                                                           meta_info.get('setting', ''))
+                logger.info(f"一致性检查：已索引{len(self.entity_index.character_names)}个角色，"
+                            f"{len(self.entity_index.entities) - len(self.entity_index.character_names)}个地点")
+
+            async def generate(chapter: ChapterSynopsis) -> str:
+                chapter_fingerprint = None
+                if checkpoint is not None:
+                    chapter_fingerprint = self._chapter_fingerprint(meta_info, chapter, story_context)
+                    status = checkpoint.chapter_status(chapter.number, chapter_fingerprint)
+                    if status == "fresh":
+                        saved = checkpoint.get_chapter(chapter.number)
+                        checkpoint.adopt_fingerprint("chapters", chapter.number, chapter_fingerprint)
+                        logger.info(f"从断点恢复第{chapter.number}章")
+                        await self._emit(on_event, {"type": "chapter_end", "index": chapter.number, "content": saved})
+                        if story_context is not None:
+                            story_context.record_chapter(chapter.number, saved)
+                        await self._index_chapter(chapter.number, saved, on_event)
+                        chapter_synopses.mark_done(chapter.number)
+                        return saved
+                    if status == "stale":
+                        # 先删除旧章节，中断时输出目录中写了一半的章节不会被当作手工修改
+                        logger.info(f"第{chapter.number}章的输入已变化，重新生成")
+                        checkpoint.invalidate_chapters([chapter.number], force=False)
+                    # 本任务只生成这一章，设置的上下文不影响其他章节
+                    _refresh_scope.set(checkpoint.is_forced("chapters", chapter.number))
+                async with semaphore:
+                    content = await self._generate_single_chapter(
+                        meta_info, chapter.number, chapter.heading, chapter.body, on_event, story_context
+                    )
+                if story_context is not None:
+                    story_context.record_chapter(chapter.number, content)
+                await self._index_chapter(chapter.number, content, on_event)
+                if checkpoint is not None:
+                    checkpoint.save_chapter(chapter.number, content, chapter_fingerprint)
+                chapter_synopses.mark_done(chapter.number)
+                return content
+
+            def chapter_done(task: asyncio.Future):
+                # 章节失败时中止梗概的传递：下面的循环不再等待剩余梗概，
+                # 分层大纲的展开也不再等待永远不会完成的章节（见SynopsisFeed.abort）
+                if not task.cancelled() and task.exception() is not None:
+                    chapter_synopses.abort(task.exception())
+
+            tasks: Dict[int, asyncio.Future] = {}
+            try:
+                async for chapter in chapter_synopses:
+                    if story_context is not None:
+                        story_context.add_synopsis(chapter)
+                    tasks[chapter.number] = asyncio.ensure_future(generate(chapter))
+                    tasks[chapter.number].add_done_callback(chapter_done)
+                chapters = await asyncio.gather(*tasks.values())
+            except BaseException:
+                # 任一章节失败时取消其余仍在运行的章节
+                for task in tasks.values():
+                    task.cancel()
+                raise
+
             logger.info("所有章节内容生成完成")
-            return chapters
+            return [content for _, content in sorted(zip(tasks, chapters))]
         except Exception as e:
             logger.error(f"生成章节内容时出错: {str(e)}")
             raise
 
-    async def create_story(self, prompt: str) -> Dict:
-        """创建完整的故事"""
+    async def _run_stage(self, name: str, produce: Callable[[], Awaitable],
+                         checkpoint: Optional[CheckpointStore] = None,
+                         stage_fingerprint: Optional[str] = None):
+        """执行一个创作步骤；断点中已有该步骤的产物且输入指纹一致时直接复用
+
+        stage_fingerprint: 本次的输入指纹（见_stage_fingerprint），为None时不检查指纹
+        """
+        refresh = False
+        if checkpoint is not None:
+            if stage_fingerprint is None:
+                status = "fresh" if checkpoint.has_stage(name) else "missing"
+            else:
+                status = checkpoint.stage_status(name, stage_fingerprint)
+            if status == "fresh":
+                logger.info(f"从断点恢复步骤：{name}")
+                if stage_fingerprint:
+                    checkpoint.adopt_fingerprint("stages", name, stage_fingerprint)
+                return checkpoint.get_stage(name)
+            if status == "stale":
+                logger.info(f"步骤{name}的输入已变化，重新生成")
+            refresh = checkpoint.is_forced("stages", name)
+        token = _stage_scope.set(name)
+        refresh_token = _refresh_scope.set(refresh)
         try:
-            logger.info("开始创建新故事...")
+            value = await produce()
+        finally:
+            _refresh_scope.reset(refresh_token)
+            _stage_scope.reset(token)
+        if checkpoint is not None:
+            checkpoint.save_stage(name, value, stage_fingerprint)
+        return value
+
+    def _stage_fingerprint(self, name: str, values: Dict) -> str:
+        """步骤的输入指纹：提示词模板、所用模型与各输入（提示词、上游产物）的内容
+
+        分层大纲模式下梗概步骤还包括大纲形状与写到的章节数，调高max_chapters后梗概步骤重新展开，
+        已展开的卷和篇仍各自按指纹复用（见_outline_node）。
+        """
+        template, complexity = STAGE_TEMPLATES[name]
+        parts = [name, template, self.model_type, self._resolve_model(complexity),
+                 [[key, values[key]] for key in sorted(values)]]
+        if name == "synopses" and self.outline_shape is not None:
+            parts += [ARC_SYNOPSIS_REQUIREMENTS_PROMPT, str(self.outline_shape), self._chapter_limit()]
+        return fingerprint(*parts)
+
+    def _compact_context(self, meta_info: Dict) -> StoryContext:
+        """compact模式的章节上下文索引，梗概与已完成的章节在生成过程中逐章加入"""
+        return StoryContext(meta_info.get('characters', ''), meta_info.get('setting', ''), [],
+                            token_budget=self.context_budget)
+
+    def _chapter_fingerprint(self, meta_info: Dict, chapter: ChapterSynopsis,
+                             story_context: Optional[StoryContext] = None) -> str:
+        """章节的输入指纹：完整上下文下本章请求的消息（模板、标题、主题、基调、角色与本章梗概）和所用模型
+
+        修改某一章的梗概只影响这一章。compact模式下还包括本章可能用到的设定段落与上下文预算
+        （见StoryContext.setting_excerpt），修改世界观时只有用到改动段落的章节失效；
+        前情回顾取自相邻章节，不计入指纹，相邻章节重新生成时本章不会随之失效。
+        story_context: compact模式下可传入已建立的索引，未传入时按meta_info建立
+        """
+        messages = get_chapter_content_messages(meta_info, chapter.heading, chapter.body, REQUIRED_WORDS)
+        parts = ["chapter", messages, MIN_WORDS, self.model_type, self._resolve_model("complex")]
+        if self.context_mode == "compact":
+            story_context = story_context or self._compact_context(meta_info)
+            parts += [self.context_budget, story_context.setting_excerpt(f"{chapter.heading}\n{chapter.body}")]
+        return fingerprint(*parts)
+
+    async def _analyze_themes(self, prompt: str) -> List[str]:
+        themes_content = await self._call_routed([
+            {"role": "system", "content": THEME_ANALYSIS_PROMPT},
+            {"role": "user", "content": prompt}
+        ], complexity="complex", gate=lambda text: None if text.strip() else "empty",
+            max_tokens=completion_budget(STAGE_OUTPUT_CHARS["themes"]))
+        # 解析主题
+        return [theme.strip() for theme in themes_content.split('\n') if theme.strip()]
+
+    async def _generate_title(self, prompt: str, themes: List[str]) -> str:
+        """生成小说标题，返回“主标题：副标题”形式的字符串"""
+        response = await self._call_routed([
+            {"role": "system", "content": TITLE_GENERATION_PROMPT},
+            {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}"}
+        ], complexity="medium",
+            gate=lambda text: None if (_parse_json_block(text) or {}).get("main_title") else "format",
+            max_tokens=completion_budget(STAGE_OUTPUT_CHARS["title"]))
+        parsed = _parse_json_block(response)
+        if parsed is None or not parsed.get("main_title"):
+            logger.warning("标题格式无法解析，使用回复的第一行作为标题")
+            return response.strip().split("\n")[0].strip("《》\"")
+        title = str(parsed["main_title"]).strip("《》")
+        if parsed.get("sub_title"):
+            title = f"{title}：{str(parsed['sub_title']).strip('《》')}"
+        return title
+
+    async def _analyze_tone(self, prompt: str, themes: List[str]) -> str:
+        return (await self._call_routed([
+            {"role": "system", "content": TONE_ANALYSIS_PROMPT},
+            {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}"}
+        ], complexity="medium", gate=lambda text: None if text.strip() else "empty",
+            max_tokens=completion_budget(STAGE_OUTPUT_CHARS["tone"]))).strip()
+
+    async def _generate_section_titles(self, prompt: str, themes: List[str]) -> Dict[str, str]:
+        """生成故事五个部分（起因、经过、发展、高潮、结局）的标题"""
+        response = await self._call_routed([
+            {"role": "system", "content": SECTION_TITLE_PROMPT},
+            {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}"}
+        ], complexity="simple", gate=lambda text: None if _parse_json_block(text) else "format",
+            max_tokens=completion_budget(STAGE_OUTPUT_CHARS["section_titles"]))
+        parsed = _parse_json_block(response)
+        if parsed is None:
+            logger.warning("分部标题格式无法解析，已忽略")
+            return {}
+        return {str(k): str(v) for k, v in parsed.items()}
+
+    def _stage_budget(self, name: str) -> int:
+        """规划步骤（均使用complex档位）的输出预算"""
+        return completion_budget(STAGE_OUTPUT_CHARS[name], self._resolve_model("complex"))
+
+    def _build_stage_graph(self, on_event: Optional[EventCallback],
+                           checkpoint: Optional[CheckpointStore]) -> StageGraph:
+        """创作流程的步骤依赖图
+
+        themes ─┬─ title / tone / section_titles
+                └─ setting ─ characters ─┬─ outline
+                                         └─ synopses ┄ chapters
+        标题、基调、分部标题只依赖提示词和主题，与世界观、角色同时生成；
+        章节梗概不使用大纲，与大纲同时生成。章节正文不等待synopses步骤结束，
+        而是通过SynopsisFeed逐章接收梗概，每解析出一章就开始生成。
+        设置outline_shape时synopses步骤按分层大纲逐篇展开（见_expand_outline）。
+        """
+        def stage(name: str, inputs: tuple, produce: Callable[[Dict], Awaitable],
+                  on_done: Optional[Callable[[object], None]] = None) -> Stage:
+            async def run(values: Dict):
+                value = await self._run_stage(name, lambda: produce(values), checkpoint,
+                                              self._stage_fingerprint(name, values))
+                self.current_story[name] = value
+                if on_done is not None:
+                    on_done(value)
+                logger.info(f"步骤完成：{name}")
+                await self._emit(on_event, {"type": "stage", "name": name, "content": value})
+                return value
+            return Stage(name, inputs, run)
+
+        synopsis_feed = SynopsisFeed()
+
+        def synopses(values: Dict) -> Awaitable[str]:
+            # 从current_story中读取标题、主题、世界观和角色
+            if self.outline_shape is not None:
+                return self._expand_outline(self.current_story, synopsis_feed, checkpoint, on_event)
+            return self._generate_chapter_synopses(self.current_story, on_chapter=synopsis_feed.put)
+
+        def synopses_done(value: str):
+            # 从断点恢复时梗概整体到达；正常生成时已逐章传递，重复的章节会被忽略
+            for chapter in parse_synopses(value):
+                synopsis_feed.put(chapter)
+            synopsis_feed.close()
 
-            # 1. 分析主题（复杂任务）
-            logger.info("Step 1/6: 分析故事主题...")
-            themes_content = await self._call_api([
-                {"role": "system", "content": THEME_ANALYSIS_PROMPT},
-                {"role": "user", "content": prompt}
-            ], complexity="complex")
-            
-            # 解析主题
-            themes = [theme.strip() for theme in themes_content.split('\n') if theme.strip()]
-            self.current_story["themes"] = themes
-            logger.info(f"主题分析完成: {themes}")
-
-            # 2. 创建世界观设定（复杂任务）
-            logger.info("Step 2/6: 创建世界观设定...")
-            setting = await self._call_api([
+        async def chapters(values: Dict) -> List[str]:
+            content = await self._generate_chapters_content(
+                meta_info=self.current_story,
+                chapter_synopses=synopsis_feed,
+                on_event=on_event,
+                checkpoint=checkpoint
+            )
+            self.current_story["content"] = content
+            return content
+
+        return StageGraph([
+            stage("themes", ("prompt",), lambda v: self._analyze_themes(v["prompt"])),
+            stage("title", ("prompt", "themes"), lambda v: self._generate_title(v["prompt"], v["themes"])),
+            stage("tone", ("prompt", "themes"), lambda v: self._analyze_tone(v["prompt"], v["themes"])),
+            stage("section_titles", ("prompt", "themes"),
+                  lambda v: self._generate_section_titles(v["prompt"], v["themes"])),
+            stage("setting", ("prompt", "themes"), lambda v: self._call_api([
                 {"role": "system", "content": SETTING_GENERATION_PROMPT},
-                {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}"}
-            ], complexity="complex")
-            
-            self.current_story["setting"] = setting
-            logger.info("世界观设定完成")
-
-            # 3. 设计角色（复杂任务）
-            logger.info("Step 3/6: 设计角色...")
-            characters = await self._call_api([
+                {"role": "user", "content": f"故事提示：{v['prompt']}\n主题：{v['themes']}"}
+            ], complexity="complex", max_tokens=self._stage_budget("setting"))),
+            stage("characters", ("prompt", "themes", "setting"), lambda v: self._call_api([
                 {"role": "system", "content": CHARACTER_DESIGN_PROMPT},
-                {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}\n世界观：{setting}"}
-            ], complexity="complex")
-            
-            self.current_story["characters"] = characters
-            logger.info("角色设计完成")
-
-            # 4. 创建故事大纲（复杂任务）
-            logger.info("Step 4/6: 创建故事大纲...")
-            outline = await self._call_api([
+                {"role": "user", "content": f"故事提示：{v['prompt']}\n主题：{v['themes']}\n世界观：{v['setting']}"}
+            ], complexity="complex", max_tokens=self._stage_budget("characters"),
+                sections=[PromptSection("setting", v["setting"])])),
+            stage("outline", ("prompt", "themes", "setting", "characters"), lambda v: self._call_api([
                 {"role": "system", "content": STORY_OUTLINE_PROMPT},
-                {"role": "user", "content": f"故事提示：{prompt}\n主题：{themes}\n世界观：{setting}\n角色：{characters}"}
-            ], complexity="complex")
-            
-            self.current_story["outline"] = outline
-            logger.info("故事大纲创建完成")
-            
-            # 5. 生成章节梗概（复杂任务）
-            logger.info("Step 5/6: 生成章节梗概...")
-            chapter_synopses = await self._generate_chapter_synopses(self.current_story)
-            self.current_story["synopses"] = chapter_synopses
-            
-            # 6. 生成具体内容（复杂任务）
-            logger.info("Step 6/6: 生成详细故事内容...")
-            story_content = await self._generate_chapters_content(
-                meta_info=self.current_story,
-                chapter_synopses=chapter_synopses
-            )
-            self.current_story["content"] = story_content
-            
-            logger.info("故事创作完成")
+                {"role": "user", "content": f"故事提示：{v['prompt']}\n主题：{v['themes']}\n"
+                                            f"世界观：{v['setting']}\n角色：{v['characters']}"}
+            ], complexity="complex", max_tokens=self._stage_budget("outline"),
+                sections=[PromptSection("setting", v["setting"], priority=0),
+                          PromptSection("characters", v["characters"], priority=1)])),
+            stage("synopses", ("title", "themes", "setting", "characters"), synopses, on_done=synopses_done),
+            # 章节正文使用标题、主题、基调、角色，compact模式还会用到世界观；梗概来自synopsis_feed
+            Stage("chapters", ("title", "themes", "tone", "setting", "characters"), chapters)
+        ])
+
+    def plan_rebuild(self, prompt: str, checkpoint: CheckpointStore) -> Dict[str, Dict]:
+        """不调用模型，按断点中的产物与输入指纹判断再次运行时需要生成哪些步骤和章节
+
+        返回{"stages": {步骤名: 状态}, "chapters": {章节序号: 状态}}，状态为fresh、stale、missing
+        （见CheckpointStore），或pending：上游需要重新生成，要等其完成后才能确定。
+        上游重新生成后内容没有变化时，pending的部分仍会直接复用。梗概需要重新生成时章节为空。
+        """
+        graph = self._build_stage_graph(None, checkpoint)
+        stages: Dict[str, str] = {}
+        values: Dict = {"prompt": prompt}
+        for name in graph.order(values):
+            inputs = graph.stages[name].inputs
+            if name == "chapters":
+                continue
+            if not checkpoint.has_stage(name):
+                stages[name] = "missing"
+            elif any(stages.get(dep, "fresh") != "fresh" for dep in inputs):
+                stages[name] = "pending"
+            else:
+                stages[name] = checkpoint.stage_status(
+                    name, self._stage_fingerprint(name, {dep: values[dep] for dep in inputs}))
+            if stages[name] == "fresh":
+                values[name] = checkpoint.get_stage(name)
+
+        chapters: Dict[int, str] = {}
+        if "synopses" in values:
+            upstream_fresh = all(stages[dep] == "fresh" for dep in graph.stages["chapters"].inputs)
+            story_context = self._compact_context(values) if self.context_mode == "compact" else None
+            for chapter in parse_synopses(values["synopses"]):
+                if not checkpoint.has_chapter(chapter.number):
+                    chapters[chapter.number] = "missing"
+                elif not upstream_fresh:
+                    chapters[chapter.number] = "pending"
+                else:
+                    chapters[chapter.number] = checkpoint.chapter_status(
+                        chapter.number, self._chapter_fingerprint(values, chapter, story_context))
+        return {"stages": stages, "chapters": chapters}
+
+    async def create_story(self, prompt: str, on_event: Optional[EventCallback] = None,
+                           checkpoint: Optional[CheckpointStore] = None) -> Dict:
+        """创建完整的故事
+
+        各步骤按依赖关系调度（见_build_stage_graph），互不依赖的步骤同时执行。
+        on_event: 可选的异步回调，每完成一个步骤或收到章节文本时调用，见stream_story
+        checkpoint: 可选的断点存储，每个步骤和章节完成后写入；已有的产物在输入指纹一致时直接复用，
+            否则重新生成（只重新生成受影响的部分，见plan_rebuild）
+        """
+        try:
+            logger.info("开始创建新故事...")
+            self.stage_graph = self._build_stage_graph(on_event, checkpoint)
+            await self.stage_graph.run({"prompt": prompt})
+            logger.info(f"故事创作完成（关键路径：{' -> '.join(self.stage_graph.critical_path())}）")
             return self.current_story
 
         except Exception as e:
             logger.error(f"故事创作过程出错: {str(e)}")
             raise
 
-def create_agent(model_type: str, api_key: str, base_url: Optional[str] = None) -> NovelAIAgent:
-    """创建AI代理"""
-    return NovelAIAgent(api_key=api_key, base_url=base_url, model_type=model_type) 
\ No newline at end of file
+    async def stream_story(self, prompt: str,
+                           checkpoint: Optional[CheckpointStore] = None) -> AsyncIterator[Dict]:
+        """以流式事件的形式创建故事，产出的事件依次为：
+
+        - {"type": "stage", "name": 步骤名, "content": 产物}：STORY_STAGES中的各步骤，按完成先后出现
+        - {"type": "chapter_start", "index": 章节序号, "title": 章节标题}
+        - {"type": "chapter_delta", "index": 章节序号, "text": 新生成的文本}
+        - {"type": "chapter_reset", "index": 章节序号}：字数不足需要重写或生成中途被中止，之前的文本作废
+          （中止时随后的chapter_delta先给出保留下来的草稿）
+        - {"type": "chapter_end", "index": 章节序号, "content": 格式化后的完整章节}
+        - {"type": "consistency", "index": 章节序号, "issues": [...]}：check_consistency时，该章加入索引后
+          新发现的不一致（见entities.ConsistencyIssue，问题所在的章节可能是之前完成的其他章节）
+        - {"type": "outline", "tree": 大纲树}：设置outline_shape时，每展开一个卷或篇产出一次
+          已展开的全部大纲（见outline.OutlineTree.to_dict）
+
+        互不依赖的步骤同时执行，并发生成章节时不同章节的事件会交错出现。全部完成后完整结果保存在current_story中。
+        从断点恢复时，已完成的步骤和章节同样以stage和chapter_end事件产出。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        task = asyncio.ensure_future(self.create_story(prompt, on_event=queue.put, checkpoint=checkpoint))
+        task.add_done_callback(lambda _: queue.put_nowait(finished))
+        try:
+            while True:
+                event = await queue.get()
+                if event is finished:
+                    break
+                yield event
+            # 传递创作过程中的异常
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+def create_agent(model_type: str, api_key: str, base_url: Optional[str] = None, **kwargs) -> NovelAIAgent:
+    """创建AI代理，其余参数（并发数、限流额度等）原样传给NovelAIAgent"""
+    return NovelAIAgent(api_key=api_key, base_url=base_url, model_type=model_type, **kwargs) 
\ No newline at end of file
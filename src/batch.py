@@ -0,0 +1,261 @@
+"""
+批量创作多部小说：所有任务共用一个限流的调用池
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .agent import STORY_STAGES, NovelAIAgent
+from .checkpoint import CheckpointStore, atomic_write
+from .container import NovelContainerWriter
+from .metrics import JsonlSink, MetricsRecorder
+from .rate_limit import RateLimiter
+from .synopsis import parse_synopses
+from .writer import StoryWriter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchJob:
+    """批量任务中的一部小说"""
+    job_id: str
+    model_type: str
+    genre: str
+    prompt: str
+
+
+@dataclass
+class JobProgress:
+    """单个任务的进度"""
+    job_id: str
+    model_type: str
+    genre: str
+    status: str = "pending"          # pending、running、done、failed（服务中还有cancelled）
+    stages_done: int = 0
+    chapters_total: int = 0
+    chapters_done: int = 0           # 已完成的章节（含从断点恢复的）
+    chapters_generated: int = 0      # 本次运行实际生成的章节
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    metrics: Dict = field(default_factory=dict)
+
+
+def track_progress(progress: JobProgress, event: Dict, generating: set):
+    """按流式创作事件更新任务进度；generating记录本次运行中开始生成的章节"""
+    event_type = event["type"]
+    if event_type == "stage":
+        progress.stages_done += 1
+        if event["name"] == "synopses":
+            progress.chapters_total = len(parse_synopses(event["content"]))
+    elif event_type == "chapter_start":
+        generating.add(event["index"])
+    elif event_type == "chapter_end":
+        progress.chapters_done += 1
+        if event["index"] in generating:
+            generating.discard(event["index"])
+            progress.chapters_generated += 1
+
+
+# 根据任务和共享资源创建代理：factory(job, rate_limiter=..., call_slots=..., metrics=...)
+AgentFactory = Callable[..., NovelAIAgent]
+
+
+def load_manifest(path: str, prompt_loader: Callable[[str], str]) -> List[BatchJob]:
+    """读取批量任务清单，展开为 题材/提示词 × 模型 的任务列表
+
+    清单为JSON文件，格式如下：
+        {
+          "models": ["puyu", "glm"],
+          "items": [
+            "科幻",
+            {"genre": "悬疑", "models": ["glm"]},
+            {"id": "custom", "genre": "奇幻", "prompt": "完整的创作提示词"}
+          ]
+        }
+
+    items中的字符串表示题材；对象可单独指定模型列表、任务名和完整提示词，
+    未指定提示词时用prompt_loader按题材生成。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except Exception as e:
+        logger.error(f"读取任务清单时出错: {str(e)}")
+        raise
+
+    default_models = manifest.get("models", ["puyu"])
+    jobs = []
+    for n, item in enumerate(manifest.get("items", []), 1):
+        if isinstance(item, str):
+            item = {"genre": item}
+        genre = item.get("genre", "")
+        prompt = item.get("prompt") or prompt_loader(genre)
+        name = item.get("id") or genre or f"item{n}"
+        for model_type in item.get("models", default_models):
+            jobs.append(BatchJob(
+                job_id=f"{n:03d}_{model_type}_{name}",
+                model_type=model_type,
+                genre=genre,
+                prompt=prompt
+            ))
+
+    job_ids = [job.job_id for job in jobs]
+    if len(set(job_ids)) != len(job_ids):
+        raise ValueError("任务清单中存在重复的任务，请为同一题材的条目指定不同的id")
+    logger.info(f"已加载任务清单：{len(jobs)}个任务")
+    return jobs
+
+
+class BatchRunner:
+    """批量运行多个创作任务
+
+    每个任务使用独立的NovelAIAgent实例（current_story等状态互不影响）、
+    独立的输出目录与断点；所有任务的各个步骤共用同一组资源：
+    - call_slots：全部任务同时进行中的模型调用总数不超过workers
+    - 每个提供方一个限流器，按该提供方的RPM/TPM额度统一限流
+
+    输出目录下每个任务一个子目录，结构与单次创作相同；再次运行同一输出目录时
+    已完成的步骤和章节从断点恢复。运行结束后写入batch_report.json。
+    """
+
+    def __init__(self, jobs: List[BatchJob], agent_factory: AgentFactory, output_base: str,
+                 workers: int = 8, provider_limits: Optional[Dict[str, Dict]] = None,
+                 report_interval: float = 30.0, container: bool = False):
+        """
+        agent_factory: 按任务创建代理，需把rate_limiter、call_slots、metrics传给NovelAIAgent
+        workers: 所有任务合计的最大并发调用数
+        provider_limits: 各提供方的限流额度，如{"glm": {"requests_per_minute": 60, "tokens_per_minute": None}}
+        report_interval: 输出进度日志的间隔（秒）
+        container: 同时把每部小说写入其输出目录下的单文件容器novel.nvl
+        """
+        self.jobs = jobs
+        self.agent_factory = agent_factory
+        self.output_base = output_base
+        self.workers = max(1, workers)
+        self.provider_limits = provider_limits or {}
+        self.report_interval = report_interval
+        self.container = container
+        self.progress: Dict[str, JobProgress] = {
+            job.job_id: JobProgress(job.job_id, job.model_type, job.genre) for job in jobs
+        }
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._started: Optional[float] = None
+
+    def _rate_limiter(self, model_type: str) -> RateLimiter:
+        """同一提供方的任务共用一个限流器"""
+        if model_type not in self._rate_limiters:
+            limits = self.provider_limits.get(model_type, {})
+            self._rate_limiters[model_type] = RateLimiter(
+                limits.get("requests_per_minute"), limits.get("tokens_per_minute")
+            )
+        return self._rate_limiters[model_type]
+
+    async def _run_job(self, job: BatchJob, call_slots: asyncio.Semaphore):
+        progress = self.progress[job.job_id]
+        output_dir = os.path.join(self.output_base, job.job_id)
+        checkpoint = CheckpointStore(output_dir)
+        creation_time = checkpoint.meta.get("creation_time") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        checkpoint.save_meta({
+            "model_type": job.model_type,
+            "genre": job.genre,
+            "prompt": job.prompt,
+            "creation_time": creation_time
+        })
+
+        metrics = MetricsRecorder([JsonlSink(os.path.join(output_dir, "metrics.jsonl"))])
+        agent = self.agent_factory(
+            job, rate_limiter=self._rate_limiter(job.model_type), call_slots=call_slots, metrics=metrics
+        )
+        container = NovelContainerWriter(os.path.join(output_dir, "novel.nvl")) if self.container else None
+        writer = StoryWriter(output_dir, {
+            "model_type": job.model_type,
+            "model_name": agent.model,
+            "creation_time": creation_time
+        }, container)
+
+        progress.status = "running"
+        progress.started = time.time()
+        generating = set()
+        logger.info(f"[{job.job_id}] 开始创作")
+        try:
+            async for event in agent.stream_story(job.prompt, checkpoint=checkpoint):
+                writer.handle(event)
+                track_progress(progress, event, generating)
+            progress.status = "done"
+            logger.info(f"[{job.job_id}] 创作完成，输出目录：{output_dir}")
+        except Exception as e:
+            # 单个任务失败不影响其余任务，断点保留，可重新运行继续
+            progress.status = "failed"
+            progress.error = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"[{job.job_id}] 创作失败: {str(e)}")
+        finally:
+            progress.finished = time.time()
+            writer.close()
+            metrics.write_summary(os.path.join(output_dir, "metrics_summary.json"))
+            metrics.close()
+            progress.metrics = metrics.summary()["total"]
+            await agent.close()
+
+    def summary(self) -> Dict:
+        """全部任务的进度与吞吐量（章/小时，只计本次运行实际生成的章节）"""
+        elapsed = time.time() - self._started if self._started else 0.0
+        jobs = list(self.progress.values())
+        generated = sum(p.chapters_generated for p in jobs)
+        return {
+            "jobs": len(jobs),
+            "done": sum(p.status == "done" for p in jobs),
+            "failed": sum(p.status == "failed" for p in jobs),
+            "running": sum(p.status == "running" for p in jobs),
+            "chapters_done": sum(p.chapters_done for p in jobs),
+            "chapters_total": sum(p.chapters_total for p in jobs),
+            "chapters_generated": generated,
+            "elapsed": round(elapsed, 2),
+            "chapters_per_hour": round(generated / elapsed * 3600, 2) if elapsed > 0 else 0.0
+        }
+
+    def _log_progress(self):
+        totals = self.summary()
+        logger.info(f"批量进度：完成{totals['done']}/{totals['jobs']}部（失败{totals['failed']}），"
+                    f"章节{totals['chapters_done']}/{totals['chapters_total'] or '?'}，"
+                    f"吞吐量{totals['chapters_per_hour']}章/小时")
+        for p in self.progress.values():
+            if p.status == "running":
+                logger.info(f"  [{p.job_id}] 步骤{p.stages_done}/{len(STORY_STAGES)}，"
+                            f"章节{p.chapters_done}/{p.chapters_total or '?'}")
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._log_progress()
+
+    def write_report(self, path: Optional[str] = None):
+        """把进度与吞吐量写入batch_report.json"""
+        path = path or os.path.join(self.output_base, "batch_report.json")
+        report = {
+            "summary": self.summary(),
+            "jobs": [asdict(p) for p in self.progress.values()]
+        }
+        atomic_write(path, json.dumps(report, ensure_ascii=False, indent=2))
+
+    async def run(self) -> Dict:
+        """运行全部任务，返回汇总结果"""
+        os.makedirs(self.output_base, exist_ok=True)
+        logger.info(f"开始批量创作：{len(self.jobs)}个任务，共用{self.workers}个并发调用名额")
+        call_slots = asyncio.Semaphore(self.workers)
+        self._started = time.time()
+        reporter = asyncio.ensure_future(self._report_periodically())
+        try:
+            await asyncio.gather(*(self._run_job(job, call_slots) for job in self.jobs))
+        finally:
+            reporter.cancel()
+            self._log_progress()
+            self.write_report()
+        return self.summary()
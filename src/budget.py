@@ -0,0 +1,167 @@
+"""
+请求的token预算：按模型的上下文窗口检查提示词，超出时压缩低优先级的段落，并按目标字数设置max_tokens
+"""
+
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 各模型的上下文窗口与单次输出上限（token）
+CONTEXT_WINDOWS = {
+    "glm-4-plus": 128000,
+    "glm-4-air": 128000,
+    "glm-4-flash": 128000,
+    "internlm2.5-latest": 32768,
+    "mock-plus": 32768,
+    "mock-air": 32768,
+    "mock-flash": 32768
+}
+MAX_OUTPUT_TOKENS = {
+    "glm-4-plus": 4095,
+    "glm-4-air": 4095,
+    "glm-4-flash": 4095,
+    "internlm2.5-latest": 4096
+}
+# 未登记的模型按较小的窗口处理，宁可多压缩也不发出超长请求
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# 每条消息的格式开销，以及为估算误差预留的余量
+MESSAGE_OVERHEAD_TOKENS = 4
+SAFETY_MARGIN = 0.05
+
+# 输出预算相对目标字数的余量：模型常会略超要求的字数，预算过紧会截断结尾
+COMPLETION_HEADROOM = 1.5
+MIN_COMPLETION_TOKENS = 256
+
+# 各步骤预期的输出字数，用于计算max_tokens；章节正文按REQUIRED_WORDS单独计算
+STAGE_OUTPUT_CHARS = {
+    "themes": 300,
+    "title": 200,
+    "tone": 300,
+    "section_titles": 300,
+    "setting": 3000,
+    "characters": 8000,
+    "outline": 4000,
+    "synopses": 3000
+}
+
+
+@dataclass
+class PromptSection:
+    """提示词中可以压缩的一段文本
+
+    text: 原样出现在消息中的文本，压缩后原位替换
+    priority: 数值越小越先被压缩
+    max_tokens: 无论窗口是否充足，该段最多保留的token数；None表示只在超出窗口时压缩
+    """
+    name: str
+    text: str
+    priority: int = 0
+    max_tokens: Optional[int] = None
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def messages_tokens(messages: Iterable[Dict]) -> int:
+    """估算一组消息的token数，包含每条消息的格式开销"""
+    return sum(estimate_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def completion_budget(chars: int, model: Optional[str] = None) -> int:
+    """生成约chars字所需的max_tokens，不超过模型的单次输出上限"""
+    budget = max(MIN_COMPLETION_TOKENS, math.ceil(chars * COMPLETION_HEADROOM))
+    if model in MAX_OUTPUT_TOKENS:
+        budget = min(budget, MAX_OUTPUT_TOKENS[model])
+    return budget
+
+
+def compress(text: str, max_tokens: int) -> str:
+    """把文本压缩到max_tokens以内：按段落（或行）保留开头部分，再不够时按字截断"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    marker = "\n（以下从略）"
+    budget = max_tokens - estimate_tokens(marker)
+    kept, used = [], 0
+    for block in re.split(r"(?<=\n)", text):
+        cost = estimate_tokens(block)
+        if used + cost > budget:
+            break
+        kept.append(block)
+        used += cost
+    if not kept:
+        # 第一段就超出预算：中文为主的文本按字数近似截断
+        return text[:max(budget, 0)].rstrip() + marker
+    return "".join(kept).rstrip() + marker
+
+
+def _replace_section(messages: List[Dict], old: str, new: str) -> List[Dict]:
+    return [dict(m, content=m.get("content", "").replace(old, new)) if old in m.get("content", "") else m
+            for m in messages]
+
+
+def fit_messages(messages: List[Dict], budget: int,
+                 sections: Sequence[PromptSection] = ()) -> Tuple[List[Dict], int]:
+    """把消息压缩到budget个token以内，返回(压缩后的消息, 减少的token数)
+
+    先按各段落的max_tokens上限压缩，仍超出时按优先级从低到高继续压缩sections中的段落；
+    压缩段落后仍超出时，兜底截断最长的一条消息。
+    """
+    original = messages_tokens(messages)
+    current = [dict(m) for m in messages]
+    for section in sections:
+        if section.max_tokens is not None and section.text:
+            current = _replace_section(current, section.text, compress(section.text, section.max_tokens))
+
+    overflow = messages_tokens(current) - budget
+    for section in sorted(sections, key=lambda s: s.priority):
+        if overflow <= 0:
+            break
+        text = section.text
+        if section.max_tokens is not None:
+            text = compress(text, section.max_tokens)
+        if not text or not any(text in m.get("content", "") for m in current):
+            continue
+        size = estimate_tokens(text)
+        shrunk = compress(text, max(size - overflow, 0))
+        current = _replace_section(current, text, shrunk)
+        logger.warning(f"提示词超出预算，已压缩{section.name}（{size} -> {estimate_tokens(shrunk)} tokens）")
+        overflow = messages_tokens(current) - budget
+
+    if overflow > 0:
+        # 兜底：压缩最长的一条消息
+        longest = max(range(len(current)), key=lambda k: estimate_tokens(current[k].get("content", "")))
+        content = current[longest].get("content", "")
+        size = estimate_tokens(content)
+        current[longest] = dict(current[longest], content=compress(content, max(size - overflow, 0)))
+        logger.warning(f"提示词超出预算且没有可压缩的段落，已截断最长的一条消息（{size} tokens）")
+
+    return current, original - messages_tokens(current)
+
+
+def plan_request(messages: List[Dict], models: Sequence[str], max_tokens: Optional[int] = None,
+                 sections: Sequence[PromptSection] = ()) -> Tuple[List[Dict], Optional[int], int]:
+    """请求前的预算检查，返回(消息, max_tokens, 压缩减少的token数)
+
+    models: 本次请求可能使用的模型（连接池中的各端点），按其中最小的窗口计算。
+    输出预算优先保留（最多占窗口的一半），提示词加上输出预算超出窗口时压缩提示词；
+    输出不完整的章节还要重试，比压缩掉部分上下文代价更高。
+    """
+    window = min(context_window(model) for model in models)
+    usable = int(window * (1 - SAFETY_MARGIN))
+    if max_tokens is not None and max_tokens > usable // 2:
+        max_tokens = max(MIN_COMPLETION_TOKENS, usable // 2)
+    reserve = max_tokens or 0
+    if messages_tokens(messages) + reserve <= usable and not any(s.max_tokens is not None for s in sections):
+        return messages, max_tokens, 0
+    fitted, trimmed = fit_messages(messages, usable - reserve, sections)
+    return fitted, max_tokens, trimmed
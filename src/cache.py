@@ -0,0 +1,137 @@
+"""
+按请求内容寻址的磁盘响应缓存
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .checkpoint import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """以（提供方、模型、消息、采样参数）的哈希为键缓存模型回复
+
+    每条缓存是一个JSON文件，命中时刷新文件的修改时间，
+    总大小超过max_bytes时按最近使用时间淘汰，超过ttl秒的条目视为失效。
+
+    bypass为True时不读取缓存但仍写入新结果，用于强制刷新。
+    同一目录可以由多个进程或代理共享：淘汰时按目录中的实际文件重新计算总大小，
+    其他进程同时删除的条目直接跳过。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024,
+                 ttl: Optional[float] = None, bypass: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def make_key(provider: str, model: str, messages: List[Dict],
+                 params: Optional[Dict[str, Any]] = None) -> str:
+        payload = json.dumps(
+            {"provider": provider, "model": model, "messages": messages, "params": params or {}},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self) -> List[str]:
+        paths = []
+        for root, _, files in os.walk(self.directory):
+            paths.extend(os.path.join(root, name) for name in files if name.endswith(".json"))
+        return paths
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """目录中现有条目的(修改时间, 大小, 路径)，扫描期间被其他进程删除的条目跳过"""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中、已过期或处于bypass模式时返回None"""
+        if self.bypass:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # 记录最近使用时间，供淘汰时参考
+        except FileNotFoundError:
+            pass  # 读取后被其他进程淘汰，本次仍然算命中
+        self.hits += 1
+        return entry["content"]
+
+    def put(self, key: str, content: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self._remove(path)
+        atomic_write(path, json.dumps({"created": time.time(), "content": content}, ensure_ascii=False))
+        self._total_bytes += os.path.getsize(path)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """按最近使用时间从旧到新删除，直到总大小降到上限的90%以下
+
+        总大小按目录中的文件重新计算，内存中的计数不包含共享目录的其他进程写入的条目。
+        """
+        target = self.max_bytes * 0.9
+        entries = sorted(self._scan())
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # 已被其他进程删除，同样不再占用空间
+            self._total_bytes -= size
+        logger.info(f"响应缓存淘汰完成，当前大小：{self._total_bytes}字节")
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "bytes": self._total_bytes
+        }
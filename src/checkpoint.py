@@ -0,0 +1,197 @@
+"""
+故事创作过程的断点存储，用于中断后从已完成的步骤继续
+
+每个步骤和章节同时记录其输入指纹（提示词模板、上游产物、模型的内容哈希），
+再次运行时只重新生成指纹不一致或被指定重新生成的部分，类似make的增量构建。
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path: str, content: str):
+    """先写临时文件再替换，避免中途崩溃留下半个文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def fingerprint(*parts: Any) -> str:
+    """输入内容的指纹：各部分按JSON序列化后计算SHA-256，取前16位十六进制"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_chapter_ranges(text: str) -> List[int]:
+    """解析"17-19,23"形式的章节范围，返回排序后的章节序号"""
+    indexes = set()
+    for part in text.replace("，", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, separator, end = part.partition("-")
+        try:
+            first, last = int(start), int(end if separator else start)
+        except ValueError:
+            raise ValueError(f"无法解析章节范围：{part}") from None
+        if first < 1 or last < first:
+            raise ValueError(f"无效的章节范围：{part}")
+        indexes.update(range(first, last + 1))
+    return sorted(indexes)
+
+
+def format_chapter_ranges(indexes: Iterable[int]) -> str:
+    """parse_chapter_ranges的逆操作，如[1, 2, 3, 5]得到1-3,5"""
+    ranges: List[List[int]] = []
+    for index in sorted(indexes):
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+class CheckpointStore:
+    """保存在输出目录下的断点数据
+
+    目录结构：
+        <output_base>/.checkpoint/state.json        运行参数、各步骤产物与输入指纹
+        <output_base>/.checkpoint/chapter_NNN.txt   已完成的章节
+
+    每个步骤和每个章节完成后立即原子写入，章节文件存在即表示该章已完成。
+    产物的状态（见stage_status、chapter_status）：
+    - missing：尚未生成
+    - stale：记录的输入指纹与本次不同，需要重新生成
+    - fresh：可以直接复用；旧版断点没有记录指纹时同样视为fresh
+    invalidate_*删除指定的产物并标记为强制重新生成，重新生成时不读取响应缓存。
+    """
+
+    DIR_NAME = ".checkpoint"
+
+    def __init__(self, output_base: str):
+        self.directory = os.path.join(output_base, self.DIR_NAME)
+        self.state_path = os.path.join(self.directory, "state.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self.state: Dict[str, Any] = {"meta": {}, "stages": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+            logger.info(f"已加载断点：{self.state_path}（已完成步骤：{', '.join(self.state['stages']) or '无'}）")
+        # 旧版断点没有以下两项
+        self.state.setdefault("fingerprints", {"stages": {}, "chapters": {}})
+        self.state.setdefault("forced", {"stages": [], "chapters": []})
+
+    @classmethod
+    def exists(cls, output_base: str) -> bool:
+        return os.path.exists(os.path.join(output_base, cls.DIR_NAME, "state.json"))
+
+    def _save_state(self):
+        atomic_write(self.state_path, json.dumps(self.state, ensure_ascii=False, indent=2))
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        """运行参数（模型、题材、提示词等），恢复时据此重建同样的任务"""
+        return self.state["meta"]
+
+    def save_meta(self, meta: Dict[str, Any]):
+        self.state["meta"].update(meta)
+        self._save_state()
+
+    def has_stage(self, name: str) -> bool:
+        return name in self.state["stages"]
+
+    def get_stage(self, name: str) -> Any:
+        return self.state["stages"][name]
+
+    def save_stage(self, name: str, value: Any, fingerprint: Optional[str] = None):
+        """保存步骤产物；未给出指纹时保留原有记录（用于手工修改产物）"""
+        self.state["stages"][name] = value
+        if fingerprint is not None:
+            self.state["fingerprints"]["stages"][name] = fingerprint
+        self._unforce("stages", name)
+        self._save_state()
+
+    def _status(self, kind: str, key: str, present: bool, fingerprint: str) -> str:
+        if not present:
+            return "missing"
+        recorded = self.state["fingerprints"][kind].get(key)
+        return "fresh" if recorded is None or recorded == fingerprint else "stale"
+
+    def stage_status(self, name: str, fingerprint: str) -> str:
+        return self._status("stages", name, self.has_stage(name), fingerprint)
+
+    def chapter_status(self, index: int, fingerprint: str) -> str:
+        return self._status("chapters", str(index), self.has_chapter(index), fingerprint)
+
+    def adopt_fingerprint(self, kind: str, key, fingerprint: str):
+        """复用旧版断点中没有指纹的产物时补记指纹，之后的修改才能被识别"""
+        recorded = self.state["fingerprints"][kind]
+        if str(key) not in recorded:
+            recorded[str(key)] = fingerprint
+            self._save_state()
+
+    def is_forced(self, kind: str, key) -> bool:
+        """kind为stages或chapters；被指定重新生成且尚未完成"""
+        return str(key) in self.state["forced"][kind]
+
+    def _unforce(self, kind: str, key):
+        forced = self.state["forced"][kind]
+        if str(key) in forced:
+            forced.remove(str(key))
+
+    def invalidate_stages(self, names: Iterable[str]):
+        """删除步骤产物并强制重新生成；下游步骤在其内容变化后经指纹判断为stale"""
+        for name in names:
+            self.state["stages"].pop(name, None)
+            self.state["fingerprints"]["stages"].pop(name, None)
+            if name not in self.state["forced"]["stages"]:
+                self.state["forced"]["stages"].append(name)
+        self._save_state()
+
+    def invalidate_chapters(self, indexes: Iterable[int], force: bool = True):
+        """删除已保存的章节；force为False时只删除（输入已变化的章节），不标记为强制重新生成"""
+        for index in indexes:
+            path = self._chapter_path(index)
+            if os.path.exists(path):
+                os.remove(path)
+            self.state["fingerprints"]["chapters"].pop(str(index), None)
+            if force and str(index) not in self.state["forced"]["chapters"]:
+                self.state["forced"]["chapters"].append(str(index))
+        self._save_state()
+
+    def chapter_indexes(self) -> List[int]:
+        """已保存的章节序号"""
+        return sorted(int(name[len("chapter_"):-len(".txt")]) for name in os.listdir(self.directory)
+                      if name.startswith("chapter_") and name.endswith(".txt"))
+
+    def _chapter_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"chapter_{index:03d}.txt")
+
+    def has_chapter(self, index: int) -> bool:
+        return os.path.exists(self._chapter_path(index))
+
+    def get_chapter(self, index: int) -> Optional[str]:
+        path = self._chapter_path(index)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def save_chapter(self, index: int, content: str, fingerprint: Optional[str] = None):
+        """保存章节；未给出指纹时保留原有记录（用于手工修改章节）"""
+        atomic_write(self._chapter_path(index), content)
+        changed = self.is_forced("chapters", index)
+        self._unforce("chapters", index)
+        if fingerprint is not None:
+            changed = changed or self.state["fingerprints"]["chapters"].get(str(index)) != fingerprint
+            self.state["fingerprints"]["chapters"][str(index)] = fingerprint
+        if changed:
+            self._save_state()
@@ -0,0 +1,337 @@
+"""
+单文件的小说容器：只追加写入的记录加上章节偏移索引，可按章节号随机读取
+
+文件结构：
+    文件头    MAGIC（8字节）
+    记录      记录头（16字节：类型、压缩方式、保留、章节号、长度、CRC32）+ 内容
+    ...
+    索引记录  所有有效记录的(类型, 压缩方式, 章节号, 偏移, 长度)
+    文件尾    索引记录的偏移（8字节）+ INDEX_MAGIC（4字节）
+
+章节是追加写入的记录，同一章节出现多次时以最后一条为准。元数据在生成过程中反复更新，
+只在sync（每个步骤完成时）和close时写入最新的版本（与上次写入的相同时跳过）。
+sync和close在文件末尾写入索引与文件尾，读取时直接加载索引；索引只保留在文件末尾，
+之后再追加记录时先截掉旧的索引。没有文件尾（写入中途崩溃）时顺序扫描记录重建索引，
+继续写入时截掉末尾不完整的记录，并把被取代的旧记录压缩掉。
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"NOVLPK01"
+INDEX_MAGIC = b"NIDX"
+
+# 记录头：类型、压缩方式、保留、章节号、内容长度、内容的CRC32
+RECORD_HEADER = struct.Struct("<BBHIII")
+# 索引条目：类型、压缩方式、章节号、内容偏移、内容长度
+INDEX_ENTRY = struct.Struct("<BBIQI")
+FOOTER = struct.Struct("<Q4s")
+
+KIND_META = 1
+KIND_CHAPTER = 2
+KIND_INDEX = 3
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+_CHAPTER_FILE = re.compile(r"^chapter_(\d+)\.txt$")
+
+# 短于此长度的章节不压缩，压缩后没有变小的章节也按原文保存
+MIN_COMPRESS_BYTES = 512
+
+
+class ContainerError(Exception):
+    """容器文件损坏或格式不符"""
+
+
+@dataclass
+class IndexEntry:
+    kind: int
+    codec: int
+    key: int
+    offset: int   # 内容（不含记录头）在文件中的偏移
+    length: int
+
+
+def _scan(data, size: int) -> Tuple[Dict[Tuple[int, int], IndexEntry], int, Optional[int]]:
+    """顺序扫描全部记录，返回(索引, 最后一条完整记录的结束位置, 末尾索引记录的偏移)
+
+    最后一条完整记录不是索引记录时，末尾索引记录的偏移为None。
+    """
+    index: Dict[Tuple[int, int], IndexEntry] = {}
+    tail: Optional[int] = None
+    position = len(MAGIC)
+    while position + RECORD_HEADER.size <= size:
+        kind, codec, _, key, length, crc = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        end = start + length
+        if kind == KIND_INDEX:
+            end += FOOTER.size
+        if kind not in (KIND_META, KIND_CHAPTER, KIND_INDEX) or end > size:
+            break
+        if kind == KIND_INDEX:
+            tail = position
+        else:
+            if zlib.crc32(data[start:start + length]) != crc:
+                break
+            index[(kind, key)] = IndexEntry(kind, codec, key, start, length)
+            tail = None
+        position = end
+    return index, position, tail
+
+
+def _load_index(data, size: int) -> Optional[Dict[Tuple[int, int], IndexEntry]]:
+    """从文件尾读取索引，文件没有正常关闭时返回None"""
+    if size < len(MAGIC) + RECORD_HEADER.size + FOOTER.size:
+        return None
+    index_offset, magic = FOOTER.unpack_from(data, size - FOOTER.size)
+    if magic != INDEX_MAGIC or index_offset + RECORD_HEADER.size > size - FOOTER.size:
+        return None
+    kind, _, _, count, length, crc = RECORD_HEADER.unpack_from(data, index_offset)
+    start = index_offset + RECORD_HEADER.size
+    if kind != KIND_INDEX or start + length + FOOTER.size != size or \
+            zlib.crc32(data[start:start + length]) != crc:
+        return None
+    index = {}
+    for n in range(count):
+        kind, codec, key, offset, length = INDEX_ENTRY.unpack_from(data, start + n * INDEX_ENTRY.size)
+        index[(kind, key)] = IndexEntry(kind, codec, key, offset, length)
+    return index
+
+
+def _decode(payload: bytes, codec: int) -> str:
+    if codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    elif codec != CODEC_NONE:
+        raise ContainerError(f"不支持的压缩方式: {codec}")
+    return payload.decode("utf-8")
+
+
+class NovelContainerWriter:
+    """增量写入容器文件，每写完一章立即落盘
+
+    文件已存在时在其后继续追加（例如断点恢复），重复写入内容相同的章节会被跳过；
+    已有文件中被取代的章节、元数据和旧索引记录在打开时压缩掉。
+    元数据缓存在内存中，sync或close时才写入；进程被终止时容器中保留最后一次sync的元数据。
+    compress: 是否用zlib压缩章节内容
+    """
+
+    def __init__(self, path: str, compress: bool = True):
+        self.path = path
+        self.compress = compress
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._index: Dict[Tuple[int, int], IndexEntry] = {}
+        # 文件末尾索引记录的偏移，追加新记录前截掉
+        self._tail: Optional[int] = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise ContainerError(f"不是小说容器文件：{path}")
+                self._index, end, self._tail = _scan(data, len(data))
+                live = len(MAGIC) + sum(RECORD_HEADER.size + e.length for e in self._index.values())
+                if (self._tail if self._tail is not None else end) > live:
+                    end = self._compact(data)
+                    self._tail = None
+            self._file = open(path, "r+b")
+            # 截掉写入中途崩溃留下的不完整记录
+            self._file.truncate(end)
+            self._file.seek(end)
+            logger.info(f"继续写入容器：{path}（已有{len(self.chapters)}章）")
+        else:
+            self._file = open(path, "w+b")
+            self._file.write(MAGIC)
+        self._pending_meta: Optional[str] = None
+        self._closed = False
+
+    @property
+    def chapters(self) -> List[int]:
+        return sorted(key for kind, key in self._index if kind == KIND_CHAPTER)
+
+    def _compact(self, data) -> int:
+        """只保留有效的记录，按原顺序重写文件，返回新文件的长度"""
+        temp_path = self.path + ".tmp"
+        index = {}
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC)
+            for entry in sorted(self._index.values(), key=lambda e: e.offset):
+                offset = f.tell()
+                f.write(data[entry.offset - RECORD_HEADER.size:entry.offset + entry.length])
+                index[(entry.kind, entry.key)] = IndexEntry(entry.kind, entry.codec, entry.key,
+                                                            offset + RECORD_HEADER.size, entry.length)
+            end = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logger.info(f"已压缩容器中被取代的记录：{len(data)} -> {end}字节")
+        self._index = index
+        return end
+
+    def _append(self, kind: int, key: int, text: str):
+        payload = text.encode("utf-8")
+        existing = self._index.get((kind, key))
+        if existing is not None and self._read_payload(existing) == payload:
+            return
+        codec = CODEC_NONE
+        if self.compress and kind == KIND_CHAPTER and len(payload) >= MIN_COMPRESS_BYTES:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                payload, codec = compressed, CODEC_ZLIB
+        if self._tail is not None:
+            # 新记录之后会写入新的索引，旧索引已经过时
+            self._file.truncate(self._tail)
+            self._tail = None
+        crc = zlib.crc32(payload)
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(RECORD_HEADER.pack(kind, codec, 0, key, len(payload), crc))
+        self._file.write(payload)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._index[(kind, key)] = IndexEntry(kind, codec, key, offset + RECORD_HEADER.size, len(payload))
+
+    def _read_payload(self, entry: IndexEntry) -> bytes:
+        """读取已写入记录解压后的内容"""
+        self._file.seek(entry.offset)
+        payload = self._file.read(entry.length)
+        return zlib.decompress(payload) if entry.codec == CODEC_ZLIB else payload
+
+    def write_meta(self, meta: Dict):
+        """更新元数据（标题、设定、梗概等），sync或close时写入最后一次的内容"""
+        self._pending_meta = json.dumps(meta, ensure_ascii=False)
+
+    def write_chapter(self, index: int, content: str):
+        self._append(KIND_CHAPTER, index, content)
+
+    def sync(self):
+        """写入最新的元数据、索引与文件尾，此后进程被终止时容器仍可直接加载索引读取
+
+        之后没有新记录时不重复写入；之后追加的记录在没有文件尾的情况下顺序扫描也能读取。
+        """
+        if self._pending_meta is not None:
+            self._append(KIND_META, 0, self._pending_meta)
+            self._pending_meta = None
+        if self._tail is not None:
+            return
+        entries = sorted(self._index.values(), key=lambda e: (e.kind, e.key))
+        payload = b"".join(INDEX_ENTRY.pack(e.kind, e.codec, e.key, e.offset, e.length) for e in entries)
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(RECORD_HEADER.pack(KIND_INDEX, CODEC_NONE, 0, len(entries), len(payload),
+                                            zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.write(FOOTER.pack(offset, INDEX_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._tail = offset
+
+    def close(self):
+        """写入索引与文件尾并关闭文件"""
+        if self._closed:
+            return
+        self.sync()
+        self._file.close()
+        self._closed = True
+
+    def __enter__(self) -> "NovelContainerWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NovelContainerReader:
+    """以内存映射方式读取容器，按章节号随机访问，不需要读入整个文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.path.getsize(path)
+        if size < len(MAGIC):
+            self._file.close()
+            raise ContainerError(f"不是小说容器文件：{path}")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ContainerError(f"不是小说容器文件：{path}")
+        index = _load_index(self._data, size)
+        if index is None:
+            logger.warning(f"容器{path}没有索引（写入未正常结束），顺序扫描重建")
+            index, _, _ = _scan(self._data, size)
+        self._index = index
+
+    @property
+    def chapters(self) -> List[int]:
+        """已有的章节号，按顺序排列"""
+        return sorted(key for kind, key in self._index if kind == KIND_CHAPTER)
+
+    @property
+    def meta(self) -> Dict:
+        entry = self._index.get((KIND_META, 0))
+        return json.loads(self._read(entry)) if entry is not None else {}
+
+    def _read(self, entry: IndexEntry) -> str:
+        return _decode(self._data[entry.offset:entry.offset + entry.length], entry.codec)
+
+    def chapter(self, index: int) -> str:
+        entry = self._index.get((KIND_CHAPTER, index))
+        if entry is None:
+            raise KeyError(f"容器中没有第{index}章")
+        return self._read(entry)
+
+    def __len__(self) -> int:
+        return len(self.chapters)
+
+    def __contains__(self, index: int) -> bool:
+        return (KIND_CHAPTER, index) in self._index
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        for index in self.chapters:
+            yield index, self.chapter(index)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> "NovelContainerReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert_directory(output_base: str, path: Optional[str] = None, compress: bool = True) -> str:
+    """把已有的输出目录（meta.json、table_of_contents.md、chapters/chapter_NNN.txt）转换为容器文件
+
+    返回容器文件的路径，默认为<output_base>/novel.nvl。
+    """
+    path = path or os.path.join(output_base, "novel.nvl")
+    meta = {}
+    meta_path = os.path.join(output_base, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    toc_path = os.path.join(output_base, "table_of_contents.md")
+    if os.path.exists(toc_path):
+        with open(toc_path, "r", encoding="utf-8") as f:
+            meta["table_of_contents"] = f.read()
+
+    chapters_dir = os.path.join(output_base, "chapters")
+    names = sorted(os.listdir(chapters_dir)) if os.path.isdir(chapters_dir) else []
+    with NovelContainerWriter(path, compress=compress) as writer:
+        writer.write_meta(meta)
+        for name in names:
+            match = _CHAPTER_FILE.match(name)
+            if not match:
+                continue
+            with open(os.path.join(chapters_dir, name), "r", encoding="utf-8") as f:
+                writer.write_chapter(int(match.group(1)), f.read())
+        count = len(writer.chapters)
+    logger.info(f"已转换{output_base}：{count}章 -> {path}")
+    return path
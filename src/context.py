@@ -0,0 +1,209 @@
+"""
+为章节创作挑选精简的上下文：只带上本章涉及的人物与设定，以及最近几章的前情回顾
+"""
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from .prompts import CHARACTER_DESIGN_PROMPT
+from .synopsis import ChapterSynopsis
+
+_CJK = re.compile(r"[一-鿿]")
+
+# 角色条目的标题行：可选的序号/符号，随后是人名，再跟括号、冒号、逗号或破折号
+_ENTRY_HEADER = re.compile(
+    r"^[\s\-\*#>\d\.、A-Za-z（(）)]*\**(?:姓名[：:]\s*)?([一-鿿·]{2,5})\**\s*[（(：:，,—\-]"
+)
+_NAME_FIELD = re.compile(r"姓名[：:]\s*\**([一-鿿·]{2,5})")
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算token数：中文大约一字一token，其余字符约四个一token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """按估算token数截断文本"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 中文为主的文本按字数近似截断
+    return text[:max_tokens].rstrip() + "……"
+
+
+def _bigrams(text: str) -> Counter:
+    chars = "".join(_CJK.findall(text))
+    return Counter(chars[i:i + 2] for i in range(len(chars) - 1))
+
+
+def _template_words(template: str, min_length: int = 2, max_length: int = 5) -> Set[str]:
+    """模板中连续汉字的所有min_length到max_length字片段"""
+    chars = "".join(_CJK.findall(template))
+    return {chars[i:i + length]
+            for length in range(min_length, max_length + 1)
+            for i in range(len(chars) - length + 1)}
+
+
+# 角色设计模板本身出现的词是小标题而不是人名，例如"主角"、"身份背景"
+_TEMPLATE_WORDS = _template_words(CHARACTER_DESIGN_PROMPT)
+
+
+def parse_character_registry(characters: str, max_entry_chars: int = 300) -> Dict[str, str]:
+    """把角色设计的输出拆成"人名 -> 角色描述"的索引，保持原有顺序
+
+    以看起来像人名开头的行作为条目起点，直到下一个条目或分组小标题（以冒号结尾的行）
+    为止的内容作为描述。比条目起点缩进更深的行视为该角色的属性（如"- 关键能力：…"）。
+    """
+    registry: Dict[str, str] = {}
+    current_name: Optional[str] = None
+    current_lines: List[str] = []
+    current_indent = 0
+
+    def flush():
+        if current_name and current_name not in registry:
+            registry[current_name] = "\n".join(current_lines).strip()[:max_entry_chars]
+
+    for line in characters.splitlines():
+        indent = len(line) - len(line.lstrip())
+        match = _NAME_FIELD.search(line) or _ENTRY_HEADER.match(line)
+        name = match.group(1) if match else None
+        if current_name and indent > current_indent:
+            name = None
+        if name and name not in _TEMPLATE_WORDS:
+            flush()
+            current_name, current_lines, current_indent = name, [line.strip()], indent
+        elif line.rstrip().endswith(("：", ":")):
+            # "B. 各阶段BOSS："之类的分组小标题，结束当前条目
+            flush()
+            current_name, current_lines = None, []
+        elif current_name:
+            current_lines.append(line.strip())
+    flush()
+    return registry
+
+
+class StoryContext:
+    """章节上下文构建器
+
+    - 人物索引：从角色设计中解析出人名及其描述，只选用本章梗概中出现的人物（主角总是包含）
+    - 设定索引：按段落切分世界观，选取与本章梗概字面最相关的段落
+    - 前情回顾：最近几章的梗概以及已完成章节的结尾
+
+    所有部分合计不超过token_budget（估算值）。
+    """
+
+    def __init__(self, characters: str, setting: str, synopses: List[ChapterSynopsis],
+                 token_budget: int = 3000, recap_chapters: int = 3, tail_chars: int = 200):
+        self.raw_characters = characters
+        self.characters = parse_character_registry(characters)
+        self.setting_sections = [p.strip() for p in re.split(r"\n\s*\n", setting) if p.strip()]
+        self._setting_bigrams = [_bigrams(p) for p in self.setting_sections]
+        self.synopses: Dict[int, ChapterSynopsis] = {s.number: s for s in synopses}
+        self.token_budget = token_budget
+        self.recap_chapters = recap_chapters
+        self.tail_chars = tail_chars
+        self.chapter_tails: Dict[int, str] = {}
+
+    def add_synopsis(self, chapter: ChapterSynopsis):
+        """梗概逐章到达时加入索引，供后续章节的前情回顾使用"""
+        self.synopses[chapter.number] = chapter
+
+    def record_chapter(self, index: int, content: str):
+        """章节完成后记录其结尾，供后续章节的前情回顾使用"""
+        self.chapter_tails[index] = content.strip()[-self.tail_chars:]
+
+    def select_characters(self, synopsis: str) -> List[str]:
+        names = [name for name in self.characters if name in synopsis]
+        # 角色设计中第一个出现的人物通常是主角
+        protagonist = next(iter(self.characters), None)
+        if protagonist and protagonist not in names:
+            names.insert(0, protagonist)
+        return names
+
+    def _character_section(self, synopsis: str, budget: int) -> str:
+        if not self.characters:
+            # 角色设计的格式无法解析时退回到截断后的原文
+            return _truncate(self.raw_characters, budget)
+        entries = []
+        used = 0
+        for name in self.select_characters(synopsis):
+            entry = self.characters[name]
+            cost = estimate_tokens(entry)
+            if used + cost > budget:
+                entry = _truncate(entry, budget - used)
+                cost = estimate_tokens(entry)
+            if not entry:
+                break
+            entries.append(entry)
+            used += cost
+        return "\n".join(entries)
+
+    def _recap_section(self, index: int, budget: int) -> str:
+        lines = []
+        for prev in range(max(1, index - self.recap_chapters), index):
+            chapter = self.synopses.get(prev)
+            if chapter is None:
+                continue
+            line = f"{chapter.heading}：{chapter.body}"
+            if prev in self.chapter_tails:
+                line += f"\n（本章结尾）{self.chapter_tails[prev]}"
+            lines.append(line)
+        # 预算不足时优先保留离本章最近的回顾
+        recap = []
+        used = 0
+        for line in reversed(lines):
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                break
+            recap.insert(0, line)
+            used += cost
+        return "\n".join(recap)
+
+    def _setting_section(self, synopsis: str, budget: int) -> str:
+        if not self.setting_sections:
+            return ""
+        query = _bigrams(synopsis)
+        scored = sorted(
+            range(len(self.setting_sections)),
+            key=lambda k: sum(min(count, query[gram]) for gram, count in self._setting_bigrams[k].items()
+                              if gram in query),
+            reverse=True
+        )
+        selected = []
+        used = 0
+        for k in scored:
+            section = self.setting_sections[k]
+            cost = estimate_tokens(section)
+            if used + cost > budget:
+                section = _truncate(section, budget - used)
+                cost = estimate_tokens(section)
+            if not section:
+                break
+            selected.append((k, section))
+            used += cost
+        # 按原文顺序排列选中的段落
+        return "\n\n".join(section for _, section in sorted(selected))
+
+    def setting_excerpt(self, synopsis: str) -> str:
+        """本章可能用到的设定段落：前情回顾为空时设定部分能分到的最大额度下选中的段落
+
+        实际选中的段落随前情回顾的长度减少，但总在这些段落之内，不依赖相邻章节。
+        """
+        characters = self._character_section(synopsis, int(self.token_budget * 0.5))
+        return self._setting_section(synopsis, self.token_budget - estimate_tokens(characters))
+
+    def build(self, index: int, synopsis: str) -> Dict[str, str]:
+        """返回本章使用的人物、前情回顾和设定三部分文本
+
+        预算分配：人物50%、前情回顾30%、设定20%，前面部分用不完的额度顺延给后面。
+        """
+        characters = self._character_section(synopsis, int(self.token_budget * 0.5))
+        remaining = self.token_budget - estimate_tokens(characters)
+        # 为设定保留20%的额度，其余（含人物部分未用完的）交给前情回顾
+        recap = self._recap_section(index, remaining - int(self.token_budget * 0.2))
+        remaining -= estimate_tokens(recap)
+        setting = self._setting_section(synopsis, remaining)
+        return {"characters": characters, "recap": recap, "setting": setting}
@@ -0,0 +1,114 @@
+"""
+流式生成过程中的退化检测：文本陷入重复循环或偏离格式时尽早中止请求，保留之前正常的部分
+
+检测在每段流式文本到达时增量进行：
+- 滚动重复率：最近window字中重复n字片段的比例
+- 重复段落：完整的段落按内容哈希计数，同一段落再次出现即视为循环
+- 格式标记：正文中出现新的章节标题、字数统计等说明文字，说明模型已经跑题
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Optional
+
+from .routing import repetition_ratio
+
+# 滚动重复率：窗口字数、片段长度、阈值，以及每新增多少字检查一次
+ROLLING_WINDOW = 800
+ROLLING_NGRAM = 10
+ROLLING_THRESHOLD = 0.5
+CHECK_INTERVAL = 100
+
+# 短于此长度的段落（如"……"、单句对白）不参与重复段落检测
+MIN_PARAGRAPH_CHARS = 15
+
+# 章节正文中不应出现的内容：下一章的标题、字数统计、对创作要求的说明
+FORMAT_MARKERS = [
+    re.compile(r"^\s*(?:#+\s*|【)?第[0-9零一二三四五六七八九十百千]+章"),
+    re.compile(r"字数(?:统计)?[：:]\s*约?\d+"),
+    re.compile(r"^\s*[（(]?(?:本章|以上)(?:内容)?(?:共|约|合计)+\d+字"),
+    re.compile(r"^\s*(?:创作要求|写作要点|情节结构)[：:]"),
+]
+
+# 截断点向前对齐到的句末标点
+_SENTENCE_END = re.compile(r"[。！？!?…」”\n]")
+
+
+class DegenerationDetector:
+    """增量检测一段流式生成的文本
+
+    每次feed新到达的文本，退化时返回原因（repetition、repeated_paragraph或format），
+    此后salvage()给出退化开始之前、可以保留并续写的文本。
+    skip_format_chars: 开头多少字内不检查格式标记（模型偶尔会先复述一遍章节标题）
+    """
+
+    def __init__(self, window: int = ROLLING_WINDOW, ngram: int = ROLLING_NGRAM,
+                 threshold: float = ROLLING_THRESHOLD, check_interval: int = CHECK_INTERVAL,
+                 skip_format_chars: int = 50):
+        self.window = window
+        self.ngram = ngram
+        self.threshold = threshold
+        self.check_interval = check_interval
+        self.skip_format_chars = skip_format_chars
+        self.text = ""
+        self.reason: Optional[str] = None
+        self.cut: Optional[int] = None
+        self._line_start = 0
+        self._checked_at = 0
+        self._paragraphs: Dict[int, int] = {}
+
+    def feed(self, text: str) -> Optional[str]:
+        if self.reason is not None:
+            return self.reason
+        self.text += text
+        # 逐个检查新完成的行
+        while self.reason is None:
+            end = self.text.find("\n", self._line_start)
+            if end < 0:
+                break
+            self._check_line(self._line_start, end)
+            self._line_start = end + 1
+        if self.reason is None and len(self.text) - self._checked_at >= self.check_interval:
+            self._checked_at = len(self.text)
+            self._check_rolling()
+        return self.reason
+
+    def _flag(self, reason: str, cut: int):
+        self.reason = reason
+        self.cut = cut
+
+    def _check_line(self, start: int, end: int):
+        line = self.text[start:end]
+        if start >= self.skip_format_chars and any(marker.search(line) for marker in FORMAT_MARKERS):
+            self._flag("format", start)
+            return
+        paragraph = "".join(line.split())
+        if len(paragraph) < MIN_PARAGRAPH_CHARS:
+            return
+        key = hash(paragraph)
+        if key in self._paragraphs:
+            # 保留第一次出现的段落，从重复处截断
+            self._flag("repeated_paragraph", start)
+        else:
+            self._paragraphs[key] = start
+
+    def _check_rolling(self):
+        if len(self.text) < self.window:
+            return
+        offset = len(self.text) - self.window
+        tail = self.text[offset:]
+        if repetition_ratio(tail, self.ngram) <= self.threshold:
+            return
+        # 循环的起点：窗口内第一个出现三次以上的片段首次出现的位置
+        counts = Counter(tail[k:k + self.ngram] for k in range(len(tail) - self.ngram + 1))
+        start = next((k for k in range(len(tail) - self.ngram + 1)
+                      if counts[tail[k:k + self.ngram]] >= 3), 0)
+        self._flag("repetition", offset + start)
+
+    def salvage(self) -> str:
+        """退化开始之前的文本，截断点向前对齐到句末；未检测到退化时返回全部文本"""
+        if self.cut is None:
+            return self.text
+        head = self.text[:self.cut]
+        ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+        return head[:ends[-1]].rstrip() if ends else ""
@@ -0,0 +1,333 @@
+"""
+章节正文的人物/地点索引与一致性检查：每完成一章增量建立索引，不额外调用模型
+
+- 多模式匹配：所有人名和地名构建一个Aho-Corasick自动机，一次扫描找出全部出现位置，
+  记录为 实体 -> {章节: [偏移, ...]} 的倒排表
+- 名字漂移：与角色名同姓、只差一个字、后面紧跟"说""道"等动作的写法（如把"林云"写成"林芸"），
+  在全书出现达到一定次数即报告
+- 死者复现：某章出现"林云战死""林云身亡"之类的描写后，之后的章节中该角色仍以在场身份出现
+  （回忆、祭奠等语境除外）
+
+章节可以乱序加入（并发生成），同一章节重新加入时替换之前的索引。
+"""
+
+import json
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from .checkpoint import atomic_write
+from .context import parse_character_registry
+
+logger = logging.getLogger(__name__)
+
+_CJK = re.compile(r"[一-鿿]")
+
+# 世界观中的地名：以这些字结尾、前面一到三个字的词
+_PLACE_SUFFIXES = "城山宗谷殿国州村镇岛海峰门阁派府湖关寺洞域界都港岭原漠林河江"
+_PLACE_FRAGMENT_SPLIT = re.compile(r"[^一-鿿]|[的是在于和与及从到向往之了为有被把将即位其]")
+_PLACE = re.compile(rf"^[一-鿿]{{1,3}}?[{_PLACE_SUFFIXES}]")
+# 以地名后缀结尾的常用词
+_PLACE_STOPWORDS = {"宗门", "山门", "江山", "高山", "深山", "群山", "大山", "下山", "上山", "大海", "森林",
+                    "世界", "边界", "境界", "眼界", "国家", "全国", "各国", "城市", "门派", "大门",
+                    "部门", "专门", "出门", "进门", "河山", "山谷", "一派", "政府", "官府", "学派"}
+# 以指示词、数量词开头的不是地名（如"这个世界"）
+_PLACE_BAD_PREFIX = set("这那一每各整全此该某本")
+
+# 名字后面常见的动作，用于判断一个"同姓只差一字"的词是否在作为人名使用
+_ACTION_CHARS = set("说道问笑喊叫看望点摇皱沉冷低轻转走抬伸站坐怒叹答回应")
+# 这些字出现在差异位置时多半是普通词语（如"林中"），不作为名字漂移
+_NON_NAME_CHARS = set("中上下里外内间前后边的了着过是在和与不也都就这那一个些")
+
+# 死亡描写：人名之后若干字内出现这些词
+_DEATH_WORDS = re.compile(r"死了|身亡|陨落|战死|阵亡|牺牲|毙命|气绝|殒命|丧命|断气|咽气|魂飞魄散|惨死|被杀|被斩杀|死去")
+_DEATH_WINDOW = 12
+# 同一句中出现这些词时不视为确定的死亡（否定、假设、险些）
+_DEATH_NEGATIONS = re.compile(r"没|未|不会|不能|差点|险些|假死|若|如果|要是|以为|仿佛")
+# 在这些语境中提到死者是正常的（回忆、祭奠、遗物等）
+_RECALL_WORDS = re.compile(r"回忆|想起|记得|生前|遗言|遗物|遗体|尸|墓|坟|灵位|牌位|祭|悼|怀念|梦|亡魂|死去的|已故|故去|临死|当年|曾经|昔日")
+_SENTENCE_END_CHARS = "。！？!?\n"
+_SENTENCE_END = re.compile(f"[{_SENTENCE_END_CHARS}]")
+# 向前查找句首的最大距离，更长的句子只取这一段判断语境
+_SENTENCE_LOOKBACK = 200
+
+
+class AhoCorasick:
+    """多模式字符串匹配：一次扫描找出文本中所有模式的出现位置
+
+    位于根状态时用正则跳到下一个可能的模式首字，中文正文中大部分字符不需要逐字走自动机。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = sorted({p for p in patterns if p})
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+        for pattern in self.patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][ch] = nxt
+                state = nxt
+            self._out[state] = (pattern,)
+
+        # 按广度优先计算失败指针，输出集合沿失败指针合并
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+        first = "".join(re.escape(ch) for ch in self._goto[0])
+        self._first = re.compile(f"[{first}]") if first else None
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, str]]:
+        """产出所有(起始位置, 模式)，包括相互重叠的匹配"""
+        if self._first is None:
+            return
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            if state == 0:
+                match = self._first.search(text, i)
+                if match is None:
+                    return
+                i = match.start()
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern in out[state]:
+                yield i - len(pattern) + 1, pattern
+            i += 1
+
+    def search(self, text: str) -> List[Tuple[int, str]]:
+        """互不重叠的匹配，同一位置取最长的模式（"林云飞"优先于"林云"）"""
+        matches = sorted(self.finditer(text), key=lambda m: (m[0], -len(m[1])))
+        result = []
+        end = 0
+        for start, pattern in matches:
+            if start >= end:
+                result.append((start, pattern))
+                end = start + len(pattern)
+        return result
+
+
+def extract_places(setting: str) -> List[str]:
+    """从世界观设定中提取地名：以城、山、宗、谷等结尾的短词，保持首次出现的顺序"""
+    places: Dict[str, None] = {}
+    for fragment in _PLACE_FRAGMENT_SPLIT.split(setting):
+        # 一个片段中可能连续出现多个地名（如"京城洛阳城"）
+        while fragment and fragment[0] not in _PLACE_BAD_PREFIX:
+            match = _PLACE.match(fragment)
+            if match is None:
+                break
+            if match.group(0) not in _PLACE_STOPWORDS:
+                places.setdefault(match.group(0))
+            fragment = fragment[match.end():]
+    return list(places)
+
+
+@dataclass
+class ConsistencyIssue:
+    """一处不一致
+
+    kind: name_variant（名字漂移）或dead_reappears（死者复现）
+    entity: 相关的角色名
+    chapter / offset: 出现的章节及在章节文本中的偏移
+    detail: 说明，名字漂移时包含实际写法
+    """
+    kind: str
+    entity: str
+    chapter: int
+    offset: int
+    detail: str
+
+    @property
+    def key(self) -> Tuple:
+        return self.kind, self.entity, self.chapter, self.detail
+
+
+class EntityIndex:
+    """人物与地点的倒排索引，逐章增量更新
+
+    characters: 角色名列表（通常由角色设计解析得到，第一个为主角）
+    places: 地名列表
+    min_variant_count: 名字漂移的写法在全书出现至少多少次才报告，避免偶然的词语误报
+    """
+
+    def __init__(self, characters: Iterable[str], places: Iterable[str] = (), min_variant_count: int = 2):
+        self.entities: Dict[str, str] = {}
+        for name in places:
+            self.entities[name] = "place"
+        for name in characters:
+            self.entities[name] = "character"
+        self.min_variant_count = min_variant_count
+        self._matcher = AhoCorasick(self.entities)
+        # 实体 -> 章节 -> 偏移列表
+        self.postings: Dict[str, Dict[int, List[int]]] = {name: {} for name in self.entities}
+        self.chapters: Set[int] = set()
+        # 每章的死亡描写：章节 -> {角色: 偏移}
+        self._deaths: Dict[int, Dict[str, int]] = {}
+        # 角色以在场身份出现的首个位置：角色 -> 章节 -> 偏移
+        self._present: Dict[str, Dict[int, int]] = {}
+        # 名字漂移的写法：(写法, 角色) -> 章节 -> 偏移列表
+        self._variants: Dict[Tuple[str, str], Dict[int, List[int]]] = {}
+        self._reported: Set[Tuple] = set()
+
+        self._by_surname: Dict[str, List[str]] = {}
+        for name, kind in self.entities.items():
+            if kind == "character" and len(name) >= 2:
+                self._by_surname.setdefault(name[0], []).append(name)
+        surnames = "".join(re.escape(ch) for ch in self._by_surname)
+        self._surname = re.compile(f"[{surnames}]") if surnames else None
+
+    @classmethod
+    def from_story(cls, characters: str, setting: str, **kwargs) -> "EntityIndex":
+        """由角色设计和世界观设定的原文建立索引"""
+        return cls(parse_character_registry(characters), extract_places(setting), **kwargs)
+
+    @property
+    def character_names(self) -> List[str]:
+        return [name for name, kind in self.entities.items() if kind == "character"]
+
+    def mentions(self, name: str) -> Dict[int, List[int]]:
+        """实体在各章中的出现位置，按章节排序"""
+        return dict(sorted(self.postings.get(name, {}).items()))
+
+    def _remove_chapter(self, index: int):
+        for chapters in self.postings.values():
+            chapters.pop(index, None)
+        for chapters in self._present.values():
+            chapters.pop(index, None)
+        for chapters in self._variants.values():
+            chapters.pop(index, None)
+        self._deaths.pop(index, None)
+
+    def add_chapter(self, index: int, text: str) -> List[ConsistencyIssue]:
+        """加入（或替换）一章的索引，返回此前未报告过的不一致"""
+        if index in self.chapters:
+            self._remove_chapter(index)
+        self.chapters.add(index)
+
+        matches = self._matcher.search(text)
+        # 按句判断死亡描写与回忆语境，每句只检查一次
+        sentences: Dict[int, Tuple[bool, bool]] = {}
+        starts: Set[int] = set()
+        deaths: Dict[str, int] = {}
+        for start, name in matches:
+            self.postings[name].setdefault(index, []).append(start)
+            starts.add(start)
+            if self.entities[name] != "character":
+                continue
+            end = _SENTENCE_END.search(text, start)
+            sentence_end = end.end() if end else len(text)
+            if sentence_end not in sentences:
+                lookback = max(0, start - _SENTENCE_LOOKBACK)
+                sentence_start = max(text.rfind(ch, lookback, start) for ch in _SENTENCE_END_CHARS) + 1
+                sentence = text[max(sentence_start, lookback):sentence_end]
+                may_die = bool(_DEATH_WORDS.search(sentence)) and not _DEATH_NEGATIONS.search(sentence)
+                sentences[sentence_end] = (may_die, bool(_RECALL_WORDS.search(sentence)))
+            may_die, recall = sentences[sentence_end]
+            after = start + len(name)
+            if may_die and _DEATH_WORDS.search(text, after, min(after + _DEATH_WINDOW, sentence_end)):
+                deaths.setdefault(name, start)
+            elif not recall:
+                self._present.setdefault(name, {}).setdefault(index, start)
+        if deaths:
+            self._deaths[index] = deaths
+        self._scan_variants(index, text, starts)
+        return self._new_issues()
+
+    def _scan_variants(self, index: int, text: str, name_starts: Set[int]):
+        if self._surname is None:
+            return
+        for match in self._surname.finditer(text):
+            position = match.start()
+            if position in name_starts:
+                continue
+            for name in self._by_surname[match.group(0)]:
+                end = position + len(name)
+                if end >= len(text) or text[end] not in _ACTION_CHARS:
+                    continue
+                written = text[position:end]
+                diff = [k for k in range(1, len(name)) if written[k] != name[k]]
+                if len(diff) != 1 or written in self.entities:
+                    continue
+                changed = written[diff[0]]
+                if not _CJK.match(changed) or changed in _NON_NAME_CHARS or changed in _ACTION_CHARS:
+                    continue
+                self._variants.setdefault((written, name), {}).setdefault(index, []).append(position)
+
+    def death_chapters(self) -> Dict[str, int]:
+        """角色 -> 最早出现死亡描写的章节"""
+        deaths: Dict[str, int] = {}
+        for index in sorted(self._deaths):
+            for name in self._deaths[index]:
+                deaths.setdefault(name, index)
+        return deaths
+
+    def issues(self) -> List[ConsistencyIssue]:
+        """当前索引下的全部不一致，按章节排序"""
+        issues = []
+        for name, died in self.death_chapters().items():
+            for index, offset in sorted(self._present.get(name, {}).items()):
+                if index > died:
+                    issues.append(ConsistencyIssue("dead_reappears", name, index, offset,
+                                                   f"{name}已在第{died}章死亡"))
+        for (written, name), chapters in self._variants.items():
+            if sum(len(offsets) for offsets in chapters.values()) < self.min_variant_count:
+                continue
+            for index, offsets in sorted(chapters.items()):
+                issues.append(ConsistencyIssue("name_variant", name, index, offsets[0],
+                                               f"“{written}”疑似“{name}”的误写"))
+        return sorted(issues, key=lambda issue: (issue.chapter, issue.offset))
+
+    def _new_issues(self) -> List[ConsistencyIssue]:
+        new = [issue for issue in self.issues() if issue.key not in self._reported]
+        self._reported.update(issue.key for issue in new)
+        return new
+
+    def to_dict(self) -> Dict:
+        return {
+            "entities": self.entities,
+            "postings": {name: self.mentions(name) for name in self.entities if self.postings[name]},
+            "deaths": self.death_chapters(),
+            "issues": [asdict(issue) for issue in self.issues()]
+        }
+
+    def save(self, path: str):
+        atomic_write(path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+
+_CHAPTER_FILE = re.compile(r"^chapter_(\d+)\.txt$")
+
+
+def index_directory(output_base: str, min_variant_count: int = 2) -> EntityIndex:
+    """为已有的输出目录（meta.json中的角色设计与世界观、chapters/下的章节）建立索引"""
+    with open(os.path.join(output_base, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    index = EntityIndex.from_story(meta.get("characters", ""), meta.get("setting", ""),
+                                   min_variant_count=min_variant_count)
+    chapters_dir = os.path.join(output_base, "chapters")
+    for name in sorted(os.listdir(chapters_dir)) if os.path.isdir(chapters_dir) else []:
+        match = _CHAPTER_FILE.match(name)
+        if match:
+            with open(os.path.join(chapters_dir, name), "r", encoding="utf-8") as f:
+                index.add_chapter(int(match.group(1)), f.read())
+    return index
@@ -0,0 +1,219 @@
+"""
+模型调用的用量与耗时统计
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from .checkpoint import atomic_write
+
+
+@dataclass
+class CallRecord:
+    """单次模型调用的记录"""
+    stage: str                       # 所属创作步骤，如themes、synopses、chapters
+    complexity: str                  # 任务复杂度档位
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0             # 总耗时（秒），包含退避等待
+    first_token_latency: Optional[float] = None  # 流式调用的首字耗时
+    retries: int = 0                 # 暂时性错误的重试次数
+    chars: int = 0                   # 生成的字数
+    chapter: Optional[int] = None
+    streamed: bool = False
+    cached: bool = False
+    error: Optional[str] = None
+    max_tokens: Optional[int] = None  # 请求的输出上限
+    trimmed_tokens: int = 0          # 提示词超出上下文窗口时压缩掉的token数
+    aborted: bool = False            # 被调用方中途中止（如检测到退化、已有合格的候选而取消）
+    shared_prefix_tokens: int = 0    # 与此前请求相同的前缀token数（本地估算）
+    cached_prompt_tokens: int = 0    # 提供方报告的命中前缀缓存的输入token数
+    timestamp: float = field(default_factory=time.time)
+
+
+class MetricsSink:
+    """统计记录的输出目标"""
+
+    def emit(self, record: CallRecord):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySink(MetricsSink):
+    """把记录保存在内存中，便于测试和在进程内汇总"""
+
+    def __init__(self):
+        self.records: List[CallRecord] = []
+
+    def emit(self, record: CallRecord):
+        self.records.append(record)
+
+
+class JsonlSink(MetricsSink):
+    """每条记录追加为JSONL文件中的一行
+
+    emit在事件循环中调用，记录先缓冲在内存里，距上次写入超过flush_interval秒时才写入文件，
+    close时写入剩余的记录。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._flushed_at = time.monotonic()
+
+    def emit(self, record: CallRecord):
+        with self._lock:
+            self._buffer.append(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+            if time.monotonic() - self._flushed_at >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._file.flush()
+            self._buffer.clear()
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+class PrometheusTextSink(MetricsSink):
+    """按步骤和模型累计计数，以Prometheus文本格式写入文件
+
+    可直接交给node_exporter的textfile collector采集。整体重写文件的开销较大，
+    距上次写入超过flush_interval秒时才重写，close时写入最终的计数。
+    """
+
+    METRICS = [
+        ("novel_llm_calls_total", "counter", "模型调用次数", "calls"),
+        ("novel_llm_errors_total", "counter", "失败的模型调用次数", "errors"),
+        ("novel_llm_cache_hits_total", "counter", "命中响应缓存的调用次数", "cache_hits"),
+        ("novel_llm_aborted_total", "counter", "中途中止的调用次数", "aborted"),
+        ("novel_llm_retries_total", "counter", "暂时性错误的重试次数", "retries"),
+        ("novel_llm_prompt_tokens_total", "counter", "输入token数", "prompt_tokens"),
+        ("novel_llm_completion_tokens_total", "counter", "输出token数", "completion_tokens"),
+        ("novel_llm_cached_prompt_tokens_total", "counter", "命中提供方前缀缓存的输入token数",
+         "cached_prompt_tokens"),
+        ("novel_llm_trimmed_tokens_total", "counter", "为适应上下文窗口压缩掉的输入token数", "trimmed_tokens"),
+        ("novel_llm_chars_total", "counter", "生成的字数", "chars"),
+        ("novel_llm_latency_seconds_sum", "counter", "调用总耗时（秒）", "latency"),
+    ]
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._series: Dict[tuple, Dict[str, float]] = {}
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def emit(self, record: CallRecord):
+        labels = (record.stage, record.model)
+        series = self._series.setdefault(labels, {key: 0 for _, _, _, key in self.METRICS})
+        series["calls"] += 1
+        series["errors"] += 1 if record.error else 0
+        series["cache_hits"] += 1 if record.cached else 0
+        series["aborted"] += 1 if record.aborted else 0
+        series["retries"] += record.retries
+        series["prompt_tokens"] += record.prompt_tokens
+        series["completion_tokens"] += record.completion_tokens
+        series["trimmed_tokens"] += record.trimmed_tokens
+        series["cached_prompt_tokens"] += record.cached_prompt_tokens
+        series["chars"] += record.chars
+        series["latency"] += record.latency
+        self._dirty = True
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        if self._dirty:
+            atomic_write(self.path, self.render())
+            self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def close(self):
+        self._flush()
+
+    def render(self) -> str:
+        lines = []
+        for name, metric_type, help_text, key in self.METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (stage, model), series in sorted(self._series.items()):
+                lines.append(f'{name}{{stage="{stage}",model="{model}"}} {series[key]:g}')
+        return "\n".join(lines) + "\n"
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {
+        "calls": 0, "errors": 0, "cache_hits": 0, "aborted": 0, "retries": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "trimmed_tokens": 0,
+        "shared_prefix_tokens": 0, "cached_prompt_tokens": 0, "chars": 0,
+        "latency_total": 0.0, "latency_max": 0.0
+    }
+
+
+class MetricsRecorder:
+    """接收每次调用的记录，分发给各个输出目标并按步骤、模型汇总"""
+
+    def __init__(self, sinks: Optional[List[MetricsSink]] = None):
+        self.sinks = list(sinks or [])
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._models: Dict[str, Dict[str, float]] = {}
+        self._total = _empty_totals()
+        self._started = time.time()
+
+    def record(self, record: CallRecord):
+        for totals in (self._total,
+                       self._stages.setdefault(record.stage, _empty_totals()),
+                       self._models.setdefault(record.model, _empty_totals())):
+            totals["calls"] += 1
+            totals["errors"] += 1 if record.error else 0
+            totals["cache_hits"] += 1 if record.cached else 0
+            totals["aborted"] += 1 if record.aborted else 0
+            totals["retries"] += record.retries
+            totals["prompt_tokens"] += record.prompt_tokens
+            totals["completion_tokens"] += record.completion_tokens
+            totals["trimmed_tokens"] += record.trimmed_tokens
+            totals["shared_prefix_tokens"] += record.shared_prefix_tokens
+            totals["cached_prompt_tokens"] += record.cached_prompt_tokens
+            totals["chars"] += record.chars
+            totals["latency_total"] += record.latency
+            totals["latency_max"] = max(totals["latency_max"], record.latency)
+        for sink in self.sinks:
+            sink.emit(record)
+
+    @staticmethod
+    def _finish(totals: Dict[str, float]) -> Dict[str, float]:
+        result = dict(totals)
+        result["latency_avg"] = totals["latency_total"] / totals["calls"] if totals["calls"] else 0.0
+        return result
+
+    def summary(self) -> Dict:
+        """按步骤和模型汇总的调用次数、token、耗时等"""
+        return {
+            "wall_clock": time.time() - self._started,
+            "total": self._finish(self._total),
+            "stages": {name: self._finish(t) for name, t in self._stages.items()},
+            "models": {name: self._finish(t) for name, t in self._models.items()}
+        }
+
+    def write_summary(self, path: str):
+        atomic_write(path, json.dumps(self.summary(), ensure_ascii=False, indent=2))
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
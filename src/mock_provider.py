@@ -0,0 +1,349 @@
+"""
+离线模拟的模型提供方，接口与AsyncOpenAI的chat.completions.create一致
+
+不需要API密钥和网络即可完整运行create_story，可模拟延迟分布、按tokens/秒输出的
+流式响应、限流错误和字数不足的章节，也可以回放录制的对话记录。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from .context import estimate_tokens
+from .prompts import PrefixReuseStats
+
+logger = logging.getLogger(__name__)
+
+# 章节正文的模拟长度，需高于agent中的MIN_WORDS
+CHAPTER_LENGTH = 2500
+# 字数不足时的模拟长度，以及续写请求的模拟长度
+SHORT_CHAPTER_LENGTH = 1200
+CONTINUATION_LENGTH = 1200
+
+# 模拟角色设计中的人名，数量与CHARACTER_DESIGN_PROMPT要求的40余个角色相当
+MOCK_NAMES = [surname + given for surname in "林苏赵王陈周吴郑冯" for given in ("云", "青岚", "天行", "若雪", "长风")]
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+# 模拟正文的词汇，按请求内容确定的随机顺序组合，避免整章都是重复片段
+MOCK_WORDS = ["少年", "剑光", "宗门", "长老", "灵气", "丹药", "秘境", "古阵", "雷霆", "妖兽",
+              "夜色", "山门", "师兄", "玉简", "神识", "符箓", "血脉", "星河", "寒潭", "古剑",
+              "低声", "冷笑", "抬手", "转身", "沉默", "震惊", "怒喝", "凝视", "踏出", "轰然",
+              "，", "。", "！", "……"]
+
+
+def _mock_characters() -> str:
+    """模拟角色设计：每个角色一个条目，附带几行描述"""
+    entries = []
+    for k, name in enumerate(MOCK_NAMES):
+        entries.append(
+            f"{k + 1}. {name}（{'主角' if k == 0 else '配角'}）：出身于第{k % 5 + 1}阶段登场的宗门势力，"
+            f"性格鲜明，擅长独门功法。\n   - 成长轨迹：从籍籍无名到名动一方，与主角关系复杂。\n"
+            f"   - 关键能力：掌握秘术与法宝，在关键时刻扭转局势。"
+        )
+    return "\n".join(entries)
+
+
+def _mock_setting() -> str:
+    """模拟世界观设定：若干段落，每段围绕一个地点"""
+    places = ["青云宗", "天剑城", "血魔谷", "东荒古域", "万妖山", "北冥海", "皇都", "落日沙漠"]
+    return "\n\n".join(
+        f"{place}是这个世界的重要地点，历史悠久，势力盘根错节。" * 4 for place in places
+    )
+
+
+def _mock_prose(length: int, seed_text: str, clauses: Sequence[str] = ()) -> str:
+    """由seed_text确定的模拟正文，同一请求总是得到相同的内容
+
+    clauses: 依次穿插在正文中的句子（如本章梗概的各个分句），模拟正文写到了梗概中的情节
+    """
+    rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).hexdigest())
+    parts, size = [], 0
+    while size < length:
+        if clauses and len(parts) % 20 == 19:
+            word = f"{clauses[len(parts) // 20 % len(clauses)]}。"
+        else:
+            word = rng.choice(MOCK_WORDS)
+        parts.append(word)
+        size += len(word)
+    return "".join(parts)[:length]
+
+
+def mock_reply(messages: List[Dict], short: bool = False, repetitive: bool = False) -> str:
+    """根据请求内容构造格式上可用的模拟回复
+
+    short为True时章节正文只返回SHORT_CHAPTER_LENGTH字，用于模拟字数不足；
+    repetitive为True时章节正文是同一个字的重复，用于模拟反复兜圈子的输出。
+    """
+    user_content = messages[-1].get("content", "") if messages else ""
+    system_content = messages[0].get("content", "") if messages else ""
+
+    if "角色设计大师" in system_content:
+        return _mock_characters()
+    if "世界观构建大师" in system_content:
+        return _mock_setting()
+    if "小说标题设计师" in system_content:
+        return '{"main_title": "模拟标题", "sub_title": "模拟副标题", "english_title": "Mock Title"}'
+    if "五个主要部分" in system_content:
+        return '{"起因": "《初醒》", "经过": "《交织》", "发展": "《风暴》", "高潮": "《决战》", "结局": "《归宁》"}'
+    if "文学风格分析专家" in system_content:
+        return "热血激昂，叙事直白明快，对话简洁有力。"
+
+    # 续写请求
+    if "请直接输出续写的正文" in user_content:
+        return _mock_prose(CONTINUATION_LENGTH, json.dumps(messages, ensure_ascii=False))
+
+    # 分层大纲的分卷、分篇请求：输出【第N卷：卷名】或【第N篇：篇名】加概要
+    match = re.search(r"规划为(\d+)(卷)|划分为(\d+)(篇)", user_content)
+    if match:
+        count, unit = int(match.group(1) or match.group(3)), match.group(2) or match.group(4)
+        return "\n\n".join(
+            f"【第{i}{unit}：模拟{unit}名{i}】\n{MOCK_NAMES[0]}在第{i}{unit}中前往{MOCK_NAMES[i % len(MOCK_NAMES)]}"
+            f"所在的天剑城，揭开新的秘密，{unit}末迎来转折。"
+            for i in range(1, count + 1)
+        )
+
+    # 章节梗概请求：按要求的章节范围输出【第N章：标题】格式
+    match = re.search(r"创作第(\d+)章到第(\d+)章的梗概", user_content)
+    if match:
+        start, end = int(match.group(1)), int(match.group(2))
+        return "\n\n".join(
+            f"【第{i}章：模拟章节{i}】\n模拟梗概内容，{MOCK_NAMES[0]}与{MOCK_NAMES[i % len(MOCK_NAMES)]}、"
+            f"{MOCK_NAMES[i * 7 % len(MOCK_NAMES)]}在天剑城相遇，第{i}章的事件与转折。"
+            for i in range(start, end + 1)
+        )
+
+    # 章节正文请求
+    if "本章梗概" in user_content:
+        length = SHORT_CHAPTER_LENGTH if short else CHAPTER_LENGTH
+        if repetitive:
+            return "模" * length
+        synopsis = user_content.split("本章梗概：")[-1].split("请直接开始创作")[0]
+        return _mock_prose(length, user_content, [c for c in re.split(r"[，。！？\s]+", synopsis) if c])
+
+    return "1. 模拟主题一\n2. 模拟主题二\n3. 模拟主题三"
+
+
+def transcript_key(messages: List[Dict]) -> str:
+    """对话记录的索引：只由消息内容决定，与录制时使用的提供方和模型无关"""
+    payload = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranscriptLog:
+    """JSONL格式的对话记录，每行为{"key", "messages", "content"}
+
+    可在任意提供方的真实运行中录制（NovelAIAgent的transcript参数），
+    再交给MockLLMClient回放。同一请求出现多次时按录制顺序依次返回。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def append(self, messages: List[Dict], content: str):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(
+            {"key": transcript_key(messages), "messages": messages, "content": content},
+            ensure_ascii=False
+        ) + "\n")
+        self._file.flush()
+
+    def load(self) -> Dict[str, deque]:
+        replies: Dict[str, deque] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    replies.setdefault(entry["key"], deque()).append(entry["content"])
+        return replies
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MockAPIError(Exception):
+    """模拟的接口错误，带有与SDK异常相同的status_code属性"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _MockCompletions:
+    def __init__(self, client: "MockLLMClient"):
+        self._client = client
+
+    async def create(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        return await self._client._create(model, messages, stream, kwargs.get("max_tokens"))
+
+
+class MockLLMClient:
+    """进程内的模拟客户端，可替代AsyncOpenAI直接作为NovelAIAgent.client
+
+    latency / latency_distribution: 首字延迟的均值与分布（fixed、uniform或lognormal）
+    tokens_per_second: 生成速度，非流式响应在返回前等待全部生成时间，0表示瞬时生成
+    chunk_tokens: 流式响应每块的字数
+    requests_per_minute: 模拟服务端的限流额度，超出时返回429
+    rate_limit_ratio / error_ratio: 随机返回429或503的概率
+    short_ratio: 章节正文字数不足的概率
+    repeat_ratio: 章节正文整章重复同一片段的概率
+    model_profiles: 按模型名覆盖上述参数，模拟不同档位的速度与质量，如
+        {"mock-flash": {"latency": 0.05, "short_ratio": 0.2}, "mock-plus": {"latency": 0.3}}，
+        可覆盖latency、tokens_per_second、short_ratio和repeat_ratio
+    prefill_tokens_per_second: 处理输入的速度，首字延迟额外增加 未命中前缀缓存的输入token数/该速度，0表示不计
+    prefix_cache: 模拟提供方的前缀缓存：与此前请求（同一模型）相同的前缀不再计入处理时间，
+        并在usage.prompt_tokens_details.cached_tokens中报告
+    replay_path: 回放的对话记录，命中时返回录制的内容，未命中时生成模拟回复
+    replay_strict: 回放未命中时抛出错误而不是生成模拟回复
+    """
+
+    def __init__(self, latency: float = 0.0, latency_distribution: str = "fixed",
+                 tokens_per_second: float = 0.0, chunk_tokens: int = 50,
+                 requests_per_minute: Optional[int] = None,
+                 rate_limit_ratio: float = 0.0, error_ratio: float = 0.0, short_ratio: float = 0.0,
+                 repeat_ratio: float = 0.0, model_profiles: Optional[Dict[str, Dict]] = None,
+                 prefill_tokens_per_second: float = 0.0, prefix_cache: bool = False,
+                 replay_path: Optional[str] = None, replay_strict: bool = False, seed: int = 0):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {latency_distribution}，"
+                             f"可选值：{', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.requests_per_minute = requests_per_minute
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.short_ratio = short_ratio
+        self.repeat_ratio = repeat_ratio
+        self.model_profiles = model_profiles or {}
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prefix_cache = prefix_cache
+        self._prefixes: Dict[str, PrefixReuseStats] = {}
+        self.replay_strict = replay_strict
+        self._replies = TranscriptLog(replay_path).load() if replay_path else {}
+        self._random = random.Random(seed)
+        self._recent_requests: deque = deque()
+        self.request_count = 0
+        self.replay_hits = 0
+        self.replay_misses = 0
+        self.chat = SimpleNamespace(completions=_MockCompletions(self))
+        if replay_path:
+            logger.info(f"已加载对话记录：{replay_path}（{sum(len(v) for v in self._replies.values())}条）")
+
+    def _option(self, model: str, name: str) -> float:
+        """按模型取参数，model_profiles中未覆盖时使用全局设置"""
+        return self.model_profiles.get(model, {}).get(name, getattr(self, name))
+
+    def _sample_latency(self, model: str) -> float:
+        latency = self._option(model, "latency")
+        if latency <= 0:
+            return 0.0
+        if self.latency_distribution == "uniform":
+            return self._random.uniform(0, 2 * latency)
+        if self.latency_distribution == "lognormal":
+            # sigma=0.5时均值为latency，长尾约为均值的3倍
+            sigma = 0.5
+            return self._random.lognormvariate(0, sigma) * latency / math.exp(sigma ** 2 / 2)
+        return latency
+
+    def _check_rate_limit(self):
+        """按滑动窗口统计最近一分钟的请求数，超出额度时返回429"""
+        if not self.requests_per_minute:
+            return
+        now = time.monotonic()
+        while self._recent_requests and now - self._recent_requests[0] >= 60:
+            self._recent_requests.popleft()
+        if len(self._recent_requests) >= self.requests_per_minute:
+            raise MockAPIError("mock rate limit exceeded", status_code=429)
+        self._recent_requests.append(now)
+
+    def _reply(self, model: str, messages: List[Dict]) -> str:
+        key = transcript_key(messages)
+        recorded = self._replies.get(key)
+        if recorded:
+            self.replay_hits += 1
+            # 最后一条保留，重复的请求继续返回它
+            return recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self._replies or self.replay_strict:
+            self.replay_misses += 1
+            if self.replay_strict:
+                raise MockAPIError("request not found in transcript", status_code=404)
+        return mock_reply(messages, short=self._random.random() < self._option(model, "short_ratio"),
+                          repetitive=self._random.random() < self._option(model, "repeat_ratio"))
+
+    def _generation_time(self, model: str, tokens: int) -> float:
+        tokens_per_second = self._option(model, "tokens_per_second")
+        return tokens / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    def _prefill(self, model: str, messages: List[Dict]) -> Tuple[int, int]:
+        """返回(输入token数, 命中前缀缓存的token数)"""
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        if not self.prefix_cache:
+            return prompt_tokens, 0
+        stats = self._prefixes.setdefault(model, PrefixReuseStats(count=estimate_tokens))
+        return prompt_tokens, min(stats.observe(messages), prompt_tokens)
+
+    async def _create(self, model: str, messages: List[Dict], stream: bool, max_tokens: Optional[int] = None):
+        self.request_count += 1
+        self._check_rate_limit()
+        prompt_tokens, cached_tokens = self._prefill(model, messages)
+        prefill = (prompt_tokens - cached_tokens) / self.prefill_tokens_per_second \
+            if self.prefill_tokens_per_second > 0 else 0.0
+        await asyncio.sleep(self._sample_latency(model) + prefill)
+        if self._random.random() < self.rate_limit_ratio:
+            raise MockAPIError("mock rate limited", status_code=429)
+        if self._random.random() < self.error_ratio:
+            raise MockAPIError("mock overloaded", status_code=503)
+
+        content = self._reply(model, messages)
+        finish_reason = "stop"
+        if max_tokens is not None and estimate_tokens(content) > max_tokens:
+            # 与真实接口一致，达到输出上限时截断并以length结束
+            content = content[:max_tokens]
+            finish_reason = "length"
+        if stream:
+            return self._stream(model, content)
+
+        await asyncio.sleep(self._generation_time(model, estimate_tokens(content)))
+        completion_tokens = estimate_tokens(content)
+        return SimpleNamespace(
+            id=f"mock-{self.request_count}",
+            model=model,
+            choices=[SimpleNamespace(
+                index=0,
+                message=SimpleNamespace(role="assistant", content=content),
+                finish_reason=finish_reason
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens)
+            )
+        )
+
+    async def _stream(self, model: str, content: str) -> AsyncIterator[SimpleNamespace]:
+        """按tokens_per_second的速度逐块产出"""
+        for start in range(0, len(content), self.chunk_tokens):
+            text = content[start:start + self.chunk_tokens]
+            await asyncio.sleep(self._generation_time(model, estimate_tokens(text)))
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=text), finish_reason=None)]
+            )
+
+    async def close(self):
+        pass
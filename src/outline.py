@@ -0,0 +1,162 @@
+"""
+长篇连载的分层大纲：全书 → 卷 → 篇 → 章
+
+默认的五阶段×10章梗概需要在开写之前一次规划完全书，几百章的连载既放不进一次请求，
+也不必提前规划尚未写到的部分。分层大纲只在需要时展开节点：
+- 卷：开始时一次规划全书的分卷（每卷一句话级别的概要，请求很小）
+- 篇：写到某一卷时才把这一卷划分为若干篇
+- 章：写到某一篇之前才展开这一篇的章节梗概，并与章节正文的生成流水线并行
+
+因此规划的调用次数随实际写到的章节数增长，而不是随全书的总长度增长。
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple
+
+from .synopsis import parse_chapter_number
+
+logger = logging.getLogger(__name__)
+
+# 卷、篇概要的输出字数，以及每章梗概的输出字数（用于计算max_tokens）
+PLAN_ITEM_CHARS = 200
+SYNOPSIS_CHARS_PER_CHAPTER = 300
+
+
+@dataclass(frozen=True)
+class OutlineShape:
+    """大纲的形状：卷数、每卷的篇数、每篇的章数"""
+    volumes: int
+    arcs_per_volume: int
+    chapters_per_arc: int
+
+    def __post_init__(self):
+        if min(self.volumes, self.arcs_per_volume, self.chapters_per_arc) < 1:
+            raise ValueError(f"大纲形状的各级数量至少为1：{self}")
+
+    @classmethod
+    def parse(cls, text: str) -> "OutlineShape":
+        """解析“卷数x篇数x章数”，如10x5x10表示10卷、每卷5篇、每篇10章，共500章"""
+        parts = re.split(r"[x×*]", text.strip().lower())
+        try:
+            volumes, arcs, chapters = (int(part) for part in parts)
+        except ValueError:
+            raise ValueError(f"大纲形状应为“卷数x篇数x章数”，如10x5x10：{text}") from None
+        return cls(volumes, arcs, chapters)
+
+    def __str__(self) -> str:
+        return f"{self.volumes}x{self.arcs_per_volume}x{self.chapters_per_arc}"
+
+    @property
+    def chapters_per_volume(self) -> int:
+        return self.arcs_per_volume * self.chapters_per_arc
+
+    @property
+    def total_chapters(self) -> int:
+        return self.volumes * self.chapters_per_volume
+
+    def arcs(self) -> Iterator[Tuple[int, int]]:
+        """按顺序遍历所有的(卷, 篇)，均从1开始"""
+        for volume in range(1, self.volumes + 1):
+            for arc in range(1, self.arcs_per_volume + 1):
+                yield volume, arc
+
+    def arc_chapters(self, volume: int, arc: int) -> range:
+        """第volume卷第arc篇包含的章节编号（全书统一编号）"""
+        start = (volume - 1) * self.chapters_per_volume + (arc - 1) * self.chapters_per_arc + 1
+        return range(start, start + self.chapters_per_arc)
+
+    def locate(self, chapter: int) -> Tuple[int, int]:
+        """章节所在的(卷, 篇)"""
+        index = chapter - 1
+        return index // self.chapters_per_volume + 1, index % self.chapters_per_volume // self.chapters_per_arc + 1
+
+
+@dataclass
+class PlanItem:
+    """一卷或一篇的规划"""
+    number: int
+    title: str
+    summary: str
+
+    def render(self, unit: str) -> str:
+        return f"【第{self.number}{unit}：{self.title or '未命名'}】\n{self.summary}"
+
+
+def _plan_header(unit: str) -> re.Pattern:
+    # 与章节梗概的标题格式相同，如【第3卷：卷名】、### 第三篇 篇名
+    return re.compile(
+        r"^[ \t#*>]*[【\[［]?[ \t]*第[ \t]*([0-9０-９]+|[零〇一二两三四五六七八九十百]+)[ \t]*" + unit +
+        r"[ \t]*[：:、.．\-—]*[ \t]*([^】\]］\n]*)[】\]］]?[ \t*]*",
+        re.M
+    )
+
+
+def parse_plan(text: str, unit: str, count: int) -> List[PlanItem]:
+    """解析卷或篇的规划，返回编号1到count的条目；缺失的条目以占位概要补齐"""
+    headers = list(_plan_header(unit).finditer(text))
+    items: Dict[int, PlanItem] = {}
+    for match, following in zip(headers, headers[1:] + [None]):
+        number = parse_chapter_number(match.group(1))
+        if number is None or not 1 <= number <= count or number in items:
+            continue
+        summary = text[match.end():following.start() if following else len(text)].strip()
+        items[number] = PlanItem(number, match.group(2).strip().strip("*#《》").strip(), summary)
+    missing = [n for n in range(1, count + 1) if n not in items]
+    if missing:
+        logger.warning(f"规划中缺少第{'、'.join(map(str, missing))}{unit}，使用占位概要")
+    return [items.get(n) or PlanItem(n, "", f"承接上一{unit}的情节继续推进主线。") for n in range(1, count + 1)]
+
+
+def render_plan(items: List[PlanItem], unit: str) -> str:
+    return "\n\n".join(item.render(unit) for item in items)
+
+
+@dataclass
+class OutlineTree:
+    """已展开的分层大纲，未展开的卷没有篇，未展开的篇没有章节"""
+    shape: OutlineShape
+    volumes: List[PlanItem] = field(default_factory=list)
+    arcs: Dict[int, List[PlanItem]] = field(default_factory=dict)
+    chapters: Dict[Tuple[int, int], List[int]] = field(default_factory=dict)
+
+    @staticmethod
+    def label(volume: int, arc: int) -> str:
+        return f"第{volume}卷第{arc}篇"
+
+    def neighbours(self, volume: int, arc: int) -> Tuple[str, str]:
+        """(上一篇的概要, 之后的走向)：之后的走向为本卷下一篇的概要，本卷最后一篇则为下一卷的概要
+
+        只使用展开本篇时必然已经就绪的节点，同样的规划总是得到同样的上下文。
+        """
+        if arc > 1:
+            previous = self.arcs[volume][arc - 2].summary
+        elif volume > 1:
+            previous = self.arcs[volume - 1][-1].summary
+        else:
+            previous = ""
+        if arc < self.shape.arcs_per_volume:
+            following = self.arcs[volume][arc].summary
+        elif volume < self.shape.volumes:
+            following = f"下一卷：{self.volumes[volume].summary}"
+        else:
+            following = ""
+        return previous, following
+
+    def to_dict(self) -> Dict:
+        """输出为outline_tree.json的内容，未展开的节点chapters为null"""
+        return {
+            "shape": str(self.shape),
+            "volumes": [{
+                "number": volume.number,
+                "title": volume.title,
+                "summary": volume.summary,
+                "arcs": [{
+                    "number": arc.number,
+                    "title": arc.title,
+                    "summary": arc.summary,
+                    "chapters": self.chapters.get((volume.number, arc.number))
+                } for arc in self.arcs.get(volume.number, [])]
+            } for volume in self.volumes]
+        }
@@ -2,7 +2,10 @@
 存储所有用于故事生成的prompt模板
 """
 
-from typing import Dict
+import json
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
 
 THEME_ANALYSIS_PROMPT = """作为一位深刻的文学分析家，请从提供的故事提示中提炼出核心主题和哲学思考。
 要求：
@@ -235,39 +238,301 @@ CONTENT_CREATION_SYSTEM_PROMPT = """你是一位擅长创作爽文的小说家
    - 避免过度夸张
 """
 
-def get_chapter_content_prompt(meta_info: Dict, chapter_synopsis: str, chapter_num: int) -> str:
-    """生成具体章节内容的prompt"""
-    return f"""作为小说创作者，请基于以下信息创作第{chapter_num}章的具体内容。
+CHAPTER_CONTINUATION_PROMPT = """上面的章节正文目前只有{written_words}字，未达到{required_words}字的要求。请继续创作本章：
 
-小说基本信息：
-1. 标题：{meta_info['title']}
-2. 主题：{meta_info['theme']}
-3. 世界观设定：
-{meta_info['setting']}
+1. 紧接上文最后一句往下写，不要重复已写的内容，不要重新开头
+2. 再补充约{remaining_words}字，推进本章梗概中尚未写到的情节
+3. 保持人物、语气和叙事视角与上文一致
+4. 写到本章情节完整收束为止
+
+请直接输出续写的正文：
+"""
+
+# 章节正文的创作要求：所有小说、所有章节都相同，放在提示词最前面以便复用缓存的前缀
+CHAPTER_REQUIREMENTS_PROMPT = """请根据以下信息创作小说章节的具体内容。
+
+创作要求：
+1. 字数要求：必须超过{required_words}字，建议2500-3500字
+   - 如果内容不足{required_words}字，请继续补充
+   - 保持情节的完整性和连贯性
+   - 不要为凑字数而冗长
+
+2. 情节结构：
+   - 反转与震撼（35%）：意外展现、打脸装逼
+   - 期待与升级（35%）：能力提升、资源获取
+   - 场景描写（20%）：震撼场面、众人反应
+   - 对话设计（10%）：金句对决、暗藏玄机
+
+3. 爽感要求：
+   - 情节要出人意料
+   - 打脸要干脆利落
+   - 升级要令人期待
+   - 反转要令人震惊
+
+4. 写作要点：
+   - 合理铺垫伏笔
+   - 制造期待感
+   - 突出震撼效果
+   - 保持爽感节奏
+"""
+
+# 提示词各段的稳定程度：越稳定越靠前，使同一部小说的各次请求共享尽可能长的相同前缀，
+# 提供方（或本地推理服务）的前缀缓存可以直接复用这部分的计算
+STABLE_STATIC = 0    # 所有小说都相同的模板文字
+STABLE_NOVEL = 1     # 同一部小说内不变：标题、主题、基调、完整的世界观与角色设计
+STABLE_REQUEST = 2   # 每次请求不同：本章梗概、本章相关人物、前情回顾等
+
+
+@dataclass
+class PromptSegment:
+    text: str
+    stability: int
 
-4. 主要人物：
-{meta_info['characters']}
 
-5. 写作基调：
-{meta_info['tone']}
+def assemble_messages(system_prompt: str, segments: List[PromptSegment]) -> List[Dict]:
+    """按稳定程度从高到低拼接用户消息，同一等级内保持给定的顺序
 
+    系统提示词放在最前；各段原样拼接，同样的输入总是得到逐字节相同的前缀。
+    """
+    ordered = sorted(segments, key=lambda segment: segment.stability)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "".join(segment.text for segment in ordered if segment.text)}
+    ]
+
+
+def get_chapter_content_messages(meta_info: Dict, chapter_title: str, chapter_synopsis: str,
+                                 required_words: int, characters: Optional[str] = None,
+                                 context: str = "") -> List[Dict]:
+    """章节正文请求的消息
+
+    characters为None时附带meta_info中的完整角色设计（同一部小说内不变，属于共享前缀）；
+    否则为本章挑选的人物，与context（前情回顾、相关设定）一起放在本章梗概之前的可变部分。
+    """
+    novel_info = f"""
+小说基本信息：
+标题：{meta_info.get('title', '未命名')}
+主题：{', '.join(meta_info.get('themes', []))}
+基调：{meta_info.get('tone', '')}
+"""
+    segments = [
+        PromptSegment(CHAPTER_REQUIREMENTS_PROMPT.format(required_words=required_words), STABLE_STATIC),
+        PromptSegment(novel_info, STABLE_NOVEL)
+    ]
+    if characters is None:
+        segments.append(PromptSegment(f"\n主要人物：\n{meta_info.get('characters', '')}\n", STABLE_NOVEL))
+    else:
+        segments.append(PromptSegment(f"\n主要人物：\n{characters}\n", STABLE_REQUEST))
+    segments += [
+        PromptSegment(context, STABLE_REQUEST),
+        PromptSegment(f"""
 本章信息：
-1. 章节标题：{meta_info['chapters'][chapter_num-1]['title']}
-2. 本章梗概：
+{chapter_title}
+
+本章梗概：
 {chapter_synopsis}
 
-写作要求：
-1. 字数控制在2500字左右
-2. 场景描写要具体，注意细节
-3. 对话要自然，展现人物性格
-4. 情节发展要符合人物性格和故事逻辑
-5. 要有适当的悬念和铺垫
-6. 注意与前后章节的连贯性
-7. 符合整体的写作基调
+请直接开始创作本章正文，确保字数超过{required_words}字：
+""", STABLE_REQUEST)
+    ]
+    return assemble_messages(CONTENT_CREATION_SYSTEM_PROMPT, segments)
+
+
+# 分阶段章节梗概的要求：五个阶段共用，放在最前面
+STAGE_SYNOPSIS_REQUIREMENTS_PROMPT = """请为小说创作一个阶段10个章节的详细梗概。
+
+梗概要求：
+1. 每章梗概200字左右
+2. 体现阶段性特点：
+   - 起：引入故事、展示天赋、初入宗门
+   - 承：磨练成长、结交好友、树敌对手
+   - 转：身世之谜、实力暴涨、危机显现
+   - 合：真相揭露、大战爆发、逆境突破
+   - 终：终极决战、拯救世界、圆满收官
+
+3. 爽点要求：
+   - 每章都要有意外或反转
+   - 实力要循序渐进提升
+   - 设置合理的打脸情节
+   - 制造期待和悬念
+"""
+
+
+def get_stage_synopsis_messages(meta_info: Dict, stage_index: int, stage: str,
+                                start_chapter: int, end_chapter: int, previous_tail: str = "") -> List[Dict]:
+    """单个阶段章节梗概请求的消息：五个阶段共享要求与小说信息，阶段序号、章节范围放在最后"""
+    continuity = ""
+    if previous_tail:
+        continuity = f"""
+上一阶段最后的章节梗概（本阶段需与之自然衔接）：
+{previous_tail}
+"""
+    return assemble_messages("你是一位优秀的故事规划师，擅长设计扣人心弦的情节。", [
+        PromptSegment(STAGE_SYNOPSIS_REQUIREMENTS_PROMPT, STABLE_STATIC),
+        PromptSegment(f"""
+小说基本信息：
+标题：{meta_info.get('title', '未命名')}
+主题：{', '.join(meta_info.get('themes', []))}
+世界观：{meta_info.get('setting', '')}
+主要人物：{meta_info.get('characters', '')}
+""", STABLE_NOVEL),
+        PromptSegment(continuity, STABLE_REQUEST),
+        PromptSegment(f"""
+本阶段：第{stage_index}阶段（{stage}），创作第{start_chapter}章到第{end_chapter}章的梗概
+
+请按以下格式输出10个章节的梗概：
+
+【第{start_chapter}章：章节标题】
+[详细梗概，包含地点、人物、事件、转折]
+
+【第{start_chapter + 1}章：章节标题】
+[详细梗概]
+...
+""", STABLE_REQUEST)
+    ])
+
+
+# 长篇连载的分层大纲：全书分卷，每卷分篇，每篇再展开为章节梗概（见outline.OutlineShape）
+VOLUME_PLAN_PROMPT = """你是一位擅长长篇网络连载的故事规划师。请把整部小说划分为若干卷，要求：
+1. 每卷有独立的主线目标和核心冲突，卷末有推动下一卷的转折
+2. 全书的实力体系、地图和人物关系随卷推进逐步展开
+3. 各卷节奏有张有弛，最后一卷完成终极决战并收束所有伏笔
+"""
+
+ARC_PLAN_PROMPT = """你是一位擅长长篇网络连载的故事规划师。请把一卷小说划分为若干篇，要求：
+1. 每篇围绕一个完整的事件展开，有开端、冲突升级和阶段性的爽点
+2. 篇与篇之间因果相连，共同完成本卷的主线目标
+3. 本卷的最后一篇要落到本卷结尾的转折上
+"""
+
+ARC_SYNOPSIS_REQUIREMENTS_PROMPT = """请为小说的一篇创作连续若干章的详细梗概。
 
-请创作本章的具体内容。
+梗概要求：
+1. 每章梗概200字左右
+2. 严格按照本篇的剧情规划推进，与前后两篇自然衔接
+3. 爽点要求：
+   - 每章都要有意外或反转
+   - 实力要循序渐进提升
+   - 设置合理的打脸情节
+   - 制造期待和悬念
 """
 
+
+def _novel_info_segment(meta_info: Dict) -> PromptSegment:
+    """分层大纲各级请求共享的小说信息，与分阶段梗概请求相同"""
+    return PromptSegment(f"""
+小说基本信息：
+标题：{meta_info.get('title', '未命名')}
+主题：{', '.join(meta_info.get('themes', []))}
+世界观：{meta_info.get('setting', '')}
+主要人物：{meta_info.get('characters', '')}
+""", STABLE_NOVEL)
+
+
+def get_volume_plan_messages(meta_info: Dict, volumes: int, chapters_per_volume: int) -> List[Dict]:
+    """全书分卷规划的请求消息"""
+    return assemble_messages(VOLUME_PLAN_PROMPT, [
+        _novel_info_segment(meta_info),
+        PromptSegment(f"""
+请把全书规划为{volumes}卷，每卷约{chapters_per_volume}章，按以下格式输出：
+
+【第1卷：卷名】
+[本卷概要：主线目标、核心冲突、主要登场人物、卷末的转折，150字左右]
+
+【第2卷：卷名】
+[本卷概要]
+...
+""", STABLE_REQUEST)
+    ])
+
+
+def get_arc_plan_messages(meta_info: Dict, volume_plan: str, volume: int, arcs: int,
+                          chapters_per_arc: int) -> List[Dict]:
+    """一卷分篇规划的请求消息；volume_plan为全书的分卷规划"""
+    return assemble_messages(ARC_PLAN_PROMPT, [
+        _novel_info_segment(meta_info),
+        PromptSegment(f"\n全书分卷规划：\n{volume_plan}\n", STABLE_NOVEL),
+        PromptSegment(f"""
+请把第{volume}卷划分为{arcs}篇，每篇{chapters_per_arc}章，按以下格式输出：
+
+【第1篇：篇名】
+[本篇概要：核心事件、冲突如何升级、结尾的结果，150字左右]
+
+【第2篇：篇名】
+[本篇概要]
+...
+""", STABLE_REQUEST)
+    ])
+
+
+def get_arc_synopsis_messages(meta_info: Dict, label: str, plan: str, previous: str, following: str,
+                              start_chapter: int, end_chapter: int) -> List[Dict]:
+    """一篇章节梗概的请求消息：plan为本篇的剧情规划，previous/following为前后两篇（或下一卷）的概要"""
+    return assemble_messages("你是一位优秀的故事规划师，擅长设计扣人心弦的情节。", [
+        PromptSegment(ARC_SYNOPSIS_REQUIREMENTS_PROMPT, STABLE_STATIC),
+        _novel_info_segment(meta_info),
+        PromptSegment(f"""
+上一篇概要：{previous or '（无，本篇是全书开篇）'}
+下一步走向：{following or '（无，本篇是全书结局）'}
+
+本篇：{label}
+本篇剧情规划：{plan}
+
+请创作第{start_chapter}章到第{end_chapter}章的梗概，共{end_chapter - start_chapter + 1}章，按以下格式输出：
+
+【第{start_chapter}章：章节标题】
+[详细梗概，包含地点、人物、事件、转折]
+
+【第{start_chapter + 1}章：章节标题】
+[详细梗概]
+...
+""", STABLE_REQUEST)
+    ])
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """两个字符串相同前缀的长度（二分查找，切片比较在C层完成）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PrefixReuseStats:
+    """统计各次请求与此前请求之间相同的前缀，估算前缀缓存可以复用的比例
+
+    每次请求与最近history次请求比较，取最长的相同前缀；count把文本换算为token数。
+    """
+
+    def __init__(self, history: int = 16, count: Callable[[str], int] = len):
+        self.count = count
+        self._recent: deque = deque(maxlen=history)
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.shared_tokens = 0
+
+    def observe(self, messages: List[Dict]) -> int:
+        """记录一次请求，返回其中与此前请求相同的前缀token数"""
+        text = json.dumps(messages, ensure_ascii=False)
+        shared = max((common_prefix_length(text, previous) for previous in self._recent), default=0)
+        self._recent.append(text)
+        shared_tokens = self.count(text[:shared])
+        self.requests += 1
+        self.prompt_tokens += self.count(text)
+        self.shared_tokens += shared_tokens
+        return shared_tokens
+
+    @property
+    def stats(self) -> Dict:
+        ratio = self.shared_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return {"requests": self.requests, "prompt_tokens": self.prompt_tokens,
+                "shared_tokens": self.shared_tokens, "reuse_ratio": round(ratio, 3)}
+
+
 SECTION_TITLE_PROMPT = """请为这个故事的五个主要部分生成富有诗意和象征意义的标题。每个标题要：
 1. 简洁有力（2-3个字）
 2. 与内容相呼应
@@ -0,0 +1,137 @@
+"""
+模型提供方插件注册表：每个提供方的SDK只在创建该提供方的端点时才导入
+
+内置puyu（OpenAI兼容协议）、glm（智谱SDK）和mock（离线模拟）三个提供方。新增提供方无需修改
+NovelAIAgent或ProviderEndpoint，只需注册一个ProviderPlugin：
+
+    from src.provider_registry import ProviderPlugin, register_provider
+
+    def create_client(api_key, base_url, max_connections, keepalive_expiry, **options):
+        from some_sdk import AsyncClient   # 在这里导入SDK，未选用该提供方时不会加载
+        return AsyncClient(api_key=api_key, base_url=base_url)
+
+    register_provider(ProviderPlugin("deepseek", {"complex": "...", "medium": "...", "simple": "..."},
+                                     create_client))
+
+也可以在提供方配置文件中用"plugin": "模块:属性"指定插件，创建端点时导入该模块并注册。
+客户端需提供与AsyncOpenAI一致的chat.completions.create和close；同步SDK设置is_async=False，
+调用会放到线程池中执行。插件可用import_sdk导入SDK，未安装时的错误会指明需要安装的包。
+"""
+
+import importlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# create_client(api_key, base_url, max_connections, keepalive_expiry, **options) -> 客户端
+ClientFactory = Callable[..., object]
+
+
+@dataclass
+class ProviderPlugin:
+    """一个模型提供方
+
+    models: 按任务复杂度（complex、medium、simple）使用的模型名
+    create_client: 创建复用连接的客户端，SDK在此函数内导入
+    is_async: 客户端是否为原生异步；同步客户端的调用放到线程池中执行
+    """
+    name: str
+    models: Dict[str, str]
+    create_client: ClientFactory
+    is_async: bool = True
+
+
+_REGISTRY: Dict[str, ProviderPlugin] = {}
+
+
+def register_provider(plugin: ProviderPlugin, replace: bool = False) -> ProviderPlugin:
+    """注册提供方；同名提供方已存在时需指定replace"""
+    if plugin.name in _REGISTRY and not replace:
+        raise ValueError(f"提供方已注册: {plugin.name}")
+    _REGISTRY[plugin.name] = plugin
+    return plugin
+
+
+def get_provider(name: str) -> ProviderPlugin:
+    plugin = _REGISTRY.get(name)
+    if plugin is None:
+        raise ValueError(f"不支持的模型类型: {name}，可选值：{', '.join(available_providers())}")
+    return plugin
+
+
+def available_providers() -> List[str]:
+    return list(_REGISTRY)
+
+
+def load_plugin(spec: str) -> ProviderPlugin:
+    """按"模块:属性"导入插件并注册，属性可以是ProviderPlugin或返回它的函数；重复加载时直接返回已注册的插件"""
+    module_name, _, attr = spec.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"插件格式应为'模块:属性'：{spec}")
+    plugin = getattr(importlib.import_module(module_name), attr)
+    if not isinstance(plugin, ProviderPlugin):
+        plugin = plugin()
+    if _REGISTRY.get(plugin.name) is plugin:
+        return plugin
+    return register_provider(plugin)
+
+
+# ---- 内置提供方 ----
+
+def import_sdk(module: str, provider: str, package: Optional[str] = None):
+    """导入提供方的SDK，未安装时抛出指明缺少哪个包的ImportError"""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        package = package or module
+        raise ImportError(f"提供方{provider}需要安装{package}（pip install {package}，"
+                          f"或pip install -r requirements.txt）") from e
+
+
+def _openai_client(api_key: str, base_url, max_connections: int, keepalive_expiry: float, **options):
+    # 浦语兼容OpenAI协议，直接使用原生异步客户端
+    # SDK自带的重试关闭，统一由NovelAIAgent按退避策略重试
+    httpx = import_sdk("httpx", "puyu")
+    openai = import_sdk("openai", "puyu")
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=keepalive_expiry)
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                              http_client=openai.DefaultAsyncHttpxClient(limits=limits), **options)
+
+
+def _zhipuai_client(api_key: str, base_url, max_connections: int, keepalive_expiry: float, **options):
+    # 智谱SDK只提供同步客户端，调用时放到线程池中执行；连接池在线程间共享
+    httpx = import_sdk("httpx", "glm")
+    zhipuai = import_sdk("zhipuai", "glm")
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                          keepalive_expiry=keepalive_expiry)
+    return zhipuai.ZhipuAI(api_key=api_key, max_retries=0, http_client=httpx.Client(limits=limits), **options)
+
+
+def _mock_client(api_key: str, base_url, max_connections: int, keepalive_expiry: float, **options):
+    from .mock_provider import MockLLMClient
+
+    return MockLLMClient(**options)
+
+
+register_provider(ProviderPlugin(
+    "puyu",
+    {"complex": "internlm2.5-latest", "medium": "internlm2.5-latest", "simple": "internlm2.5-latest"},
+    _openai_client
+))
+register_provider(ProviderPlugin(
+    "glm",
+    {
+        "complex": "glm-4-plus",   # 最复杂的任务：故事大纲、人物设计等
+        "medium": "glm-4-air",     # 中等复杂度：章节梗概、主题分析等
+        "simple": "glm-4-flash"    # 简单任务：具体内容生成等
+    },
+    _zhipuai_client,
+    is_async=False
+))
+register_provider(ProviderPlugin(
+    "mock",
+    {"complex": "mock-plus", "medium": "mock-air", "simple": "mock-flash"},
+    _mock_client
+))
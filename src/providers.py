@@ -0,0 +1,291 @@
+"""
+模型提供方连接池：多个密钥/端点之间负载均衡，按端点限流，出错率过高时熔断并切换
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from .provider_registry import get_provider, load_plugin
+from .rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# 每个端点保持的连接数与空闲连接的保活时间（秒）
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+# 所有端点都不可用且有试探请求进行中时，检查试探结果的间隔（秒）
+PROBE_POLL_INTERVAL = 0.5
+
+
+class CircuitBreaker:
+    """按最近若干次调用的失败率熔断
+
+    closed：正常放行；最近window次调用中失败率超过failure_rate（且至少min_calls次）时打开。
+    open：cooldown秒内不再选择该端点。
+    half_open：冷却结束后放行一次试探调用，成功则关闭，失败则重新打开；
+    试探调用被取消时（release）既不算成功也不算失败，下一次调用重新试探。
+    """
+
+    def __init__(self, failure_rate: float = 0.5, window: int = 20, min_calls: int = 5,
+                 cooldown: float = 30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._results: deque = deque(maxlen=window)
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # 半开状态同一时间只放行一个试探请求
+        return state == "half_open" and not self._probing
+
+    def wait_time(self) -> Optional[float]:
+        """距离再次放行请求的秒数；半开且试探进行中时返回None，取决于试探何时结束"""
+        state = self.state
+        if state == "open":
+            return self._opened_at + self.cooldown - time.monotonic()
+        if state == "half_open" and self._probing:
+            return None
+        return 0.0
+
+    def on_request(self):
+        if self.state == "half_open":
+            self._probing = True
+
+    def release(self):
+        """请求没有结果就结束了（被调用方取消），释放试探名额，不计入失败率"""
+        self._probing = False
+
+    def record(self, success: bool):
+        if self._opened_at is not None:
+            # 试探请求的结果决定关闭还是重新打开
+            self._probing = False
+            if success:
+                self._opened_at = None
+                self._results.clear()
+            else:
+                self._opened_at = time.monotonic()
+            return
+        self._results.append(success)
+        failures = self._results.count(False)
+        if len(self._results) >= self.min_calls and failures / len(self._results) > self.failure_rate:
+            self._opened_at = time.monotonic()
+
+
+class ProviderEndpoint:
+    """一个提供方密钥/端点，持有复用连接的客户端、独立的限流器和熔断器
+
+    model_type: 提供方名称，见provider_registry；该提供方的SDK在此时才导入
+    priority: 数值越小越优先；只有更优先的端点全部熔断时才会切换到下一级
+    weight: 同一优先级内的负载权重，按 进行中请求数/权重 选择最空闲的端点
+    client_options: 传给提供方客户端的其他参数（mock提供方的延迟、生成速度等，mock_options与此相同）
+    """
+
+    def __init__(self, model_type: str, api_key: str, base_url: Optional[str] = None,
+                 name: Optional[str] = None, requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None, priority: int = 0, weight: float = 1.0,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 mock_options: Optional[Dict] = None, breaker: Optional[CircuitBreaker] = None,
+                 client_options: Optional[Dict] = None):
+        self.plugin = get_provider(model_type)
+        self.model_type = model_type
+        self.name = name or f"{model_type}-{api_key[-4:]}"
+        self.models = self.plugin.models
+        self.priority = priority
+        self.weight = max(weight, 0.01)
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+        self.client = self.plugin.create_client(api_key, base_url, max_connections, keepalive_expiry,
+                                                **(client_options or mock_options or {}))
+
+    @property
+    def is_async(self) -> bool:
+        """原生异步的客户端直接await，同步客户端（如智谱）放到线程池中调用"""
+        return self.plugin.is_async
+
+    def resolve_model(self, complexity: str) -> str:
+        return self.models.get(complexity, self.models["medium"])
+
+    async def create(self, messages: List[Dict], complexity: str, **kwargs):
+        """发起一次请求，返回SDK的原始响应对象（stream=True时为流）"""
+        model = self.resolve_model(complexity)
+        if self.is_async:
+            return await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return await asyncio.to_thread(
+            self.client.chat.completions.create, model=model, messages=messages, **kwargs
+        )
+
+    async def iter_text(self, stream) -> AsyncIterator[str]:
+        """逐段产出流式响应中的文本"""
+        if self.is_async:
+            async for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    yield text
+            return
+        # 智谱的流是同步迭代器，逐块在线程池中读取
+        iterator = iter(stream)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                break
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+    async def close_stream(self, stream):
+        """关闭流式响应，调用方提前停止读取时释放连接"""
+        close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+        if close is None:
+            return
+        if self.is_async:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        else:
+            await asyncio.to_thread(close)
+
+    async def close(self):
+        if self.is_async:
+            await self.client.close()
+        else:
+            await asyncio.to_thread(self.client.close)
+
+
+class ProviderPool:
+    """在多个端点之间分配请求
+
+    选择规则：跳过熔断中的端点，取优先级最高的一组，在组内选 进行中请求数/权重 最小、
+    且限流等待最短的端点。所有端点都熔断时不再选择任何端点，acquire等待最早的端点冷却结束
+    （或半开试探结束）后再选择，熔断中的端点不会收到请求。
+    池可以在多个NovelAIAgent之间共享，连接和限流额度随之共享。
+    """
+
+    def __init__(self, endpoints: Iterable[ProviderEndpoint]):
+        self.endpoints = list(endpoints)
+        if not self.endpoints:
+            raise ValueError("提供方连接池中至少需要一个端点")
+
+    @property
+    def primary(self) -> ProviderEndpoint:
+        """优先级最高的第一个端点，用于缓存键和默认模型名"""
+        return min(self.endpoints, key=lambda e: e.priority)
+
+    def select(self, exclude: Iterable[ProviderEndpoint] = ()) -> Optional[ProviderEndpoint]:
+        """选择一个熔断器放行的端点，优先选择exclude之外的；没有可用端点时返回None"""
+        allowed = [e for e in self.endpoints if e.breaker.allow()]
+        if not allowed:
+            return None
+        excluded = set(id(e) for e in exclude)
+        candidates = [e for e in allowed if id(e) not in excluded] or allowed
+        top = min(e.priority for e in candidates)
+        group = [e for e in candidates if e.priority == top]
+        endpoint = min(group, key=lambda e: (e.in_flight / e.weight, e.rate_limiter.wait_time(0)))
+        endpoint.breaker.on_request()
+        return endpoint
+
+    def wait_time(self) -> float:
+        """距离最早有端点可以放行请求的秒数"""
+        waits = [e.breaker.wait_time() for e in self.endpoints]
+        known = [wait for wait in waits if wait is not None]
+        if len(known) < len(waits):
+            known.append(PROBE_POLL_INTERVAL)
+        return max(min(known), 0.0)
+
+    async def acquire(self, exclude: Iterable[ProviderEndpoint] = ()) -> ProviderEndpoint:
+        """同select，所有端点都熔断时等待最早的端点恢复放行"""
+        while True:
+            endpoint = self.select(exclude)
+            if endpoint is not None:
+                return endpoint
+            delay = self.wait_time()
+            logger.warning(f"所有端点均已熔断，{delay:.1f}秒后重新选择端点...")
+            await asyncio.sleep(delay)
+
+    def has_alternative(self, exclude: Iterable[ProviderEndpoint] = ()) -> bool:
+        """除exclude之外是否还有未熔断的端点可以立即切换"""
+        excluded = set(id(e) for e in exclude)
+        return any(id(e) not in excluded and e.breaker.allow() for e in self.endpoints)
+
+    def release(self, endpoint: ProviderEndpoint):
+        """select选出的端点没有发出请求或请求被取消，不计入调用结果"""
+        endpoint.breaker.release()
+
+    def report(self, endpoint: ProviderEndpoint, success: bool):
+        endpoint.calls += 1
+        if not success:
+            endpoint.failures += 1
+        previous = endpoint.breaker.state
+        endpoint.breaker.record(success)
+        state = endpoint.breaker.state
+        if state != previous:
+            if state == "open":
+                logger.warning(f"端点{endpoint.name}错误率过高，熔断{endpoint.breaker.cooldown:.0f}秒")
+            elif state == "closed":
+                logger.info(f"端点{endpoint.name}已恢复")
+
+    @property
+    def stats(self) -> List[Dict]:
+        return [{
+            "name": e.name, "model_type": e.model_type, "priority": e.priority,
+            "calls": e.calls, "failures": e.failures, "in_flight": e.in_flight,
+            "state": e.breaker.state
+        } for e in self.endpoints]
+
+    async def close(self):
+        await asyncio.gather(*(e.close() for e in self.endpoints))
+
+    @classmethod
+    def from_config(cls, path: str) -> "ProviderPool":
+        """从JSON配置文件创建连接池
+
+        配置为端点列表，密钥建议通过api_key_env从环境变量读取：
+            [
+              {"model_type": "puyu", "api_key_env": "PUYU_API_KEY", "base_url": "...", "requests_per_minute": 60},
+              {"model_type": "puyu", "api_key_env": "PUYU_API_KEY_2", "base_url": "..."},
+              {"model_type": "glm", "api_key_env": "GLM_API_KEY", "priority": 1}
+            ]
+        其余字段与ProviderEndpoint的参数同名。未内置的提供方可用"plugin": "模块:属性"指定插件，
+        model_type默认为插件名。
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"读取提供方配置时出错: {str(e)}")
+            raise
+
+        endpoints = []
+        for entry in entries:
+            entry = dict(entry)
+            if "plugin" in entry:
+                entry.setdefault("model_type", load_plugin(entry.pop("plugin")).name)
+            key_env = entry.pop("api_key_env", None)
+            api_key = entry.pop("api_key", None) or (os.getenv(key_env) if key_env else None)
+            if not api_key:
+                raise ValueError(f"提供方配置缺少密钥：{key_env or entry.get('name') or entry.get('model_type')}")
+            endpoints.append(ProviderEndpoint(api_key=api_key, **entry))
+        logger.info(f"已加载{len(endpoints)}个提供方端点：{', '.join(e.name for e in endpoints)}")
+        return cls(endpoints)
@@ -0,0 +1,81 @@
+"""
+按提供方配置的请求频率与token用量限流
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+
+class _TokenBucket:
+    """简单令牌桶，容量为每分钟额度，按秒匀速补充"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """返回取出amount个令牌前需要等待的秒数"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+class RateLimiter:
+    """每分钟请求数（RPM）与每分钟token数（TPM）限流器
+
+    调用前用预估token数占用额度，拿到响应后再按实际用量结算差额。
+    未设置的限制项不生效。
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        self._requests = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._requests is not None or self._tokens is not None
+
+    def wait_time(self, estimated_tokens: int = 0) -> float:
+        """返回当前发起一次请求需要等待的秒数（不占用额度）"""
+        wait = 0.0
+        if self._requests:
+            wait = max(wait, self._requests.wait_time(1))
+        if self._tokens:
+            wait = max(wait, self._tokens.wait_time(estimated_tokens))
+        return wait
+
+    async def acquire(self, estimated_tokens: int = 0):
+        """等待直到请求数与token额度都足够"""
+        if not self.enabled:
+            return
+        async with self._lock:
+            while True:
+                wait = self.wait_time(estimated_tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self._requests:
+                self._requests.take(1)
+            if self._tokens:
+                self._tokens.take(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """按实际token用量修正预占额度"""
+        if self._tokens and actual_tokens:
+            self._tokens.take(actual_tokens - estimated_tokens)
@@ -0,0 +1,132 @@
+"""
+按质量门槛逐级升级的模型档位路由：先用便宜、快速的档位起草，未通过检查时换用更强的档位
+
+各步骤在各档位上的通过率随调用结果持续更新：某一档位在某一步骤上经常不合格时，
+该步骤直接从更高的档位开始，省去注定被丢弃的草稿。
+"""
+
+import json
+import logging
+import os
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+from .checkpoint import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# fixed：每个步骤使用固定的档位；cascade：从低档位起草，未通过检查时升级
+ROUTING_MODES = ("fixed", "cascade")
+
+# 默认的升级路径：glm下为 glm-4-flash -> glm-4-plus
+DEFAULT_CASCADE = ("simple", "complex")
+
+# 章节正文中重复片段的比例超过该值时视为不合格
+REPETITION_THRESHOLD = 0.3
+REPETITION_NGRAM = 10
+
+
+def repetition_ratio(text: str, n: int = REPETITION_NGRAM) -> float:
+    """文本中重复出现的n字片段所占的比例，正常行文接近0，反复兜圈子的文本接近1"""
+    text = "".join(text.split())
+    total = len(text) - n + 1
+    if total <= 0:
+        return 0.0
+    unique = len({text[k:k + n] for k in range(total)})
+    return 1 - unique / total
+
+
+def check_chapter(content: str, min_words: int, check_repetition: bool = True) -> Optional[str]:
+    """章节正文的质量门槛，通过时返回None，否则返回未通过的原因"""
+    if len(content) < min_words:
+        return "length"
+    if check_repetition and repetition_ratio(content) > REPETITION_THRESHOLD:
+        return "repetition"
+    return None
+
+
+class TierRouter:
+    """按步骤学习各档位通过率的路由策略
+
+    tiers: 从低到高的升级路径，取值为complexity（simple、medium、complex）
+    window: 每个步骤、每个档位保留最近多少次结果
+    min_samples / min_pass_rate: 样本足够且通过率低于min_pass_rate时跳过该档位
+    explore_every: 跳过低档位后，每隔若干次仍从最低档位开始一次，以便发现通过率回升
+    path: 可选的统计文件，启动时读取，每次记录后写入，多次运行之间持续学习
+
+    同一个路由器可以在多个NovelAIAgent之间共享（如批量创作），统计随之共享。
+    """
+
+    def __init__(self, tiers: Sequence[str] = DEFAULT_CASCADE, window: int = 50, min_samples: int = 5,
+                 min_pass_rate: float = 0.5, explore_every: int = 10, path: Optional[str] = None):
+        if not tiers:
+            raise ValueError("升级路径中至少需要一个档位")
+        self.tiers = tuple(tiers)
+        self.window = window
+        self.min_samples = min_samples
+        self.min_pass_rate = min_pass_rate
+        self.explore_every = max(1, explore_every)
+        self.path = path
+        # {步骤: {档位: 最近的通过/未通过记录}}
+        self._outcomes: Dict[str, Dict[str, deque]] = {}
+        self._plans: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            self._load()
+
+    def _history(self, stage: str, tier: str) -> deque:
+        return self._outcomes.setdefault(stage, {}).setdefault(tier, deque(maxlen=self.window))
+
+    def pass_rate(self, stage: str, tier: str) -> Optional[float]:
+        """该档位在该步骤上的通过率，样本不足时返回None"""
+        history = self._history(stage, tier)
+        if len(history) < self.min_samples:
+            return None
+        return sum(history) / len(history)
+
+    def plan(self, stage: str) -> List[str]:
+        """本次调用依次尝试的档位"""
+        count = self._plans.get(stage, 0)
+        self._plans[stage] = count + 1
+        start = 0
+        if count % self.explore_every != self.explore_every - 1:
+            # 跳过通过率过低的档位，最高档位总是保留
+            while start < len(self.tiers) - 1:
+                rate = self.pass_rate(stage, self.tiers[start])
+                if rate is None or rate >= self.min_pass_rate:
+                    break
+                start += 1
+        return list(self.tiers[start:])
+
+    def record(self, stage: str, tier: str, passed: bool):
+        self._history(stage, tier).append(passed)
+        if self.path:
+            self._save()
+
+    @property
+    def stats(self) -> Dict[str, Dict]:
+        """各步骤在各档位上的调用次数、通过率，以及从最低档位升级的比例"""
+        result = {}
+        for stage, tiers in self._outcomes.items():
+            entry = {tier: {"calls": len(h), "pass_rate": round(sum(h) / len(h), 3) if h else None}
+                     for tier, h in tiers.items()}
+            first = tiers.get(self.tiers[0])
+            entry["escalation_rate"] = round(1 - sum(first) / len(first), 3) if first else None
+            result[stage] = entry
+        return result
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取档位路由统计时出错，重新开始统计: {str(e)}")
+            return
+        for stage, tiers in data.items():
+            for tier, outcomes in tiers.items():
+                self._history(stage, tier).extend(bool(v) for v in outcomes)
+        logger.info(f"已加载档位路由统计：{self.path}")
+
+    def _save(self):
+        data = {stage: {tier: [int(v) for v in h] for tier, h in tiers.items()}
+                for stage, tiers in self._outcomes.items()}
+        atomic_write(self.path, json.dumps(data, ensure_ascii=False))
@@ -0,0 +1,91 @@
+"""
+章节候选正文的本地评分：同时请求多份候选时，不再调用模型，按字数、重复程度、
+梗概关键词覆盖率和格式是否干净选出最好的一份
+
+各项得分均在0到1之间：
+- length：字数达到要求字数的比例
+- repetition：重复片段比例相对于不合格门槛（routing.REPETITION_THRESHOLD）的余量
+- coverage：本章梗概中的关键词（双字片段）在正文中出现的比例，衡量是否写了梗概中的情节
+- format：正文中没有下一章标题、字数统计、创作说明等多余内容（见degeneration.FORMAT_MARKERS）
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Optional, Set
+
+from .degeneration import FORMAT_MARKERS
+from .routing import REPETITION_THRESHOLD, check_chapter, repetition_ratio
+
+# 各项得分的权重
+SCORE_WEIGHTS = {"length": 0.35, "repetition": 0.25, "coverage": 0.2, "format": 0.2}
+
+# 达到该总分并通过字数、重复检查的候选直接采用，其余候选随即取消
+DEFAULT_ACCEPT_SCORE = 0.8
+
+# 关键词覆盖率达到该比例即视为满分：梗概中的措辞不会原样出现在正文里
+FULL_COVERAGE = 0.6
+
+# 开头多少字内不检查格式标记（模型偶尔会先复述一遍章节标题）
+FORMAT_SKIP_CHARS = 50
+
+# 不构成关键词的常见虚字，含有这些字的双字片段不计入覆盖率
+_STOP_CHARS = set("的了是在和与及或也又就都而着过被把从向对为以于之其这那个们他她它我你中上下里")
+_CJK_RUN = re.compile(r"[一-鿿]+")
+# 回复开头对请求的应答，不属于正文
+_PREAMBLE = re.compile(r"^\s*(?:好的|以下是|下面是|当然)")
+
+
+@dataclass
+class ChapterScore:
+    """一份候选正文的评分，failure为check_chapter的结果（通过时为None）"""
+    total: float
+    length: float
+    repetition: float
+    coverage: float
+    format: float
+    failure: Optional[str]
+
+    @property
+    def passed(self) -> bool:
+        return self.failure is None
+
+
+def synopsis_keywords(synopsis: str) -> Set[str]:
+    """梗概中的关键词：连续汉字中不含虚字的双字片段"""
+    keywords = set()
+    for run in _CJK_RUN.findall(synopsis):
+        for k in range(len(run) - 1):
+            pair = run[k:k + 2]
+            if pair[0] not in _STOP_CHARS and pair[1] not in _STOP_CHARS:
+                keywords.add(pair)
+    return keywords
+
+
+def format_score(content: str) -> float:
+    """每处多余内容扣0.5分"""
+    problems = 1 if _PREAMBLE.match(content) else 0
+    offset = 0
+    for line in content.split("\n"):
+        if offset >= FORMAT_SKIP_CHARS and any(marker.search(line) for marker in FORMAT_MARKERS):
+            problems += 1
+        offset += len(line) + 1
+    return max(0.0, 1.0 - 0.5 * problems)
+
+
+def score_chapter(content: str, synopsis: str, min_words: int, required_words: int,
+                  check_repetition: bool = True, keywords: Optional[Set[str]] = None) -> ChapterScore:
+    """为一份候选正文评分；keywords可传入预先提取的梗概关键词，多份候选共用"""
+    if keywords is None:
+        keywords = synopsis_keywords(synopsis)
+    length = min(1.0, len(content) / required_words) if required_words > 0 else 1.0
+    repetition = max(0.0, 1.0 - repetition_ratio(content) / REPETITION_THRESHOLD)
+    if keywords:
+        covered = sum(1 for keyword in keywords if keyword in content) / len(keywords)
+        coverage = min(1.0, covered / FULL_COVERAGE)
+    else:
+        coverage = 1.0
+    form = format_score(content)
+    total = (SCORE_WEIGHTS["length"] * length + SCORE_WEIGHTS["repetition"] * repetition
+             + SCORE_WEIGHTS["coverage"] * coverage + SCORE_WEIGHTS["format"] * form)
+    return ChapterScore(round(total, 4), round(length, 4), round(repetition, 4), round(coverage, 4),
+                        round(form, 4), check_chapter(content, min_words, check_repetition))
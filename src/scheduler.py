@@ -0,0 +1,102 @@
+"""
+按依赖关系调度创作步骤：互不依赖的步骤同时执行，每个步骤在输入就绪后立即开始
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """一个创作步骤
+
+    inputs: 依赖的步骤名（或调度开始时提供的初始值名，如prompt）
+    run: 异步函数，参数为{输入名: 值}，返回本步骤的产物
+    """
+    name: str
+    inputs: Tuple[str, ...]
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class StageGraph:
+    """由步骤及其输入构成的有向无环图"""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("存在重名的步骤")
+        # 每个步骤的开始、结束时间（相对调度开始的秒数）
+        self.timings: Dict[str, Tuple[float, float]] = {}
+
+    def order(self, initial: Dict[str, Any]) -> List[str]:
+        """返回拓扑顺序；存在未知输入或循环依赖时抛出ValueError"""
+        ordered: List[str] = []
+        state: Dict[str, str] = {}
+
+        def visit(name: str, path: Tuple[str, ...]):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"步骤存在循环依赖：{' -> '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dep in self.stages[name].inputs:
+                if dep in self.stages:
+                    visit(dep, path + (name,))
+                elif dep not in initial:
+                    raise ValueError(f"步骤{name}的输入{dep}既不是步骤也不是初始值")
+            state[name] = "done"
+            ordered.append(name)
+
+        for name in self.stages:
+            visit(name, ())
+        return ordered
+
+    async def run(self, initial: Dict[str, Any]) -> Dict[str, Any]:
+        """执行所有步骤，返回初始值与各步骤产物
+
+        任一步骤失败时取消其余步骤并抛出该异常。
+        """
+        order = self.order(initial)
+        started = time.perf_counter()
+        tasks: Dict[str, asyncio.Future] = {}
+
+        async def execute(stage: Stage) -> Any:
+            deps = [dep for dep in stage.inputs if dep in tasks]
+            values = dict(zip(deps, await asyncio.gather(*(tasks[dep] for dep in deps))))
+            values.update({dep: initial[dep] for dep in stage.inputs if dep not in tasks})
+            begin = time.perf_counter() - started
+            logger.info(f"开始步骤：{stage.name}")
+            result = await stage.run(values)
+            self.timings[stage.name] = (begin, time.perf_counter() - started)
+            return result
+
+        # 按拓扑顺序创建任务，保证每个任务创建时其依赖的任务已经存在
+        for name in order:
+            tasks[name] = asyncio.ensure_future(execute(self.stages[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        results = dict(initial)
+        results.update({name: task.result() for name, task in tasks.items()})
+        return results
+
+    def critical_path(self) -> List[str]:
+        """根据本次运行的耗时，返回决定总耗时的步骤链（从第一个步骤到最后完成的步骤）"""
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda name: self.timings[name][1])]
+        while True:
+            deps = [dep for dep in self.stages[path[-1]].inputs if dep in self.timings]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda name: self.timings[name][1]))
+        return list(reversed(path))
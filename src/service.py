@@ -0,0 +1,367 @@
+"""
+常驻的创作服务：通过HTTP提交任务，任务持久化排队，复用已建立的客户端，以SSE推送进度与章节文本
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from aiohttp import web
+
+from .batch import AgentFactory, BatchJob, JobProgress, track_progress
+from .checkpoint import CheckpointStore, atomic_write
+from .container import NovelContainerWriter
+from .metrics import JsonlSink, MetricsRecorder
+from .rate_limit import RateLimiter
+from .writer import StoryWriter
+
+logger = logging.getLogger(__name__)
+
+# 任务结束后的状态；服务停止时被中断的任务回到pending，下次启动时继续
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class GenerationService:
+    """在同一进程内持续运行创作任务
+
+    - 任务列表持久化在<output_base>/service_jobs.json，服务重启后未完成的任务重新排队，
+      已完成的步骤和章节从各自输出目录的断点恢复
+    - 最多同时运行jobs部小说；所有任务共用call_slots个并发调用名额
+    - agent_factory与BatchRunner相同，通常复用同一组提供方连接池，无需每部小说重新建立客户端
+    - 取消任务时已生成的步骤、章节和断点保留在输出目录中，可以重新排队继续
+    """
+
+    STATE_FILE = "service_jobs.json"
+
+    def __init__(self, output_base: str, agent_factory: AgentFactory, prompt_loader: Callable[[str], str],
+                 model_types: Iterable[str], jobs: int = 2, workers: int = 8,
+                 provider_limits: Optional[Dict[str, Dict]] = None, container: bool = False):
+        """
+        prompt_loader: 提交时未给出提示词，按题材生成提示词
+        model_types: 可用的模型类型（已配置密钥的提供方）
+        jobs: 同时运行的任务数
+        workers: 所有任务合计的最大并发调用数
+        provider_limits: 各提供方的限流额度，格式同BatchRunner
+        container: 同时把每部小说写入其输出目录下的单文件容器novel.nvl
+        """
+        self.output_base = output_base
+        self.agent_factory = agent_factory
+        self.prompt_loader = prompt_loader
+        self.model_types = set(model_types)
+        self.concurrent_jobs = max(1, jobs)
+        self.workers = max(1, workers)
+        self.provider_limits = provider_limits or {}
+        self.container = container
+        self.jobs: Dict[str, BatchJob] = {}
+        self.progress: Dict[str, JobProgress] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # 已在队列中的任务，避免取消后又重新排队的任务被排入两次、由两个worker同时运行
+        self._queued: Set[str] = set()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._workers: List[asyncio.Task] = []
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._call_slots: Optional[asyncio.Semaphore] = None
+        self._stopping = False
+        self._load()
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.output_base, self.STATE_FILE)
+
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            job = BatchJob(**entry["job"])
+            self.jobs[job.job_id] = job
+            self.progress[job.job_id] = JobProgress(**entry["progress"])
+        logger.info(f"已加载{len(entries)}个任务：{self.state_path}")
+
+    def _save(self):
+        os.makedirs(self.output_base, exist_ok=True)
+        entries = [{"job": asdict(self.jobs[job_id]), "progress": asdict(self.progress[job_id])}
+                   for job_id in self.jobs]
+        atomic_write(self.state_path, json.dumps(entries, ensure_ascii=False, indent=2))
+
+    def output_dir(self, job_id: str) -> str:
+        return os.path.join(self.output_base, job_id)
+
+    def describe(self, job_id: str) -> Dict:
+        return dict(asdict(self.progress[job_id]), output_dir=self.output_dir(job_id))
+
+    # ---- 任务管理 ----
+
+    def submit(self, genre: str, model_type: str, prompt: Optional[str] = None) -> Dict:
+        if model_type not in self.model_types:
+            raise ValueError(f"不可用的模型类型: {model_type}，可选值：{', '.join(sorted(self.model_types))}")
+        job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{model_type}_{uuid.uuid4().hex[:6]}"
+        job = BatchJob(job_id=job_id, model_type=model_type, genre=genre,
+                       prompt=prompt or self.prompt_loader(genre))
+        self.jobs[job_id] = job
+        self.progress[job_id] = JobProgress(job_id, model_type, genre)
+        self._save()
+        self._enqueue(job_id)
+        logger.info(f"[{job_id}] 已加入队列（{genre}，{model_type}）")
+        return self.describe(job_id)
+
+    def cancel(self, job_id: str) -> Dict:
+        """取消排队中或运行中的任务，已生成的内容保留"""
+        progress = self.progress[job_id]
+        if progress.status == "pending":
+            progress.status = "cancelled"
+            self._save()
+            self._publish(job_id, {"type": "status", "job": self.describe(job_id)})
+        elif progress.status == "running":
+            self._tasks[job_id].cancel()
+        return self.describe(job_id)
+
+    def resume(self, job_id: str) -> Dict:
+        """把已取消或失败的任务重新排队，从其断点继续"""
+        progress = self.progress[job_id]
+        if progress.status in ("cancelled", "failed"):
+            progress.status = "pending"
+            progress.error = None
+            self._save()
+            self._enqueue(job_id)
+            self._publish(job_id, {"type": "status", "job": self.describe(job_id)})
+        return self.describe(job_id)
+
+    def _enqueue(self, job_id: str):
+        """排队等待运行；排队期间被取消又恢复的任务仍在队列中，不再重复加入"""
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id, [])
+        if queue in subscribers:
+            subscribers.remove(queue)
+
+    def _publish(self, job_id: str, event: Dict):
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait(event)
+
+    # ---- 运行 ----
+
+    def _rate_limiter(self, model_type: str) -> RateLimiter:
+        """同一提供方的任务共用一个限流器，服务运行期间一直保留"""
+        if model_type not in self._rate_limiters:
+            limits = self.provider_limits.get(model_type, {})
+            self._rate_limiters[model_type] = RateLimiter(
+                limits.get("requests_per_minute"), limits.get("tokens_per_minute")
+            )
+        return self._rate_limiters[model_type]
+
+    async def start(self):
+        self._stopping = False
+        self._call_slots = asyncio.Semaphore(self.workers)
+        # 上次停止时排队或被中断的任务重新排队
+        for job_id, progress in self.progress.items():
+            if progress.status in ("pending", "running"):
+                progress.status = "pending"
+                self._enqueue(job_id)
+        self._save()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrent_jobs)]
+        logger.info(f"创作服务已启动：同时运行{self.concurrent_jobs}部小说，共用{self.workers}个并发调用名额，"
+                    f"排队任务{self._queue.qsize()}个")
+
+    async def stop(self):
+        """停止服务：运行中的任务被中断并保持pending状态，下次启动时从断点继续"""
+        self._stopping = True
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._save()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            if self.progress[job_id].status != "pending":
+                # 排队期间已被取消
+                continue
+            task = asyncio.ensure_future(self._run_job(job_id))
+            self._tasks[job_id] = task
+            # 任务被取消时wait不会抛出异常，worker继续处理下一个任务
+            await asyncio.wait([task])
+            self._tasks.pop(job_id, None)
+
+    async def _run_job(self, job_id: str):
+        job = self.jobs[job_id]
+        progress = self.progress[job_id]
+        output_dir = self.output_dir(job_id)
+        checkpoint = CheckpointStore(output_dir)
+        creation_time = checkpoint.meta.get("creation_time") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        checkpoint.save_meta({
+            "model_type": job.model_type,
+            "genre": job.genre,
+            "prompt": job.prompt,
+            "creation_time": creation_time
+        })
+
+        metrics = MetricsRecorder([JsonlSink(os.path.join(output_dir, "metrics.jsonl"))])
+        agent = self.agent_factory(
+            job, rate_limiter=self._rate_limiter(job.model_type), call_slots=self._call_slots, metrics=metrics
+        )
+        container = NovelContainerWriter(os.path.join(output_dir, "novel.nvl")) if self.container else None
+        writer = StoryWriter(output_dir, {
+            "model_type": job.model_type,
+            "model_name": agent.model,
+            "creation_time": creation_time
+        }, container)
+
+        # 从断点继续时重新统计进度
+        progress.status = "running"
+        progress.stages_done = progress.chapters_done = progress.chapters_generated = 0
+        progress.started = time.time()
+        progress.finished = None
+        progress.error = None
+        self._save()
+        self._publish(job_id, {"type": "status", "job": self.describe(job_id)})
+        generating = set()
+        logger.info(f"[{job_id}] 开始创作")
+        try:
+            async for event in agent.stream_story(job.prompt, checkpoint=checkpoint):
+                writer.handle(event)
+                track_progress(progress, event, generating)
+                self._publish(job_id, event)
+                if event["type"] in ("stage", "chapter_end"):
+                    self._save()
+            progress.status = "done"
+            logger.info(f"[{job_id}] 创作完成，输出目录：{output_dir}")
+        except asyncio.CancelledError:
+            progress.status = "pending" if self._stopping else "cancelled"
+            logger.info(f"[{job_id}] 已{'中断' if self._stopping else '取消'}，已生成的内容保留在{output_dir}")
+            raise
+        except Exception as e:
+            progress.status = "failed"
+            progress.error = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"[{job_id}] 创作失败: {str(e)}")
+        finally:
+            progress.finished = time.time()
+            writer.close()
+            metrics.write_summary(os.path.join(output_dir, "metrics_summary.json"))
+            metrics.close()
+            progress.metrics = metrics.summary()["total"]
+            await agent.close()
+            self._save()
+            self._publish(job_id, {"type": "status", "job": self.describe(job_id)})
+
+
+def _job_or_404(service: GenerationService, request: web.Request) -> str:
+    job_id = request.match_info["job_id"]
+    if job_id not in service.jobs:
+        raise web.HTTPNotFound(text=json.dumps({"error": f"任务不存在：{job_id}"}, ensure_ascii=False),
+                               content_type="application/json")
+    return job_id
+
+
+def create_app(service: GenerationService) -> web.Application:
+    """HTTP接口：
+
+    POST /jobs                         提交任务，{"genre": 题材, "model": 模型类型, "prompt": 可选的完整提示词}
+    GET  /jobs                         全部任务的进度
+    GET  /jobs/{id}                    单个任务的进度
+    GET  /jobs/{id}/events             SSE事件流：先推送当前状态，随后为stream_story的各事件与状态变化，
+                                       任务结束后关闭；?deltas=0时不推送chapter_delta
+    GET  /jobs/{id}/chapters/{n}       已完成或生成中的章节文本
+    POST /jobs/{id}/cancel             取消任务，已生成的内容保留
+    POST /jobs/{id}/resume             重新排队已取消或失败的任务，从断点继续
+    """
+
+    async def submit(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            job = service.submit(body["genre"], body.get("model", "puyu"), body.get("prompt"))
+        except (ValueError, KeyError) as e:
+            return web.json_response({"error": str(e)}, status=400, dumps=_dumps)
+        return web.json_response(job, status=201, dumps=_dumps)
+
+    async def list_jobs(request: web.Request) -> web.Response:
+        return web.json_response([service.describe(job_id) for job_id in service.jobs], dumps=_dumps)
+
+    async def get_job(request: web.Request) -> web.Response:
+        return web.json_response(service.describe(_job_or_404(service, request)), dumps=_dumps)
+
+    async def cancel(request: web.Request) -> web.Response:
+        return web.json_response(service.cancel(_job_or_404(service, request)), dumps=_dumps)
+
+    async def resume(request: web.Request) -> web.Response:
+        return web.json_response(service.resume(_job_or_404(service, request)), dumps=_dumps)
+
+    async def chapter(request: web.Request) -> web.Response:
+        job_id = _job_or_404(service, request)
+        path = os.path.join(service.output_dir(job_id), "chapters", f"chapter_{int(request.match_info['n']):03d}.txt")
+        if not os.path.exists(path):
+            raise web.HTTPNotFound(text="章节尚未生成")
+        with open(path, "r", encoding="utf-8") as f:
+            return web.Response(text=f.read(), content_type="text/plain", charset="utf-8")
+
+    async def events(request: web.Request) -> web.StreamResponse:
+        job_id = _job_or_404(service, request)
+        include_deltas = request.query.get("deltas", "1") != "0"
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        queue = service.subscribe(job_id)
+
+        async def send(event: Dict):
+            await response.write(f"event: {event['type']}\ndata: {_dumps(event)}\n\n".encode("utf-8"))
+
+        try:
+            await send({"type": "status", "job": service.describe(job_id)})
+            if service.progress[job_id].status in TERMINAL_STATUSES:
+                return response
+            while True:
+                event = await queue.get()
+                if event["type"] == "chapter_delta" and not include_deltas:
+                    continue
+                await send(event)
+                if event["type"] == "status" and event["job"]["status"] in TERMINAL_STATUSES:
+                    break
+        except ConnectionResetError:
+            # 客户端断开，任务继续运行
+            pass
+        finally:
+            service.unsubscribe(job_id, queue)
+        return response
+
+    async def on_startup(app: web.Application):
+        await service.start()
+
+    async def on_cleanup(app: web.Application):
+        await service.stop()
+
+    app = web.Application()
+    app.add_routes([
+        web.post("/jobs", submit),
+        web.get("/jobs", list_jobs),
+        web.get("/jobs/{job_id}", get_job),
+        web.get("/jobs/{job_id}/events", events),
+        web.get(r"/jobs/{job_id}/chapters/{n:\d+}", chapter),
+        web.post("/jobs/{job_id}/cancel", cancel),
+        web.post("/jobs/{job_id}/resume", resume),
+    ])
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
@@ -0,0 +1,225 @@
+"""
+章节梗概的结构化表示与增量解析
+
+模型输出的梗概格式常有小的偏差（全角/半角括号、中文数字、Markdown标记、
+按阶段内序号编号等），这里统一解析为ChapterSynopsis，并支持在流式输出过程中
+每解析出一章就立即交给后续的章节生成。
+"""
+
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 章节梗概的五个阶段，每阶段10章
+SYNOPSIS_STAGES = ["起", "承", "转", "合", "终"]
+CHAPTERS_PER_STAGE = 10
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+              "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100}
+
+# 行首的章节标题，如【第12章：标题】、[第十二章] 标题、**第12章 标题**、### 第12章：标题
+_HEADER = re.compile(
+    r"^[ \t#*>]*[【\[［]?[ \t]*第[ \t]*([0-9０-９]+|[零〇一二两三四五六七八九十百]+)[ \t]*章"
+    r"[ \t]*[：:、.．\-—]*[ \t]*([^】\]］\n]*)[】\]］]?[ \t*]*",
+    re.M
+)
+
+
+@dataclass
+class ChapterSynopsis:
+    """一章的梗概"""
+    number: int
+    title: str
+    body: str
+    stage: str
+
+    @property
+    def heading(self) -> str:
+        """章节正文使用的标题，如“第12章：标题”"""
+        return f"第{self.number}章：{self.title or '未命名'}"
+
+    def render(self) -> str:
+        return f"【第{self.number}章：{self.title or '未命名'}】\n{self.body}"
+
+
+def stage_of(number: int) -> str:
+    """章节所属的梗概阶段"""
+    return SYNOPSIS_STAGES[min((number - 1) // CHAPTERS_PER_STAGE, len(SYNOPSIS_STAGES) - 1)]
+
+
+def stage_chapters(stage_index: int) -> range:
+    """第stage_index（从1开始）阶段包含的章节编号"""
+    start = (stage_index - 1) * CHAPTERS_PER_STAGE + 1
+    return range(start, start + CHAPTERS_PER_STAGE)
+
+
+def parse_chapter_number(text: str) -> Optional[int]:
+    """把“12”、“１２”、“十二”、“一百零三”等转为整数，无法识别时返回None"""
+    text = text.strip().translate(str.maketrans("０１２３４５６７８９", "0123456789"))
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, None
+    for char in text:
+        if char in _CN_DIGITS:
+            digit = _CN_DIGITS[char]
+        elif char in _CN_UNITS:
+            total += (digit if digit is not None else 1) * _CN_UNITS[char]
+            digit = None
+        else:
+            return None
+    total += digit or 0
+    return total or None
+
+
+class SynopsisStreamParser:
+    """增量解析一段梗概输出
+
+    feed()返回已经完整的章节（遇到下一章的标题才算上一章结束），finish()返回最后一章。
+    expected给出本段应包含的章节编号：编号不在范围内但加上阶段起始偏移后在范围内的
+    （模型按阶段内序号1-10编号）会被修正，仍不在范围内、重复或梗概为空的章节被丢弃。
+    """
+
+    def __init__(self, expected: Optional[Iterable[int]] = None):
+        self.expected: Optional[Set[int]] = set(expected) if expected is not None else None
+        self._offset = min(self.expected) - 1 if self.expected else 0
+        self._buffer = ""
+        self.seen: Set[int] = set()
+
+    def _section(self, match: re.Match, end: int) -> Optional[ChapterSynopsis]:
+        number = parse_chapter_number(match.group(1))
+        if number is None:
+            return None
+        if self.expected is not None and number not in self.expected:
+            if number + self._offset in self.expected:
+                number += self._offset
+            else:
+                logger.warning(f"梗概中出现了范围之外的第{number}章，已忽略")
+                return None
+        if number in self.seen:
+            logger.warning(f"梗概中第{number}章重复出现，只保留第一次")
+            return None
+        title = match.group(2).strip().strip("*#《》").strip()
+        body = self._buffer[match.end():end]
+        if not title and "\n" in body:
+            # 标题写在括号之外，如“[第3章] 标题”
+            first_line, rest = body.split("\n", 1)
+            if first_line.strip():
+                title, body = first_line.strip().strip("*#《》").strip(), rest
+        body = body.strip()
+        if not body:
+            logger.warning(f"第{number}章的梗概为空，已忽略")
+            return None
+        self.seen.add(number)
+        return ChapterSynopsis(number=number, title=title, body=body, stage=stage_of(number))
+
+    def feed(self, text: str) -> List[ChapterSynopsis]:
+        self._buffer += text
+        headers = list(_HEADER.finditer(self._buffer))
+        if len(headers) < 2:
+            return []
+        completed = []
+        for match, following in zip(headers, headers[1:]):
+            chapter = self._section(match, following.start())
+            if chapter is not None:
+                completed.append(chapter)
+        # 只保留最后一个尚未结束的章节
+        self._buffer = self._buffer[headers[-1].start():]
+        return completed
+
+    def finish(self) -> List[ChapterSynopsis]:
+        headers = list(_HEADER.finditer(self._buffer))
+        completed = []
+        for match, following in zip(headers, headers[1:] + [None]):
+            chapter = self._section(match, following.start() if following else len(self._buffer))
+            if chapter is not None:
+                completed.append(chapter)
+        self._buffer = ""
+        return completed
+
+    def missing(self) -> List[int]:
+        """本段中尚未解析到的章节编号"""
+        return sorted(self.expected - self.seen) if self.expected is not None else []
+
+
+def parse_synopses(text: str, expected: Optional[Iterable[int]] = None) -> List[ChapterSynopsis]:
+    """一次性解析完整的梗概文本，按章节编号排序"""
+    parser = SynopsisStreamParser(expected)
+    chapters = parser.feed(text) + parser.finish()
+    return sorted(chapters, key=lambda c: c.number)
+
+
+def render_synopses(chapters: Iterable[ChapterSynopsis]) -> str:
+    """把章节梗概按编号排序，输出为统一的【第N章：标题】格式"""
+    return "\n\n".join(c.render() for c in sorted(chapters, key=lambda c: c.number))
+
+
+class SynopsisFeed:
+    """在梗概规划与章节生成之间传递章节梗概的异步队列，同一章节只传递一次
+
+    章节生成方每完成一章调用mark_done，规划方可以用wait_done等待写作进度，
+    只领先正文有限的章节（见agent中的分层大纲）。章节生成失败时调用abort，
+    正在等待的wait_done和迭代立即抛出该异常，双方都不会一直等待下去。
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._numbers: Set[int] = set()
+        self._closed = False
+        self._done: Set[int] = set()
+        self._progress = asyncio.Event()
+        self._error: Optional[BaseException] = None
+
+    def mark_done(self, number: int):
+        self._done.add(number)
+        self._progress.set()
+
+    def abort(self, error: BaseException):
+        """以error结束传递：之后的put被忽略，wait_done和迭代抛出error（只记录第一次的错误）"""
+        if self._error is not None:
+            return
+        self._error = error
+        self._closed = True
+        self._queue.put_nowait(None)
+        self._progress.set()
+
+    async def wait_done(self, count: int):
+        """等待至少count章完成（count不大于0时立即返回）"""
+        while len(self._done) < count:
+            if self._error is not None:
+                raise self._error
+            self._progress.clear()
+            await self._progress.wait()
+
+    def put(self, chapter: ChapterSynopsis):
+        if self._closed or chapter.number in self._numbers:
+            return
+        self._numbers.add(chapter.number)
+        self._queue.put_nowait(chapter)
+
+    def close(self):
+        """梗概全部就绪后调用，迭代在取完已有章节后结束"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[ChapterSynopsis]:
+        while True:
+            chapter = await self._queue.get()
+            if self._error is not None:
+                raise self._error
+            if chapter is None:
+                return
+            yield chapter
+
+    @classmethod
+    def from_chapters(cls, chapters: Iterable[ChapterSynopsis]) -> "SynopsisFeed":
+        feed = cls()
+        for chapter in chapters:
+            feed.put(chapter)
+        feed.close()
+        return feed
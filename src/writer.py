@@ -0,0 +1,174 @@
+"""
+把流式创作事件增量写入输出目录
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional, TextIO
+
+from .checkpoint import CheckpointStore, atomic_write
+from .container import NovelContainerWriter
+
+logger = logging.getLogger(__name__)
+
+# 步骤名到meta.json字段的映射
+META_FIELDS = {
+    "title": "title",
+    "themes": "theme",
+    "setting": "setting",
+    "characters": "characters",
+    "tone": "tone",
+    "section_titles": "section_titles",
+    "outline": "outline",
+    "synopses": "chapters"
+}
+
+
+def import_edits(output_base: str, checkpoint: CheckpointStore) -> List[str]:
+    """把输出目录中手工修改过的产物写回断点，返回被修改的步骤名与章节（如"第17章"）
+
+    meta.json中的步骤字段（如chapters对应的章节梗概）或chapters/下的章节与断点不同时，
+    以输出目录为准替换断点中的产物，并保留其输入指纹：修改的产物本身不会被重新生成，
+    下游产物则因输入内容变化而重新生成，例如修改某一章的梗概只会重新生成这一章。
+    需在创建StoryWriter之前调用（StoryWriter会重写meta.json）。
+    """
+    edited = []
+    meta_path = os.path.join(output_base, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta_info = json.load(f)
+        for name, field in META_FIELDS.items():
+            value = meta_info.get(field)
+            if value not in (None, "") and checkpoint.has_stage(name) and checkpoint.get_stage(name) != value:
+                checkpoint.save_stage(name, value)
+                edited.append(name)
+    for index in checkpoint.chapter_indexes():
+        path = os.path.join(output_base, "chapters", f"chapter_{index:03d}.txt")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        if content != checkpoint.get_chapter(index):
+            checkpoint.save_chapter(index, content)
+            edited.append(f"第{index}章")
+    if edited:
+        logger.info(f"采用输出目录中手工修改的产物：{', '.join(edited)}")
+    return edited
+
+
+class StoryWriter:
+    """消费NovelAIAgent.stream_story产出的事件，边生成边落盘
+
+    输出目录结构与一次性保存时相同：meta.json、table_of_contents.md
+    以及chapters/chapter_NNN.txt。章节文本在生成过程中逐段追加，
+    章节完成后再以格式化后的最终内容整体替换。
+
+    container: 可选的单文件容器（见container.NovelContainerWriter），
+    完成的章节同时追加写入其中，元数据和目录在每个步骤完成时和close时连同索引一起写入。
+
+    开启一致性检查时，发现的问题累计写入consistency_issues.json；
+    分层大纲模式下已展开的大纲写入outline_tree.json。
+    """
+
+    def __init__(self, output_base: str, meta_info: Optional[Dict] = None,
+                 container: Optional[NovelContainerWriter] = None):
+        self.output_base = output_base
+        self.container = container
+        self.chapters_dir = os.path.join(output_base, "chapters")
+        os.makedirs(self.chapters_dir, exist_ok=True)
+
+        self.meta_info = dict(meta_info or {})
+        for field in META_FIELDS.values():
+            self.meta_info.setdefault(field, "")
+        self._open_chapters: Dict[int, TextIO] = {}
+        self._titles: Dict[int, str] = {}
+        self._issues: List[Dict] = []
+        self._write_meta()
+
+    def chapter_path(self, index: int) -> str:
+        return os.path.join(self.chapters_dir, f"chapter_{index:03d}.txt")
+
+    def _write_meta(self):
+        atomic_write(
+            os.path.join(self.output_base, "meta.json"),
+            json.dumps(self.meta_info, ensure_ascii=False, indent=2)
+        )
+        if self.container is not None:
+            self.container.write_meta(self.meta_info)
+
+    def _write_table_of_contents(self, outline: str):
+        table_of_contents = "# 故事目录\n\n" + outline.split("## 详细大纲")[0]  # 只保存目录部分
+        atomic_write(os.path.join(self.output_base, "table_of_contents.md"), table_of_contents)
+        if self.container is not None:
+            # 容器中目录与其余元数据一起保存，字段名与convert_directory一致
+            self.meta_info["table_of_contents"] = table_of_contents
+            self._write_meta()
+
+    def _begin_chapter(self, index: int):
+        f = open(self.chapter_path(index), "w", encoding="utf-8")
+        f.write(f"{self._titles.get(index, '')}\n\n")
+        f.flush()
+        self._open_chapters[index] = f
+
+    def _close_chapter(self, index: int):
+        f = self._open_chapters.pop(index, None)
+        if f is not None:
+            f.close()
+
+    def handle(self, event: Dict):
+        """处理单个流式事件"""
+        event_type = event.get("type")
+
+        if event_type == "stage":
+            name = event["name"]
+            if name in META_FIELDS:
+                self.meta_info[META_FIELDS[name]] = event["content"]
+                self._write_meta()
+            if name == "outline":
+                self._write_table_of_contents(event["content"])
+            if self.container is not None:
+                self.container.sync()
+
+        elif event_type == "chapter_start":
+            self._titles[event["index"]] = event.get("title", "")
+            self._begin_chapter(event["index"])
+
+        elif event_type == "chapter_delta":
+            f = self._open_chapters.get(event["index"])
+            if f is not None:
+                f.write(event["text"])
+                f.flush()
+
+        elif event_type == "chapter_reset":
+            self._close_chapter(event["index"])
+            self._begin_chapter(event["index"])
+
+        elif event_type == "chapter_end":
+            index = event["index"]
+            self._close_chapter(index)
+            atomic_write(self.chapter_path(index), event["content"])
+            if self.container is not None:
+                self.container.write_chapter(index, event["content"])
+            self._titles.pop(index, None)
+            logger.info(f"第{index}章已保存：{self.chapter_path(index)}")
+
+        elif event_type == "consistency":
+            self._issues.extend(event["issues"])
+            atomic_write(
+                os.path.join(self.output_base, "consistency_issues.json"),
+                json.dumps(self._issues, ensure_ascii=False, indent=2)
+            )
+
+        elif event_type == "outline":
+            atomic_write(
+                os.path.join(self.output_base, "outline_tree.json"),
+                json.dumps(event["tree"], ensure_ascii=False, indent=2)
+            )
+
+    def close(self):
+        """关闭所有未完成的章节文件（已写入的部分保留在磁盘上），并为容器写入索引"""
+        for index in list(self._open_chapters):
+            self._close_chapter(index)
+        if self.container is not None:
+            self.container.close()
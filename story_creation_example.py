@@ -1,30 +1,70 @@
 import asyncio
 import os
 from dotenv import load_dotenv
-from src.agent import NovelAIAgent, create_agent
-import json
+from src.agent import STORY_STAGES, NovelAIAgent, create_agent
+from src.cache import ResponseCache
+from src.checkpoint import CheckpointStore, format_chapter_ranges, parse_chapter_ranges
+from src.container import NovelContainerWriter
+from src.metrics import JsonlSink, MetricsRecorder, PrometheusTextSink
+from src.mock_provider import TranscriptLog
+from src.providers import ProviderEndpoint, ProviderPool
+from src.routing import ROUTING_MODES, TierRouter
+from src.writer import StoryWriter, import_edits
 import logging
 from datetime import datetime
 import argparse
+from typing import List, Optional
 
 # 加载.env文件
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+
+def _env_int(name: str) -> Optional[int]:
+    """读取整数类型的环境变量，未设置时返回None"""
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _env_float(name: str, default: float = 0.0) -> float:
+    """读取浮点类型的环境变量，未设置时返回默认值"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
 # 模型配置
 MODEL_CONFIGS = {
     "puyu": {
         "api_key": os.getenv("PUYU_API_KEY"),
         "base_url": os.getenv("PUYU_BASE_URL"),
         "model_type": "puyu",
-        "model": "internlm2.5-latest"
+        "model": "internlm2.5-latest",
+        "requests_per_minute": _env_int("PUYU_RPM"),
+        "tokens_per_minute": _env_int("PUYU_TPM")
     },
     "glm": {
         "api_key": os.getenv("GLM_API_KEY"),
         "base_url": os.getenv("GLM_BASE_URL"),
         "model_type": "glm",
-        "model": "glm-4-flash"
+        "model": "glm-4-flash",
+        "requests_per_minute": _env_int("GLM_RPM"),
+        "tokens_per_minute": _env_int("GLM_TPM")
+    },
+    # 离线模拟提供方，无需密钥，用于调试流程和性能测试
+    "mock": {
+        "api_key": "mock",
+        "base_url": None,
+        "model_type": "mock",
+        "model": "mock-air",
+        "requests_per_minute": None,
+        "tokens_per_minute": None,
+        "mock_options": {
+            "latency": _env_float("MOCK_LATENCY"),
+            "tokens_per_second": _env_float("MOCK_TOKENS_PER_SECOND"),
+            "short_ratio": _env_float("MOCK_SHORT_RATIO"),
+            "repeat_ratio": _env_float("MOCK_REPEAT_RATIO"),
+            "replay_path": os.getenv("MOCK_REPLAY")
+        }
     }
 }
 
@@ -51,87 +91,280 @@ def load_story_prompt(genre: str) -> str:
         logger.error(f"加载故事提示词时出错: {str(e)}")
         raise
 
-async def create_sample_story(model_type: str = "puyu", genre: str = "科幻"):
+def build_provider_pool(model_type: str, providers: Optional[str] = None) -> ProviderPool:
+    """创建提供方连接池
+
+    指定providers配置文件时按文件创建（可包含多个提供方与备用端点），
+    否则使用MODEL_CONFIGS中的密钥；密钥可用逗号分隔多个，请求在各密钥间均衡分配，
+    RPM/TPM限额按每个密钥分别计算。
+    """
+    if providers:
+        return ProviderPool.from_config(providers)
+    config = MODEL_CONFIGS[model_type]
+    keys = [key.strip() for key in config["api_key"].split(",") if key.strip()]
+    return ProviderPool([
+        ProviderEndpoint(
+            model_type, key, config.get("base_url"),
+            name=f"{model_type}-{n}",
+            requests_per_minute=config.get("requests_per_minute"),
+            tokens_per_minute=config.get("tokens_per_minute"),
+            mock_options=config.get("mock_options")
+        )
+        for n, key in enumerate(keys, 1)
+    ])
+
+def invalidate_targets(checkpoint: CheckpointStore, targets: List[List[str]]):
+    """按--regenerate删除断点中的产物：步骤名，或chapters加章节范围（省略范围时为全部章节）
+
+    下游产物无需指定，重新生成的内容与原来不同时会因输入指纹变化而自动重新生成。
+    """
+    for target in targets:
+        name, ranges = target[0], target[1:]
+        if name == "chapters":
+            indexes = parse_chapter_ranges(",".join(ranges)) if ranges else checkpoint.chapter_indexes()
+            checkpoint.invalidate_chapters(indexes)
+            logger.info(f"将重新生成第{'、'.join(map(str, indexes))}章")
+        elif name in STORY_STAGES and not ranges:
+            checkpoint.invalidate_stages([name])
+            logger.info(f"将重新生成步骤：{name}")
+        else:
+            raise ValueError(f"无法识别的重新生成目标：{' '.join(target)}"
+                             f"（可选：{', '.join(STORY_STAGES)}，或chapters 17-19）")
+
+
+def log_rebuild_plan(plan: dict):
+    """按状态汇总plan_rebuild的结果，章节以范围表示"""
+    def group(statuses: dict) -> dict:
+        groups = {}
+        for name, status in statuses.items():
+            groups.setdefault(status, []).append(name)
+        return groups
+
+    stages = group(plan["stages"])
+    chapters = group(plan["chapters"])
+    logger.info("重建计划 - 步骤：" + ("；".join(f"{status}：{'、'.join(names)}" for status, names in stages.items())
+                                  or "无"))
+    logger.info("重建计划 - 章节：" + ("；".join(f"{status}：{format_chapter_ranges(indexes)}"
+                                            for status, indexes in chapters.items()) or "梗概需要重新生成"))
+
+
+async def create_sample_story(model_type: str = "puyu", genre: str = "科幻", max_concurrency: int = 1,
+                              synopsis_mode: str = "sequential", resume: Optional[str] = None,
+                              cache: Optional[ResponseCache] = None, retry_strategy: str = "regenerate",
+                              metrics_prom: Optional[str] = None, context_mode: str = "full",
+                              context_budget: int = 3000, record_transcript: Optional[str] = None,
+                              providers: Optional[str] = None, routing: str = "fixed",
+                              routing_stats: Optional[str] = None, container: bool = False,
+                              detect_degeneration: bool = False, check_consistency: bool = False,
+                              regenerate: Optional[List[List[str]]] = None, samples: int = 1,
+                              sample_tier: Optional[str] = None, accept_score: float = 0.8,
+                              outline_shape: Optional[str] = None, max_chapters: Optional[int] = None,
+                              outline_lookahead: int = 1):
+    if regenerate and not resume:
+        raise ValueError("--regenerate需要与--resume一起使用")
+    if resume:
+        # 从已有输出目录的断点继续，沿用当时的模型、题材和提示词
+        if not CheckpointStore.exists(resume):
+            raise ValueError(f"未找到可恢复的断点：{resume}")
+        output_base = resume
+        checkpoint = CheckpointStore(output_base)
+        model_type = checkpoint.meta["model_type"]
+        genre = checkpoint.meta["genre"]
+        prompt = checkpoint.meta["prompt"]
+        creation_time = checkpoint.meta["creation_time"]
+        # 未指定时沿用创建时的大纲形状，只调高--max-chapters即可续写
+        outline_shape = outline_shape or checkpoint.meta.get("outline_shape")
+        logger.info(f"从断点恢复创作：{output_base}")
+        # 输出目录中手工修改的梗概、角色、章节等写回断点，只重新生成受影响的下游部分
+        import_edits(output_base, checkpoint)
+        if regenerate:
+            invalidate_targets(checkpoint, regenerate)
+    else:
+        output_base = None
+
+    if providers:
+        # 使用提供方配置文件时，以其中优先级最高的端点作为模型类型
+        provider_pool = build_provider_pool(model_type, providers)
+        model_type = provider_pool.primary.model_type
+    else:
+        provider_pool = None
+
     # 获取对应的模型配置
     config = MODEL_CONFIGS.get(model_type)
     if not config:
-        raise ValueError(f"不支持的模型类型: {model_type}，请选择 'puyu' 或 'glm'")
+        raise ValueError(f"不支持的模型类型: {model_type}，请选择 'puyu'、'glm' 或 'mock'")
     
-    if not config["api_key"]:
-        raise ValueError(f"请在.env文件中设置{model_type.upper()}_API_KEY")
+    if provider_pool is None:
+        if not config["api_key"]:
+            raise ValueError(f"请在.env文件中设置{model_type.upper()}_API_KEY")
+        provider_pool = build_provider_pool(model_type)
+
+    if output_base is None:
+        # 加载故事提示词
+        prompt = load_story_prompt(genre)
+
+        # 创建输出目录结构
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_base = os.path.join("output", f"story_{model_type}_{timestamp}")
+        creation_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        checkpoint = CheckpointStore(output_base)
+        checkpoint.save_meta({
+            "model_type": model_type,
+            "genre": genre,
+            "prompt": prompt,
+            "creation_time": creation_time,
+            "outline_shape": outline_shape
+        })
+
+    # 每次调用的统计明细写入metrics.jsonl，汇总写入metrics_summary.json
+    sinks = [JsonlSink(os.path.join(output_base, "metrics.jsonl"))]
+    if metrics_prom:
+        sinks.append(PrometheusTextSink(metrics_prom))
+    metrics = MetricsRecorder(sinks)
+    transcript = TranscriptLog(record_transcript) if record_transcript else None
+    # cascade模式下先用低档位起草，统计文件保留各步骤的升级情况供下次运行参考
+    router = TierRouter(path=routing_stats) if routing == "cascade" else None
 
     # 初始化AI代理
     agent = NovelAIAgent(
         api_key=config["api_key"],
-        base_url=config.get("base_url"),
-        model_type=model_type
+        provider_pool=provider_pool,
+        max_concurrency=max_concurrency,
+        synopsis_mode=synopsis_mode,
+        cache=cache,
+        retry_strategy=retry_strategy,
+        metrics=metrics,
+        context_mode=context_mode,
+        context_budget=context_budget,
+        transcript=transcript,
+        router=router,
+        detect_degeneration=detect_degeneration,
+        check_consistency=check_consistency,
+        samples=samples,
+        sample_tier=sample_tier,
+        accept_score=accept_score,
+        outline_shape=outline_shape,
+        max_chapters=max_chapters,
+        outline_lookahead=outline_lookahead
     )
 
-    # 加载故事提示词
-    prompt = load_story_prompt(genre)
+    if resume:
+        log_rebuild_plan(agent.plan_rebuild(prompt, checkpoint))
 
-    # 创建故事
-    story = await agent.create_story(prompt)
-    
-    # 创建输出目录结构
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_base = os.path.join("output", f"story_{model_type}_{timestamp}")
-    os.makedirs(output_base, exist_ok=True)
-    chapters_dir = os.path.join(output_base, "chapters")
-    os.makedirs(chapters_dir, exist_ok=True)
-
-    # 准备元数据
+    # 准备元数据，故事各部分在生成后陆续写入
     meta_info = {
         "model_type": model_type,
         "model_name": config["model"],
-        "creation_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "title": story.get("title", ""),
-        "theme": story.get("themes", []),
-        "setting": story.get("setting", ""),
-        "characters": story.get("characters", ""),
-        "tone": story.get("tone", ""),
-        "outline": story.get("outline", ""),
-        "chapters": story.get("synopses", [])
+        "creation_time": creation_time
     }
+    # 可选的单文件容器，与目录结构同时写入；断点恢复时在已有容器后继续追加
+    novel_container = NovelContainerWriter(os.path.join(output_base, "novel.nvl")) if container else None
+    writer = StoryWriter(output_base, meta_info, novel_container)
 
-    # 保存元数据
-    with open(os.path.join(output_base, "meta.json"), "w", encoding="utf-8") as f:
-        json.dump(meta_info, f, ensure_ascii=False, indent=2)
-
-    # 保存目录结构
-    with open(os.path.join(output_base, "table_of_contents.md"), "w", encoding="utf-8") as f:
-        f.write("# 故事目录\n\n")
-        f.write(story["outline"].split("## 详细大纲")[0])  # 只保存目录部分
-
-    # 保存每章内容
-    if isinstance(story["content"], list):
-        for i, chapter in enumerate(story["content"], 1):
-            chapter_file = os.path.join(chapters_dir, f"chapter_{i:03d}.txt")
-            with open(chapter_file, "w", encoding="utf-8") as f:
-                f.write(chapter)
-    else:
-        logger.error("故事内容格式错误：不是章节列表")
-        # 如果内容不是列表，将整个内容保存为单个文件
-        with open(os.path.join(output_base, "full_story.txt"), "w", encoding="utf-8") as f:
-            f.write(story["content"])
+    # 流式创建故事，每个步骤和章节一生成就写入磁盘；中断后可用--resume继续
+    try:
+        async for event in agent.stream_story(prompt, checkpoint=checkpoint):
+            writer.handle(event)
+    finally:
+        writer.close()
+        metrics.write_summary(os.path.join(output_base, "metrics_summary.json"))
+        metrics.close()
+        if transcript is not None:
+            transcript.close()
+        await provider_pool.close()
 
+    if len(provider_pool.endpoints) > 1:
+        logger.info(f"提供方端点统计：{provider_pool.stats}")
+    if router is not None:
+        logger.info(f"档位路由统计：{router.stats}")
+    if cache is not None:
+        logger.info(f"响应缓存统计：{cache.stats}")
+    logger.info(f"提示词前缀复用统计：{agent.prefix_stats.stats}")
+    if agent.entity_index is not None:
+        # 人物/地点在各章的出现位置与全部一致性问题
+        agent.entity_index.save(os.path.join(output_base, "entity_index.json"))
+        logger.info(f"一致性检查：发现{len(agent.entity_index.issues())}处问题，"
+                    f"索引已写入{os.path.join(output_base, 'entity_index.json')}")
     logger.info(f"故事创作完成，输出目录：{output_base}")
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='AI小说创作工具')
-    parser.add_argument('--model', type=str, choices=['puyu', 'glm'], 
-                       default='puyu', help='选择使用的模型 (puyu 或 glm)')
+    parser.add_argument('--model', type=str, choices=['puyu', 'glm', 'mock'],
+                       default='puyu', help='选择使用的模型 (puyu、glm，或离线模拟的mock)')
     parser.add_argument('--genre', type=str, default='科幻',
                        help='小说题材 (如：科幻、奇幻、悬疑等)')
+    parser.add_argument('--max-concurrency', type=int, default=1,
+                       help='同时生成的章节数 (默认1，逐章生成)')
+    parser.add_argument('--synopsis-mode', type=str, choices=['sequential', 'parallel', 'chained'],
+                       default='sequential',
+                       help='章节梗概生成方式：逐阶段、五阶段并行(延迟最低)、串联上一阶段结尾(衔接最好)')
+    parser.add_argument('--retry-strategy', type=str, choices=['regenerate', 'continue'],
+                       default='regenerate',
+                       help='章节字数不足时重写整章(regenerate)或在草稿基础上续写(continue，更省token)')
+    parser.add_argument('--context-mode', type=str, choices=['full', 'compact'], default='full',
+                       help='章节上下文：完整角色设计(full)或仅本章相关人物、设定与前情回顾(compact)')
+    parser.add_argument('--context-budget', type=int, default=3000,
+                       help='compact模式下章节上下文的token预算 (默认3000)')
+    parser.add_argument('--routing', type=str, choices=ROUTING_MODES, default='fixed',
+                       help='模型档位：固定档位(fixed)或先用低档位起草、未通过质量检查再升级(cascade)')
+    parser.add_argument('--routing-stats', type=str, metavar='PATH',
+                       help='cascade模式下各步骤档位通过率的统计文件，跨多次运行持续学习')
+    parser.add_argument('--detect-degeneration', action='store_true',
+                       help='以流式方式生成章节，文本陷入重复或偏离格式时立即中止并保留之前的部分')
+    parser.add_argument('--check-consistency', action='store_true',
+                       help='每完成一章就检查人物名字漂移、已死亡角色再次出场等问题（不额外调用模型）')
+    parser.add_argument('--samples', type=int, default=1,
+                       help='每章同时请求的候选数，大于1时按本地评分（字数、重复、梗概覆盖、格式）选出最好的一份')
+    parser.add_argument('--sample-tier', type=str, choices=['simple', 'medium', 'complex'], default=None,
+                       help='第一轮候选使用的档位（如simple），不合格重试时恢复原档位')
+    parser.add_argument('--accept-score', type=float, default=0.8,
+                       help='候选通过字数检查且评分达到该值时立即采用，并取消其余候选、停止其生成 (默认0.8)')
+    parser.add_argument('--outline-shape', type=str, metavar='VxAxC',
+                       help='长篇连载的分层大纲：卷数x每卷篇数x每篇章数（如10x5x10共500章），按需逐篇展开梗概')
+    parser.add_argument('--max-chapters', type=int, default=None,
+                       help='分层大纲模式下本次写到第几章，调高后用--resume续写')
+    parser.add_argument('--outline-lookahead', type=int, default=1,
+                       help='分层大纲模式下梗概最多领先正文的篇数 (默认1)')
+    parser.add_argument('--metrics-prom', type=str, metavar='PATH',
+                       help='额外以Prometheus文本格式输出调用统计到指定文件')
+    parser.add_argument('--record-transcript', type=str, metavar='PATH',
+                       help='把每次请求的消息与回复追加写入JSONL文件，可用MOCK_REPLAY回放')
+    parser.add_argument('--providers', type=str, metavar='FILE',
+                       help='提供方配置文件（JSON），可配置多个密钥/端点与备用提供方，格式见providers.example.json')
+    parser.add_argument('--container', action='store_true',
+                       help='同时写入单文件容器novel.nvl（带章节索引，可按章随机读取）')
+    parser.add_argument('--resume', type=str, metavar='DIR',
+                       help='从指定输出目录的断点继续创作，跳过已完成的步骤和章节')
+    parser.add_argument('--regenerate', nargs='+', action='append', metavar='TARGET',
+                       help='与--resume一起使用，重新生成指定的步骤（如characters）或章节（如chapters 17-19），'
+                            '可多次指定；受影响的下游部分随之重新生成，其余直接复用')
+    parser.add_argument('--cache-dir', type=str, default=os.getenv("CACHE_DIR"),
+                       help='响应缓存目录，相同的请求直接复用缓存结果 (默认不启用)')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                       help='缓存有效期（秒），默认永久有效')
+    parser.add_argument('--refresh-cache', action='store_true',
+                       help='不读取缓存，重新请求并刷新缓存内容')
     args = parser.parse_args()
 
     # 在Windows系统上运行异步代码
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl, bypass=args.refresh_cache)
+
     # 运行异步函数
-    asyncio.run(create_sample_story(args.model, args.genre))
+    asyncio.run(create_sample_story(args.model, args.genre, args.max_concurrency, args.synopsis_mode,
+                                    args.resume, cache, args.retry_strategy, args.metrics_prom,
+                                    args.context_mode, args.context_budget, args.record_transcript,
+                                    args.providers, args.routing, args.routing_stats, args.container,
+                                    args.detect_degeneration, args.check_consistency, args.regenerate,
+                                    args.samples, args.sample_tier, args.accept_score,
+                                    args.outline_shape, args.max_chapters, args.outline_lookahead))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
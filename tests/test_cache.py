@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+from src.agent import NovelAIAgent
+from src.cache import ResponseCache
+from src.metrics import MemorySink, MetricsRecorder
+
+MESSAGES = [{"role": "user", "content": "请列出三个主题"}]
+
+
+def test_cache_key_includes_max_tokens(tmp_path):
+    async def run():
+        sink = MemorySink()
+        agent = NovelAIAgent(api_key="mock", model_type="mock", cache=ResponseCache(str(tmp_path)),
+                             metrics=MetricsRecorder([sink]))
+        await agent._call_api(MESSAGES, max_tokens=50)
+        await agent._call_api(MESSAGES, max_tokens=50)
+        # 输出预算不同的请求不复用较小预算下可能被截断的回复
+        await agent._call_api(MESSAGES, max_tokens=500)
+        await agent.close()
+        return [record.cached for record in sink.records]
+
+    assert asyncio.run(run()) == [False, True, False]
+
+
+
+def directory_bytes(directory) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*.json"))
+
+
+def test_evict_skips_entries_deleted_by_another_process(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10 ** 6)
+    for n in range(5):
+        cache.put(f"{n:02d}key", "内容" * 100)
+    # 另一个进程在本进程列出目录之后删除了条目
+    listed = cache._entries()
+    os.remove(listed[0])
+    cache._entries = lambda: listed
+    cache.max_bytes = directory_bytes(tmp_path) // 2
+    cache._evict()
+    assert cache.stats["bytes"] == directory_bytes(tmp_path) <= cache.max_bytes
+
+
+def test_shared_directory_size_is_recomputed_on_evict(tmp_path):
+    first = ResponseCache(str(tmp_path), max_bytes=10 ** 6)
+    second = ResponseCache(str(tmp_path), max_bytes=10 ** 6)
+    for n in range(10):
+        second.put(f"{n:02d}second", "内容" * 100)
+    first.put("00first", "内容" * 100)
+    first.max_bytes = directory_bytes(tmp_path) // 2
+    # first的内存计数不包含second写入的条目，淘汰时按目录重新计算
+    first._evict()
+    assert first.stats["bytes"] == directory_bytes(tmp_path) <= first.max_bytes
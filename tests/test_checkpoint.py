@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from src.agent import NovelAIAgent
+from src.checkpoint import CheckpointStore, format_chapter_ranges, parse_chapter_ranges
+from src.synopsis import parse_synopses, render_synopses
+from src.writer import StoryWriter, import_edits
+
+
+def test_parse_chapter_ranges():
+    assert parse_chapter_ranges("17-19,23") == [17, 18, 19, 23]
+    assert parse_chapter_ranges("5， 3,3-4,") == [3, 4, 5]
+    assert format_chapter_ranges(parse_chapter_ranges("1-3,5,7-8")) == "1-3,5,7-8"
+
+
+@pytest.mark.parametrize("text", ["3-", "-3", "x", "1-y", "5-2", "0"])
+def test_parse_chapter_ranges_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        parse_chapter_ranges(text)
+
+
+def test_stage_and_chapter_status(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    assert store.stage_status("themes", "a") == "missing"
+    store.save_stage("themes", "修仙", fingerprint="a")
+    assert store.stage_status("themes", "a") == "fresh"
+    assert store.stage_status("themes", "b") == "stale"
+
+    store.save_chapter(1, "正文", fingerprint="c")
+    assert store.chapter_status(1, "c") == "fresh"
+    assert store.chapter_status(1, "d") == "stale"
+    assert store.chapter_status(2, "c") == "missing"
+
+    # 重新加载后状态不变；没有记录指纹的旧版断点视为fresh
+    store = CheckpointStore(str(tmp_path))
+    assert store.chapter_status(1, "c") == "fresh"
+    store.save_stage("title", "模拟标题")
+    assert store.stage_status("title", "任意") == "fresh"
+
+
+def test_invalidate_forces_regeneration(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save_stage("characters", "林云", fingerprint="a")
+    store.save_chapter(3, "正文", fingerprint="b")
+    store.invalidate_stages(["characters"])
+    store.invalidate_chapters([3])
+    assert store.stage_status("characters", "a") == "missing" and store.is_forced("stages", "characters")
+    assert not store.has_chapter(3) and store.is_forced("chapters", 3)
+    store.save_chapter(3, "新正文", fingerprint="b")
+    assert not store.is_forced("chapters", 3)
+
+
+def test_synopsis_edit_invalidates_only_that_chapter(tmp_path):
+    output_base = str(tmp_path)
+
+    async def run():
+        checkpoint = CheckpointStore(output_base)
+        agent = NovelAIAgent(api_key="mock", model_type="mock", max_concurrency=50)
+        writer = StoryWriter(output_base)
+        try:
+            async for event in agent.stream_story("修仙小说", checkpoint=checkpoint):
+                writer.handle(event)
+        finally:
+            writer.close()
+            await agent.close()
+        return agent
+
+    agent = asyncio.run(run())
+    checkpoint = CheckpointStore(output_base)
+    plan = agent.plan_rebuild("修仙小说", checkpoint)
+    assert set(plan["stages"].values()) == {"fresh"}
+    assert plan["chapters"] and set(plan["chapters"].values()) == {"fresh"}
+
+    meta_path = os.path.join(output_base, "meta.json")
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    chapters = parse_synopses(meta["chapters"])
+    chapters[2].body += "林云在比武中意外突破。"
+    meta["chapters"] = render_synopses(chapters)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    assert import_edits(output_base, checkpoint) == ["synopses"]
+    plan = agent.plan_rebuild("修仙小说", checkpoint)
+    assert plan["stages"]["synopses"] == "fresh"
+    assert {index for index, status in plan["chapters"].items() if status != "fresh"} == {chapters[2].number}
+    assert plan["chapters"][chapters[2].number] == "stale"
@@ -0,0 +1,65 @@
+from src.container import INDEX_MAGIC, NovelContainerReader, NovelContainerWriter
+
+
+def test_meta_written_once_per_session(tmp_path):
+    path = str(tmp_path / "novel.nvl")
+    for session in range(2):
+        with NovelContainerWriter(path) as writer:
+            # 每个步骤完成时都会更新一次元数据
+            for step in range(10):
+                writer.write_meta({"title": "模拟标题", "step": step})
+                writer.write_chapter(step + 1, f"第{step + 1}章正文" * 100)
+
+    with open(path, "rb") as f:
+        data = f.read()
+    # 第二次会话的元数据与第一次相同，不再追加
+    assert data.count('"title"'.encode("utf-8")) == 1
+    with NovelContainerReader(path) as reader:
+        assert reader.meta == {"title": "模拟标题", "step": 9}
+        assert reader.chapters == list(range(1, 11))
+
+
+def test_killed_run_keeps_meta_from_last_sync(tmp_path):
+    path = str(tmp_path / "novel.nvl")
+    writer = NovelContainerWriter(path)
+    writer.write_meta({"title": "模拟标题"})
+    writer.sync()
+    writer.write_chapter(1, "第1章正文" * 100)
+    writer.write_meta({"title": "模拟标题", "chapters": "梗概"})
+    # 进程被终止：没有调用close，最后一次sync之后的元数据丢失，章节仍可读取
+    writer._file.close()
+
+    with NovelContainerReader(path) as reader:
+        assert reader.meta == {"title": "模拟标题"}
+        assert reader.chapter(1) == "第1章正文" * 100
+
+
+def test_repeated_sync_keeps_a_single_index(tmp_path):
+    path = str(tmp_path / "novel.nvl")
+    with NovelContainerWriter(path) as writer:
+        for step in range(5):
+            writer.write_chapter(step + 1, f"第{step + 1}章正文")
+            writer.sync()
+            writer.sync()
+    with open(path, "rb") as f:
+        assert f.read().count(INDEX_MAGIC) == 1
+    with NovelContainerReader(path) as reader:
+        assert reader.chapters == [1, 2, 3, 4, 5]
+
+
+def test_reopen_compacts_superseded_records(tmp_path):
+    path = str(tmp_path / "novel.nvl")
+    with NovelContainerWriter(path) as writer:
+        for step in range(10):
+            writer.write_meta({"title": "模拟标题", "step": step})
+            writer.write_chapter(1, f"第{step}版正文" * 100)
+            writer.sync()
+    with NovelContainerWriter(path) as writer:
+        assert writer.chapters == [1]
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data.count('"title"'.encode("utf-8")) == 1
+    assert data.count(INDEX_MAGIC) == 1
+    with NovelContainerReader(path) as reader:
+        assert reader.meta == {"title": "模拟标题", "step": 9}
+        assert reader.chapter(1) == "第9版正文" * 100
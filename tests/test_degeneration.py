@@ -0,0 +1,74 @@
+from src.degeneration import DegenerationDetector
+
+PROSE = """清晨的薄雾还没有散去，林云已经背着长剑走出了青云宗的山门。
+山道两旁的松树挂满露水，偶尔有几只灰雀从枝头惊起，扑棱棱地飞向远处的云海。
+他回头望了一眼师父居住的竹楼，心中默念着临行前那句叮嘱：剑在人在，道心不移。
+三天后，他终于看到了天剑城高耸的城墙，城门口排着长长的队伍，商贩和修士混杂在一起。
+守城的士兵懒洋洋地检查着路引，听说他是来参加比武大会的，态度顿时恭敬了几分。
+城中的酒楼早已人满为患，林云只好在城西一家不起眼的客栈落脚，掌柜是个独眼的老头。
+夜里，隔壁房间传来压低的争吵声，似乎有人在讨论某件失窃的宝物，语气急切而慌张。
+林云本不想多管闲事，可当他听到血魔谷三个字时，握着茶杯的手还是微微一顿。
+第二天一早，客栈门外围满了官差，据说城主府昨夜遭了贼，丢失的正是镇城之宝玄冰鉴。
+掌柜把他拉到柜台后面，塞给他一张皱巴巴的纸条，上面只写着一个地址和一个时辰。
+苏瑶是在比武台下第一次见到林云的，那时他正被三名外宗弟子围住，神色却毫不慌乱。
+她注意到这个少年握剑的姿势很特别，拇指压在剑格上，像是随时准备拔剑，又像是在克制。
+比武大会的第一轮抽签结果贴在广场中央的石碑上，林云的对手是北冥海来的一个胖和尚。
+胖和尚的掌法大开大合，每一掌都带着潮水般的回响，台下的看客不住地叫好。
+林云却只守不攻，脚步在擂台边缘游走，直到第三十招时才突然出剑，一剑点中对方手腕。
+"""
+
+LOOP = "他抬头望向远方的天空，心中充满了迷茫和不安。" * 60
+
+
+def feed_in_chunks(detector: DegenerationDetector, text: str, size: int = 37):
+    for start in range(0, len(text), size):
+        reason = detector.feed(text[start:start + size])
+        if reason is not None:
+            return reason
+    return None
+
+
+def test_normal_prose_is_not_flagged():
+    # 缩小窗口，使滚动重复率在这段正文上检查多次
+    detector = DegenerationDetector(window=250)
+    assert len(PROSE) > 2 * detector.window
+    assert feed_in_chunks(detector, PROSE) is None
+    assert detector.salvage() == PROSE
+
+
+def test_rolling_repetition_is_detected_and_salvaged():
+    detector = DegenerationDetector()
+    assert feed_in_chunks(detector, PROSE + LOOP) == "repetition"
+    salvaged = detector.salvage()
+    assert salvaged.startswith(PROSE.rstrip())
+    assert salvaged.count("心中充满了迷茫和不安") <= 2
+    # 检测到退化后不再接收文本
+    assert detector.feed("新的文本") == "repetition"
+
+
+def test_repeated_paragraph_is_detected():
+    paragraph = "林云拔出长剑，剑光如水，映得整座擂台一片雪亮。\n"
+    detector = DegenerationDetector()
+    assert feed_in_chunks(detector, PROSE[:200] + "\n" + paragraph + "台下一片寂静。\n" + paragraph) \
+        == "repeated_paragraph"
+    assert detector.salvage().endswith("台下一片寂静。")
+
+
+def test_short_repeated_lines_are_ignored():
+    detector = DegenerationDetector()
+    assert feed_in_chunks(detector, "“好。”\n林云点了点头。\n“好。”\n……\n……\n") is None
+
+
+def test_format_marker_after_opening_is_detected():
+    detector = DegenerationDetector()
+    text = "第3章：天剑城\n" + PROSE[:300] + "\n第4章：比武\n胖和尚走上擂台。\n"
+    assert feed_in_chunks(detector, text) == "format"
+    # 开头复述的标题不算，截断在下一章标题之前
+    assert detector.salvage().startswith("第3章：天剑城")
+    assert "第4章" not in detector.salvage()
+
+
+def test_threshold_controls_rolling_detection():
+    text = PROSE + "他抬头望向远方。" * 40
+    assert feed_in_chunks(DegenerationDetector(window=300), text) == "repetition"
+    assert feed_in_chunks(DegenerationDetector(window=300, threshold=0.99), text) is None
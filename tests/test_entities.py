@@ -0,0 +1,66 @@
+from src.entities import AhoCorasick, EntityIndex, extract_places
+
+
+def test_aho_corasick_finds_overlapping_matches():
+    matcher = AhoCorasick(["林云", "林云飞", "云飞", "天剑城"])
+    text = "林云飞来到天剑城，林云随后赶到。"
+    assert sorted(matcher.finditer(text)) == [(0, "林云"), (0, "林云飞"), (1, "云飞"), (5, "天剑城"), (9, "林云")]
+    # 不重叠的匹配在同一位置取最长的模式
+    assert matcher.search(text) == [(0, "林云飞"), (5, "天剑城"), (9, "林云")]
+    assert AhoCorasick([]).search(text) == []
+
+
+def test_aho_corasick_matches_brute_force():
+    patterns = ["他", "他们", "们说", "说道", "道理", "理由"]
+    text = "他们说道理由不充分，他说道理他们不懂。"
+    expected = sorted((i, p) for p in patterns for i in range(len(text)) if text.startswith(p, i))
+    assert sorted(AhoCorasick(patterns).finditer(text)) == expected
+
+
+def test_extract_places_skips_common_words():
+    places = extract_places("天剑城位于东荒古域，城外有血魔谷；青云宗的山门在万妖山上。这个世界很大。")
+    assert places[:2] == ["天剑城", "东荒古域"]
+    assert {"血魔谷", "青云宗", "万妖山"} <= set(places)
+    assert "山门" not in places and "世界" not in places
+
+
+def index() -> EntityIndex:
+    return EntityIndex(["林云", "苏瑶", "赵无极"], ["天剑城", "血魔谷"])
+
+
+def test_postings_record_chapters_and_offsets():
+    entities = index()
+    assert entities.add_chapter(2, "苏瑶在天剑城等候。林云赶到天剑城。") == []
+    entities.add_chapter(1, "林云离开青云宗。")
+    assert entities.mentions("林云") == {1: [0], 2: [9]}
+    assert entities.mentions("天剑城") == {2: [3, 13]}
+    # 重新加入同一章时替换之前的索引
+    entities.add_chapter(2, "苏瑶独自离开。")
+    assert entities.mentions("林云") == {1: [0]}
+
+
+def test_dead_character_reappearing_is_reported():
+    entities = index()
+    assert entities.add_chapter(5, "血魔谷一战，赵无极战死，众人悲痛不已。") == []
+    assert entities.add_chapter(6, "众人想起赵无极生前的教诲。") == []
+    issues = entities.add_chapter(7, "赵无极推门而入，笑着向众人打招呼。")
+    assert [(i.kind, i.entity, i.chapter) for i in issues] == [("dead_reappears", "赵无极", 7)]
+    # 已报告的问题不再重复返回
+    assert entities.add_chapter(8, "林云继续赶路。") == []
+    assert len(entities.issues()) == 1
+
+
+def test_negated_death_is_not_a_death():
+    entities = index()
+    entities.add_chapter(1, "赵无极差点战死，幸好林云及时赶到。")
+    assert entities.add_chapter(2, "赵无极养好了伤。") == []
+    assert entities.death_chapters() == {}
+
+
+def test_name_variant_needs_repeated_occurrences():
+    entities = index()
+    assert entities.add_chapter(3, "林芸说：“我们走吧。”") == []
+    issues = entities.add_chapter(4, "林芸道：“天剑城到了。”")
+    assert {(i.kind, i.entity, i.chapter) for i in issues} == {("name_variant", "林云", 3), ("name_variant", "林云", 4)}
+    # 普通词语不视为名字漂移
+    assert entities.add_chapter(5, "林中说话声不断，林中笑声传来。") == []
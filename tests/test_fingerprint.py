@@ -0,0 +1,33 @@
+from src.agent import NovelAIAgent
+from src.synopsis import ChapterSynopsis
+
+PLACES = ["青云宗", "天剑城", "血魔谷", "东荒古域", "万妖山", "北冥海"]
+
+
+def setting_with(edited: str = "") -> str:
+    return "\n\n".join(
+        f"{place}是这个世界的重要地点，{place}的宗门与世家盘根错节，弟子众多，常年与外敌交战。"
+        + ("（新增的设定细节）" if place == edited else "")
+        for place in PLACES
+    )
+
+
+META = {"title": "模拟标题", "themes": ["修仙"], "tone": "热血", "characters": "林云：主角，少年剑修。"}
+CHAPTER = ChapterSynopsis(number=3, title="天剑城", body="林云来到天剑城，参加天剑城的比武大会。", stage="起")
+
+
+def chapter_fingerprint(agent: NovelAIAgent, setting: str) -> str:
+    return agent._chapter_fingerprint(dict(META, setting=setting), CHAPTER)
+
+
+def test_compact_fingerprint_tracks_relevant_setting():
+    agent = NovelAIAgent(api_key="mock", model_type="mock", context_mode="compact", context_budget=120)
+    original = chapter_fingerprint(agent, setting_with())
+    # 本章用到的设定段落改变时失效，与本章无关的段落改变时不受影响
+    assert chapter_fingerprint(agent, setting_with("天剑城")) != original
+    assert chapter_fingerprint(agent, setting_with("北冥海")) == original
+
+
+def test_full_fingerprint_ignores_setting():
+    agent = NovelAIAgent(api_key="mock", model_type="mock")
+    assert chapter_fingerprint(agent, setting_with("天剑城")) == chapter_fingerprint(agent, setting_with())
@@ -0,0 +1,35 @@
+import os
+
+from src.metrics import CallRecord, JsonlSink, PrometheusTextSink
+
+
+def test_jsonl_sink_buffers_until_close(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    sink = JsonlSink(path, flush_interval=3600)
+    for n in range(100):
+        sink.emit(CallRecord(stage="chapters", complexity="medium", model="mock", chapter=n))
+    assert os.path.getsize(path) == 0
+    sink.close()
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 100
+
+
+def test_jsonl_sink_flushes_after_interval(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    sink = JsonlSink(path, flush_interval=0)
+    sink.emit(CallRecord(stage="chapters", complexity="medium", model="mock"))
+    assert os.path.getsize(path) > 0
+    sink.close()
+
+
+def test_prometheus_sink_writes_final_counts_at_close(tmp_path):
+    path = str(tmp_path / "novel.prom")
+    sink = PrometheusTextSink(path, flush_interval=3600)
+    for _ in range(3):
+        sink.emit(CallRecord(stage="chapters", complexity="medium", model="mock", completion_tokens=10))
+    assert not os.path.exists(path)
+    sink.close()
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    assert 'novel_llm_calls_total{stage="chapters",model="mock"} 3' in text
+    assert 'novel_llm_completion_tokens_total{stage="chapters",model="mock"} 30' in text
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from src.agent import NovelAIAgent
+from src.outline import OutlineShape
+from src.synopsis import ChapterSynopsis, SynopsisFeed
+
+
+def test_outline_shape_locates_chapters():
+    shape = OutlineShape.parse("2x3x4")
+    assert shape.total_chapters == 24
+    assert shape.arc_chapters(2, 1) == range(13, 17)
+    assert shape.locate(13) == (2, 1)
+
+
+def test_feed_abort_wakes_waiters():
+    async def run():
+        feed = SynopsisFeed()
+        feed.put(ChapterSynopsis(1, "", "梗概", "第1卷第1篇"))
+        waiter = asyncio.ensure_future(feed.wait_done(5))
+        chapters = []
+
+        async def consume():
+            async for chapter in feed:
+                chapters.append(chapter.number)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        feed.abort(RuntimeError("章节失败"))
+        for task in (waiter, consumer):
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(task, 1.0)
+        assert chapters == [1]
+
+    asyncio.run(run())
+
+
+def test_chapter_failure_does_not_hang_outline_expansion():
+    async def run():
+        agent = NovelAIAgent(api_key="mock", model_type="mock", outline_shape="2x2x3", max_concurrency=4)
+
+        async def failing_chapter(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            raise RuntimeError("章节生成失败")
+
+        agent._generate_single_chapter = failing_chapter
+        try:
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(agent.create_story("写一部修仙小说"), 5.0)
+        finally:
+            await agent.close()
+
+    asyncio.run(run())
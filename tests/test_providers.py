@@ -0,0 +1,239 @@
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+from typing import Dict, Iterator, List
+
+import pytest
+
+from src.agent import REQUIRED_WORDS, NovelAIAgent
+from src.mock_provider import mock_reply
+from src.prompts import get_chapter_content_messages
+from src.provider_registry import ProviderPlugin, register_provider
+from src.providers import CircuitBreaker, ProviderEndpoint, ProviderPool
+
+
+def half_open_pool(latency: float):
+    """主端点刚熔断且已冷却（半开），备用端点优先级较低"""
+    primary = ProviderEndpoint("mock", "mock-primary", name="primary", mock_options={"latency": latency},
+                               breaker=CircuitBreaker(min_calls=1, cooldown=0.05))
+    backup = ProviderEndpoint("mock", "mock-backup", name="backup", priority=1)
+    pool = ProviderPool([primary, backup])
+    pool.report(primary, success=False)
+    assert primary.breaker.state == "open"
+    time.sleep(0.06)
+    assert primary.breaker.state == "half_open"
+    return pool, primary
+
+
+def test_cancelled_half_open_probe_is_released():
+    async def run():
+        pool, primary = half_open_pool(latency=5.0)
+        agent = NovelAIAgent(api_key="mock", provider_pool=pool)
+        task = asyncio.ensure_future(agent._call_api([{"role": "user", "content": "你好"}]))
+        await asyncio.sleep(0.05)
+        # 试探请求进行中，不再放行第二个
+        assert not primary.breaker.allow()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # 取消不计入失败：仍为半开，可以再次试探
+        assert primary.breaker.state == "half_open"
+        assert pool.select() is primary
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_completed_half_open_probe_closes_breaker():
+    async def run():
+        pool, primary = half_open_pool(latency=0.0)
+        agent = NovelAIAgent(api_key="mock", provider_pool=pool)
+        await agent._call_api([{"role": "user", "content": "你好"}])
+        assert primary.breaker.state == "closed"
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_best_of_n_cancelling_probe_keeps_endpoint_selectable():
+    async def run():
+        # 第一份候选成为主端点的试探请求且很慢，备用端点上的候选先合格，试探随之被取消
+        pool, primary = half_open_pool(latency=5.0)
+        agent = NovelAIAgent(api_key="mock", provider_pool=pool, samples=3, accept_score=0.5)
+        synopsis = "林云来到天剑城，参加比武大会。"
+        messages = get_chapter_content_messages(
+            {"title": "模拟标题", "themes": ["修仙"], "characters": "林云：主角。"},
+            "第1章：天剑城", synopsis, REQUIRED_WORDS
+        )
+        started = time.perf_counter()
+        text, score = await agent._request_best_chapter(messages, 1, synopsis, use_cache=False)
+        assert score.passed and time.perf_counter() - started < 2.0
+        assert primary.breaker.state == "half_open"
+        assert primary.in_flight == 0
+        assert pool.select() is primary
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_all_open_waits_for_earliest_cooldown():
+    async def run():
+        slow = ProviderEndpoint("mock", "mock-slow", name="slow", breaker=CircuitBreaker(min_calls=1, cooldown=5.0))
+        fast = ProviderEndpoint("mock", "mock-fast", name="fast", priority=1,
+                                breaker=CircuitBreaker(min_calls=1, cooldown=0.2))
+        pool = ProviderPool([slow, fast])
+        pool.report(slow, success=False)
+        pool.report(fast, success=False)
+        assert pool.select() is None
+        assert 0.1 < pool.wait_time() <= 0.2
+
+        agent = NovelAIAgent(api_key="mock", provider_pool=pool)
+        started = time.perf_counter()
+        await agent._call_api([{"role": "user", "content": "你好"}])
+        # 不向熔断中的端点发请求：等到fast冷却结束，由它的试探请求回答
+        assert time.perf_counter() - started >= 0.15
+        assert (slow.calls, fast.calls) == (1, 2)
+        assert fast.breaker.state == "closed" and slow.breaker.state == "open"
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_waits_for_half_open_probe_to_finish():
+    async def run():
+        pool, primary = half_open_pool(latency=0.0)
+        backup = pool.endpoints[1]
+        for _ in range(backup.breaker.min_calls):
+            pool.report(backup, success=False)
+        assert backup.breaker.state == "open"
+        assert pool.select() is primary
+        # 试探请求进行中，其他请求等待试探结果而不是发往熔断中的端点
+        assert pool.select() is None and pool.wait_time() > 0
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        pool.report(primary, success=True)
+        assert await asyncio.wait_for(waiter, 1.0) is primary
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_missing_sdk_names_the_package(monkeypatch):
+    # sys.modules中为None的模块导入时抛出ImportError，模拟未安装智谱SDK
+    monkeypatch.setitem(sys.modules, "zhipuai", None)
+    with pytest.raises(ImportError, match="pip install zhipuai"):
+        ProviderEndpoint("glm", "glm-key")
+
+
+def chunk(text: str) -> SimpleNamespace:
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class CandidateStreams:
+    """第一个请求立即生成完，其余请求每块间隔interval秒；记录各个流产出的块数和是否被关闭"""
+
+    def __init__(self, interval: float = 0.02, size: int = 50):
+        self.interval = interval
+        self.size = size
+        self.produced: List[int] = []
+        self.closed: List[bool] = []
+
+    def chunks(self, n: int, messages: List[Dict]) -> Iterator[str]:
+        content = mock_reply(messages)
+        for start in range(0, len(content), self.size):
+            if self.closed[n]:
+                return
+            self.produced[n] += 1
+            yield content[start:start + self.size]
+
+    def open(self, messages: List[Dict]) -> int:
+        self.produced.append(0)
+        self.closed.append(False)
+        return len(self.produced) - 1
+
+
+class AsyncStream:
+    def __init__(self, streams: CandidateStreams, n: int, messages: List[Dict]):
+        self.streams, self.n, self._chunks = streams, n, streams.chunks(n, messages)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.n > 0:
+            await asyncio.sleep(self.streams.interval)
+        text = next(self._chunks, None)
+        if text is None:
+            raise StopAsyncIteration
+        return chunk(text)
+
+    async def aclose(self):
+        self.streams.closed[self.n] = True
+
+
+class SyncStream:
+    """同步SDK的流：在线程中逐块读取，close可以在其他线程调用"""
+
+    def __init__(self, streams: CandidateStreams, n: int, messages: List[Dict]):
+        self.streams, self.n, self._chunks = streams, n, streams.chunks(n, messages)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.n > 0:
+            time.sleep(self.streams.interval)
+        text = next(self._chunks, None)
+        if text is None:
+            raise StopIteration
+        return chunk(text)
+
+    def close(self):
+        self.streams.closed[self.n] = True
+
+
+def candidate_client(streams: CandidateStreams, is_async: bool):
+    def create(model, messages, stream=False, **kwargs):
+        assert stream, "候选应以流式方式请求"
+        n = streams.open(messages)
+        return (AsyncStream if is_async else SyncStream)(streams, n, messages)
+
+    async def create_async(**kwargs):
+        return create(**kwargs)
+
+    async def close_async():
+        pass
+
+    completions = SimpleNamespace(create=create_async if is_async else create)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions),
+                           close=close_async if is_async else (lambda: None))
+
+
+@pytest.mark.parametrize("is_async", [True, False])
+def test_cancelled_candidate_stops_receiving_tokens(is_async):
+    async def run():
+        streams = CandidateStreams()
+        name = f"candidates-{'async' if is_async else 'sync'}"
+        register_provider(ProviderPlugin(name, {"complex": "m", "medium": "m", "simple": "m"},
+                                         lambda *args, **kwargs: candidate_client(streams, is_async),
+                                         is_async=is_async), replace=True)
+        pool = ProviderPool([ProviderEndpoint(name, "candidate-key")])
+        agent = NovelAIAgent(api_key="mock", provider_pool=pool, samples=3, accept_score=0.5)
+        synopsis = "林云来到天剑城，参加比武大会。"
+        messages = get_chapter_content_messages(
+            {"title": "模拟标题", "themes": ["修仙"], "characters": "林云：主角。"},
+            "第1章：天剑城", synopsis, REQUIRED_WORDS
+        )
+        text, score = await agent._request_best_chapter(messages, 1, synopsis, use_cache=False)
+        assert score.passed and len(streams.produced) == 3
+        produced = list(streams.produced)
+        await asyncio.sleep(10 * streams.interval)
+        # 其余候选的流已关闭，之后不再产出任何内容
+        assert streams.closed[1:] == [True, True]
+        assert streams.produced == produced
+        assert all(count < produced[0] for count in produced[1:])
+        await pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from src.scheduler import Stage, StageGraph
+
+
+def stage(name, *inputs, delay=0.0, log=None, fail=False):
+    async def run(values):
+        if log is not None:
+            log.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(name)
+        return name + "(" + ",".join(str(values[dep]) for dep in inputs) + ")"
+    return Stage(name, inputs, run)
+
+
+def test_order_is_topological():
+    graph = StageGraph([stage("chapters", "synopses"), stage("synopses", "titles", "characters"),
+                        stage("titles", "prompt"), stage("characters", "prompt")])
+    order = graph.order({"prompt": "p"})
+    for name, deps in (("chapters", ["synopses"]), ("synopses", ["titles", "characters"])):
+        assert all(order.index(dep) < order.index(name) for dep in deps)
+
+
+def test_cycle_and_unknown_input_are_rejected():
+    with pytest.raises(ValueError, match="循环依赖"):
+        StageGraph([stage("a", "b"), stage("b", "a")]).order({})
+    with pytest.raises(ValueError, match="既不是步骤也不是初始值"):
+        StageGraph([stage("a", "missing")]).order({"prompt": "p"})
+    with pytest.raises(ValueError, match="重名"):
+        StageGraph([stage("a"), stage("a")])
+
+
+def test_run_passes_results_to_dependents():
+    graph = StageGraph([stage("titles", "prompt"), stage("characters", "prompt"),
+                        stage("synopses", "titles", "characters")])
+    results = asyncio.run(graph.run({"prompt": "p"}))
+    assert results["synopses"] == "synopses(titles(p),characters(p))"
+
+
+def test_failed_stage_skips_dependents():
+    log = []
+    graph = StageGraph([stage("titles", "prompt", log=log, fail=True),
+                        stage("synopses", "titles", log=log),
+                        stage("chapters", "synopses", log=log)])
+    with pytest.raises(RuntimeError, match="titles"):
+        asyncio.run(graph.run({"prompt": "p"}))
+    assert log == ["titles"]
+    assert "synopses" not in graph.timings
+
+
+def test_independent_stages_overlap_and_critical_path():
+    graph = StageGraph([stage("themes", "prompt", delay=0.01), stage("titles", "themes", delay=0.01),
+                        stage("characters", "themes", delay=0.1),
+                        stage("synopses", "titles", "characters", delay=0.01)])
+    asyncio.run(graph.run({"prompt": "p"}))
+    titles, characters = graph.timings["titles"], graph.timings["characters"]
+    assert titles[0] < characters[1] and characters[0] < titles[1]
+    assert graph.critical_path() == ["themes", "characters", "synopses"]
+    assert StageGraph([stage("a")]).critical_path() == []
@@ -0,0 +1,33 @@
+import asyncio
+from collections import Counter
+
+from src.agent import NovelAIAgent
+from src.service import TERMINAL_STATUSES, GenerationService
+
+
+def test_cancel_then_resume_runs_job_once(tmp_path):
+    runs = Counter()
+
+    def create_agent(job, **shared):
+        runs[job.job_id] += 1
+        return NovelAIAgent(api_key="mock", model_type="mock", max_concurrency=50, **shared)
+
+    async def run():
+        service = GenerationService(str(tmp_path), create_agent, lambda genre: f"{genre}小说", ["mock"], jobs=2)
+        await service.start()
+        # 排队期间取消又恢复，任务仍在队列中
+        job_id = service.submit("修仙", "mock")["job_id"]
+        assert service.cancel(job_id)["status"] == "cancelled"
+        assert service.resume(job_id)["status"] == "pending"
+        try:
+            while service.progress[job_id].status not in TERMINAL_STATUSES:
+                await asyncio.sleep(0.05)
+            # 等待第二个worker可能重复启动的运行
+            await asyncio.sleep(0.2)
+        finally:
+            await service.stop()
+        return service.progress[job_id].status, job_id
+
+    status, job_id = asyncio.run(run())
+    assert status == "done"
+    assert runs[job_id] == 1
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from src.synopsis import (ChapterSynopsis, SynopsisFeed, SynopsisStreamParser, parse_chapter_number,
+                          parse_synopses, render_synopses)
+
+TEXT = """【第1章：初入山门】
+林云拜入青云宗，成为外门弟子。
+
+[第二章] 试炼
+外门试炼中林云结识苏瑶。
+
+**第3章：秘境**
+秘境开启，林云获得古剑。
+"""
+
+
+def feed_in_chunks(parser: SynopsisStreamParser, text: str, size: int):
+    chapters = []
+    for start in range(0, len(text), size):
+        chapters.extend(parser.feed(text[start:start + size]))
+    return chapters + parser.finish()
+
+
+def test_parse_chapter_number():
+    assert parse_chapter_number("12") == 12
+    assert parse_chapter_number("１２") == 12
+    assert parse_chapter_number("十二") == 12
+    assert parse_chapter_number("一百零三") == 103
+    assert parse_chapter_number("第") is None
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(TEXT)])
+def test_stream_parser_across_chunk_boundaries(size):
+    chapters = feed_in_chunks(SynopsisStreamParser(range(1, 4)), TEXT, size)
+    assert [(c.number, c.title) for c in chapters] == [(1, "初入山门"), (2, "试炼"), (3, "秘境")]
+    assert chapters[1].body == "外门试炼中林云结识苏瑶。"
+
+
+def test_stream_parser_emits_a_chapter_once_the_next_header_arrives():
+    parser = SynopsisStreamParser()
+    assert parser.feed("【第1章：初入山门】\n林云拜入青云宗") == []
+    assert parser.feed("，成为外门弟子。\n") == []
+    chapters = parser.feed("【第2章：试炼】\n外门")
+    assert [c.number for c in chapters] == [1]
+    assert chapters[0].body == "林云拜入青云宗，成为外门弟子。"
+    assert [c.number for c in parser.finish()] == [2]
+
+
+def test_stage_relative_numbers_are_offset():
+    parser = SynopsisStreamParser(range(11, 21))
+    chapters = parser.feed("【第1章：下山】\n林云下山历练。\n【第2章：入城】\n林云来到天剑城。\n") + parser.finish()
+    assert [c.number for c in chapters] == [11, 12]
+    assert chapters[0].stage == "承"
+    assert parser.missing() == list(range(13, 21))
+
+
+def test_malformed_duplicate_and_empty_chapters_are_dropped():
+    text = ("【第1章：开端】\n正文一。\n【第1章：重复】\n重复的正文。\n【第2章：空】\n\n"
+            "【第99章：越界】\n越界的正文。\n【第三章：结尾】\n正文三。\n")
+    chapters = parse_synopses(text, range(1, 4))
+    assert [(c.number, c.title) for c in chapters] == [(1, "开端"), (3, "结尾")]
+    assert SynopsisStreamParser(range(1, 4)).missing() == [1, 2, 3]
+
+
+def test_render_round_trips():
+    chapters = parse_synopses(TEXT)
+    assert parse_synopses(render_synopses(reversed(chapters))) == chapters
+
+
+def chapter(number: int) -> ChapterSynopsis:
+    return ChapterSynopsis(number=number, title=f"标题{number}", body="梗概", stage="起")
+
+
+def test_feed_delivers_each_chapter_once_in_order():
+    async def run():
+        feed = SynopsisFeed.from_chapters([chapter(1), chapter(2), chapter(1), chapter(3)])
+        return [c.number async for c in feed]
+
+    assert asyncio.run(run()) == [1, 2, 3]
+
+
+def test_feed_wait_done_returns_after_enough_chapters():
+    async def run():
+        feed = SynopsisFeed()
+        await asyncio.wait_for(feed.wait_done(0), 0.1)
+        waiter = asyncio.ensure_future(feed.wait_done(2))
+        feed.mark_done(1)
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        feed.mark_done(2)
+        await asyncio.wait_for(waiter, 0.1)
+
+    asyncio.run(run())
+
+
+def test_feed_abort_stops_iteration_and_keeps_first_error():
+    async def run():
+        feed = SynopsisFeed()
+        feed.put(chapter(1))
+        received = []
+
+        async def consume():
+            async for c in feed:
+                received.append(c.number)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        feed.abort(RuntimeError("第一次"))
+        feed.abort(ValueError("第二次"))
+        feed.put(chapter(2))
+        with pytest.raises(RuntimeError, match="第一次"):
+            await asyncio.wait_for(consumer, 0.1)
+        with pytest.raises(RuntimeError, match="第一次"):
+            await asyncio.wait_for(feed.wait_done(1), 0.1)
+        assert received == [1]
+
+    asyncio.run(run())